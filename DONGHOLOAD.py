@@ -1,11 +1,15 @@
-from pymodbus.client.sync   import ModbusTcpClient
+from concurrent.futures import ThreadPoolExecutor, wait
 import datetime
+import math
 import time
 import sys
 import io
+import logging
 
-# Đặt mã hóa của đầu ra console là utf-8
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+from pymodbus.exceptions import ConnectionException, ModbusIOException
+
+from modbus_pool import ModbusConnectionPool
+from setpoint_writer import SetpointWriter
 
 # Giới hạn dung lượng pin và thời gian xả
 DISCHARGE_START = 18  # Giờ bắt đầu xả
@@ -36,43 +40,123 @@ BESS_DISCHARGE_CMD = 104  # Lệnh xả BESS (0: Tắt, 1: Bật)
 BESS_CHARGE_CMD = 105  # Lệnh sạc BESS (0: Tắt, 1: Bật)
 BESS_CHARGE_POWER_REG = 106  # Công suất sạc tối đa vào BESS (kW)
 
+# Đọc/ghi song song cho dàn inverter lớn
+MAX_PARALLEL_DEVICES = 32  # Số inverter được truy vấn cùng lúc
+DEVICE_TIMEOUT = 2  # Hạn chót cứng mỗi request Modbus (giây)
+FAN_OUT_TIMEOUT = 2 * DEVICE_TIMEOUT  # Mỗi đợt MAX_PARALLEL_DEVICES inverter: kết nối + request (giây)
+# Inverter không phản hồi bị ngắt mạch (modbus_pool.CircuitBreaker): các lượt quét sau bỏ
+# qua nó ngay, chỉ thử lại sau thời gian nghỉ tăng dần tới BREAKER_MAX_BACKOFF giây
+BREAKER_MAX_BACKOFF = 60
+
+# Chống ghi lặp lệnh: deadband (kW) và khoảng cách ghi tối thiểu (giây) theo thanh ghi
+SETPOINT_DEADBAND = {INVERTER_POWER_CMD: 1, BESS_CHARGE_POWER_REG: 1}
+SETPOINT_MIN_INTERVAL = {INVERTER_POWER_CMD: 5}
+
 # Hàm kiểm tra thời gian xả
 def is_within_timer(start_hour, end_hour):
     now = datetime.datetime.now()
     return start_hour <= now.hour or now.hour < end_hour
 
+# Báo kết quả request cho ngắt mạch của thiết bị: không phản hồi là lỗi
+def record_result(client, result):
+    if isinstance(result, ModbusIOException):
+        modbus_pool.failed(client)
+    else:
+        modbus_pool.succeeded(client)
+
 # Hàm đọc giá trị từ Modbus
 def read_register(client, register, count=1):
+    if not modbus_pool.allow(client):
+        print(f"Bỏ qua {client.host}: đang ngắt mạch.")
+        return None
     try:
         result = client.read_holding_registers(register, count, unit=LOAD_METER_UNIT_ID)
+        record_result(client, result)
         if result.isError():
             print(f"Không thể đọc thanh ghi {register}")
             return None
         return result.registers[0]
     except Exception as e:
+        if isinstance(e, ConnectionException):
+            modbus_pool.failed(client)
         print(f"Lỗi khi đọc thanh ghi {register}: {e}")
         return None
 
 # Hàm ghi giá trị vào Modbus
 def write_register(client, register, value):
+    if not modbus_pool.allow(client):
+        print(f"Bỏ qua {client.host}: đang ngắt mạch.")
+        return False
     try:
         value = round(value)
         result = client.write_register(register, value, unit=LOAD_METER_UNIT_ID)
+        record_result(client, result)
         if result.isError():
             print(f"Không thể ghi vào thanh ghi {register}")
-        else:
-            print(f"Ghi thành công {value} vào thanh ghi {register}")
+            return False
+        print(f"Ghi thành công {value} vào thanh ghi {register}")
+        return True
     except Exception as e:
+        if isinstance(e, ConnectionException):
+            modbus_pool.failed(client)
         print(f"Loi khi ghi vào thanh ghi {register}: {e}")
-
-# Hàm kết nối với inverter hoặc BESS qua TCP
+        return False
+
+modbus_pool = ModbusConnectionPool(
+    port=MODBUS_TCP_PORT, timeout=DEVICE_TIMEOUT, backoff_max=BREAKER_MAX_BACKOFF
+)
+executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_DEVICES)
+setpoint_writer = SetpointWriter(
+    write_register, deadband=SETPOINT_DEADBAND, min_interval=SETPOINT_MIN_INTERVAL
+)
+
+# Hàm kết nối với inverter hoặc BESS qua TCP (giữ kết nối trong pool)
+# Trả về None ngay khi thiết bị đang ngắt mạch
 def connect_modbus_device(ip):
-    client = ModbusTcpClient(ip, port=MODBUS_TCP_PORT)
-    if not client.connect():
+    client = modbus_pool.get(ip)
+    if not client:
         print(f"Không thể kết nối với {ip}.")
-        return None
     return client
 
+# Chạy func(ip, *args) song song cho mọi IP, trả về {ip: kết quả}
+# Pool chỉ chạy MAX_PARALLEL_DEVICES thiết bị cùng lúc, thiết bị xếp hàng phải chờ các đợt
+# trước: hạn chót tính theo số đợt để inverter khỏe không bị hủy vì inverter im lặng
+# Thiết bị không trả lời trong hạn chót được tính là None
+def fan_out(func, ips, *args):
+    futures = {executor.submit(func, ip, *args): ip for ip in ips}
+    waves = math.ceil(len(futures) / MAX_PARALLEL_DEVICES)
+    done, not_done = wait(futures, timeout=waves * FAN_OUT_TIMEOUT)
+    results = {}
+    for future, ip in futures.items():
+        if future in done:
+            results[ip] = future.result()
+        else:
+            future.cancel()
+            print(f"Hết thời gian chờ {ip}.")
+            results[ip] = None
+    return results
+
+# Đọc công suất một inverter
+def read_inverter_power(ip):
+    inverter_client = connect_modbus_device(ip)
+    if not inverter_client:
+        return None
+    return read_register(inverter_client, SOLAR_POWER_REG)
+
+# Ghi lệnh giới hạn công suất cho một inverter
+def write_inverter_power(ip, power):
+    inverter_client = connect_modbus_device(ip)
+    if not inverter_client:
+        return False
+    return setpoint_writer.write(inverter_client, INVERTER_POWER_CMD, round(power))
+
+# Gửi lệnh giới hạn công suất tới tất cả inverter cùng lúc
+def broadcast_inverter_power(ips, power):
+    results = fan_out(write_inverter_power, ips, power)
+    acked = sum(1 for ok in results.values() if ok)
+    print(f"Đã ghi giới hạn công suất cho {acked}/{len(ips)} inverter.")
+    return results
+
 # Hàm đọc công suất và SOC từ BESS
 def read_bess_data():
     bess_client = connect_modbus_device(BESS_IP)
@@ -82,91 +166,88 @@ def read_bess_data():
     bess_power = read_register(bess_client, BESS_POWER_REG)
     bess_soc = read_register(bess_client, BESS_SOC_REG)
     bess_charge_power = read_register(bess_client, BESS_CHARGE_POWER_REG)
-    bess_client.close()
 
     return bess_power, bess_soc, bess_charge_power
 
-# Khởi động quản lý năng lượng
-print("Bat dau quan ly nang luong..")
-load_meter_client = connect_modbus_device(LOAD_METER_IP)
+if __name__ == "__main__":
+    # Đặt mã hóa của đầu ra console là utf-8
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    # In log của pool kết nối / lớp ghi lệnh ra console
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(logging.Formatter("%(message)s"))
+    logging.getLogger("my_logger").addHandler(console_handler)
+    logging.getLogger("my_logger").setLevel(logging.INFO)
 
-if not load_meter_client:
-    exit("Không thể kết nối với đồng hồ đo tải qua Modbus TCP.")
+    # Khởi động quản lý năng lượng
+    print("Bat dau quan ly nang luong..")
+    load_meter_client = connect_modbus_device(LOAD_METER_IP)
 
-try:
-    while True:
-        load_consumption = read_register(load_meter_client, LOAD_CONSUMPTION_REG)
-        if load_consumption is None:
-            time.sleep(5)
-            continue
-
-        total_solar_production = 0
-        working_inverters = []
-
-        for ip in INVERTER_IPS:
-            inverter_client = connect_modbus_device(ip)
-            if inverter_client:
-                solar_power = read_register(inverter_client, SOLAR_POWER_REG)
-                if solar_power is not None:
-                    total_solar_production += solar_power
-                    working_inverters.append(inverter_client)
-                else:
-                    inverter_client.close()
+    if not load_meter_client:
+        exit("Không thể kết nối với đồng hồ đo tải qua Modbus TCP.")
 
-        bess_power, bess_soc, bess_charge_power = read_bess_data()
-        if bess_power is None or bess_soc is None or bess_charge_power is None:
-            time.sleep(5)
-            continue
-
-        print(f"Solar: {total_solar_production} kW, Load: {load_consumption} kW, "
-              f"BESS Power: {bess_power} kW, SOC: {bess_soc}%, Charge Power: {bess_charge_power} kW")
-
-        if total_solar_production < load_consumption:
-            deficit = load_consumption - total_solar_production
-            inverter_count = len(working_inverters)
-
-            if inverter_count > 0:
-                power_per_inverter = min(total_solar_production / inverter_count, 100)
-                for inverter_client in working_inverters:
-                    write_register(inverter_client, INVERTER_POWER_CMD, power_per_inverter)
-                    inverter_client.close()
-
-            if is_within_timer(DISCHARGE_START, DISCHARGE_END) and bess_soc > 10:
-                discharge_power = min(deficit, bess_power)
-                bess_client = connect_modbus_device(BESS_IP)
-                if bess_client:
-                    write_register(bess_client, BESS_DISCHARGE_CMD, 1)
-                    write_register(bess_client, BESS_POWER_REG, discharge_power)
-                    bess_client.close()
-            else:
-                print("Bổ sung tải bằng lưới điện.")
-        else:
-            excess_energy = total_solar_production - load_consumption
-            if bess_soc < 90 and excess_energy <= bess_charge_power:
-                charge_power = excess_energy
-                bess_client = connect_modbus_device(BESS_IP)
-                if bess_client:
-                    write_register(bess_client, BESS_DISCHARGE_CMD, 0)
-                    write_register(bess_client, BESS_CHARGE_CMD, 1)
-                    write_register(bess_client, BESS_CHARGE_POWER_REG, charge_power)
-                    print(f"Sạc BESS với công suất: {charge_power} kW.")
-                    bess_client.close()
+    try:
+        while True:
+            load_consumption = read_register(load_meter_client, LOAD_CONSUMPTION_REG)
+            if load_consumption is None:
+                time.sleep(5)
+                continue
+
+            solar_powers = fan_out(read_inverter_power, INVERTER_IPS)
+            working_inverters = [
+                ip for ip, solar_power in solar_powers.items() if solar_power is not None
+            ]
+            total_solar_production = sum(solar_powers[ip] for ip in working_inverters)
+
+            bess_power, bess_soc, bess_charge_power = read_bess_data()
+            if bess_power is None or bess_soc is None or bess_charge_power is None:
+                time.sleep(5)
+                continue
+
+            print(f"Solar: {total_solar_production} kW, Load: {load_consumption} kW, "
+                  f"BESS Power: {bess_power} kW, SOC: {bess_soc}%, Charge Power: {bess_charge_power} kW")
+
+            if total_solar_production < load_consumption:
+                deficit = load_consumption - total_solar_production
+                inverter_count = len(working_inverters)
+
+                if inverter_count > 0:
+                    power_per_inverter = min(total_solar_production / inverter_count, 100)
+                    broadcast_inverter_power(working_inverters, power_per_inverter)
+
+                if is_within_timer(DISCHARGE_START, DISCHARGE_END) and bess_soc > 10:
+                    discharge_power = min(deficit, bess_power)
+                    bess_client = connect_modbus_device(BESS_IP)
+                    if bess_client:
+                        setpoint_writer.write(bess_client, BESS_DISCHARGE_CMD, 1)
+                        setpoint_writer.write(bess_client, BESS_POWER_REG, round(discharge_power))
+                else:
+                    print("Bổ sung tải bằng lưới điện.")
             else:
-                print("pin đã đầy hoặc công suất sạc vượt quá khả năng của BESS, kích hoạt Zero Export.")
-                inverter_count=len(INVERTER_IPS)
-                if bess_soc < 90 :
-                    power_per_inverter=(load_consumption + bess_charge_power)/inverter_count
+                excess_energy = total_solar_production - load_consumption
+                if bess_soc < 90 and excess_energy <= bess_charge_power:
+                    charge_power = excess_energy
+                    bess_client = connect_modbus_device(BESS_IP)
+                    if bess_client:
+                        setpoint_writer.write(bess_client, BESS_DISCHARGE_CMD, 0)
+                        setpoint_writer.write(bess_client, BESS_CHARGE_CMD, 1)
+                        setpoint_writer.write(bess_client, BESS_CHARGE_POWER_REG, round(charge_power))
+                        print(f"Sạc BESS với công suất: {charge_power} kW.")
                 else:
-                    power_per_inverter=load_consumption/inverter_count
-                for ip in INVERTER_IPS:
-                    inverter_client=connect_modbus_device(ip)
-                    if inverter_client :
-                        write_register= inverter_client, INVERTER_POWER_CMD, power_per_inverter
-                        inverter_client.close()
-                
-        time.sleep(5)
-
-except KeyboardInterrupt:
-    print("Dừng hệ thống...")
-finally:
-    load_meter_client.close()
+                    print("pin đã đầy hoặc công suất sạc vượt quá khả năng của BESS, kích hoạt Zero Export.")
+                    # Chỉ chia công suất cho các inverter đang phản hồi trong chu kỳ này
+                    inverter_count=len(working_inverters)
+                    if inverter_count > 0:
+                        if bess_soc < 90 :
+                            power_per_inverter=(load_consumption + bess_charge_power)/inverter_count
+                        else:
+                            power_per_inverter=load_consumption/inverter_count
+                        broadcast_inverter_power(working_inverters, power_per_inverter)
+
+            time.sleep(5)
+
+    except KeyboardInterrupt:
+        print("Dừng hệ thống...")
+        setpoint_writer.report()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        modbus_pool.close_all()
@@ -0,0 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger("my_logger")
+
+
+# 📡 Đọc đồng thời tất cả thiết bị trong một chu kỳ, gộp thành một snapshot
+# readers: danh sách hàm đọc, mỗi hàm đọc một thiết bị và trả về {tên: giá trị}
+# Mỗi thiết bị chạy trên socket riêng của pool nên thời gian chu kỳ chỉ bằng thiết bị chậm nhất
+class AsyncPoller:
+    def __init__(self, readers):
+        self.readers = list(readers)
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(
+            ThreadPoolExecutor(
+                max_workers=len(self.readers), thread_name_prefix="modbus_poll"
+            )
+        )
+
+    async def _poll(self):
+        results = await asyncio.gather(
+            *(self.loop.run_in_executor(None, reader) for reader in self.readers),
+            return_exceptions=True,
+        )
+        snapshot = {"timestamp": time.time()}
+        for reader, result in zip(self.readers, results):
+            if isinstance(result, Exception):
+                logger.error("❌ Lỗi khi đọc %s: %s", reader.__name__, result)
+                continue
+            snapshot.update(result)
+        return snapshot
+
+    def poll(self):
+        return self.loop.run_until_complete(self._poll())
+
+    def close(self):
+        self.loop.run_until_complete(self.loop.shutdown_default_executor())
+        self.loop.close()
@@ -0,0 +1,96 @@
+from pymodbus.payload import BinaryPayloadBuilder
+from pymodbus.payload import BinaryPayloadDecoder
+from pymodbus.constants import Endian
+import timeit
+
+from register_codec import RegisterCodec, get_codec
+
+# ⏱️ So sánh codec struct biên dịch sẵn với đường BinaryPayloadDecoder/Builder cũ
+# Chạy: python bench_codec.py
+
+N = 100000
+
+
+def legacy_decode(registers, typeString):
+    decoder = BinaryPayloadDecoder.fromRegisters(
+        registers, byteorder=Endian.Big, wordorder=Endian.Big
+    )
+    if typeString == "int16":
+        return decoder.decode_16bit_int()
+    elif typeString == "uint16":
+        return decoder.decode_16bit_uint()
+    elif typeString == "int32":
+        return decoder.decode_32bit_int()
+    elif typeString == "uint32":
+        return decoder.decode_32bit_uint()
+    return "Invalid type"
+
+
+def legacy_encode(value, data_type):
+    builder = BinaryPayloadBuilder(byteorder=Endian.Big, wordorder=Endian.Big)
+    if data_type == "int16":
+        builder.add_16bit_int(value)
+    elif data_type == "uint32":
+        builder.add_32bit_uint(value)
+    return builder.to_registers()
+
+
+def report(name, legacy, compiled):
+    legacy_time = min(timeit.repeat(legacy, number=N, repeat=3))
+    compiled_time = min(timeit.repeat(compiled, number=N, repeat=3))
+    print(
+        f"{name:<28} cũ: {N / legacy_time:>12,.0f} op/s   "
+        f"codec: {N / compiled_time:>12,.0f} op/s   x{legacy_time / compiled_time:.1f}"
+    )
+
+
+if __name__ == "__main__":
+    int16 = get_codec("int16")
+    uint32 = get_codec("uint32")
+    report(
+        "decode int16",
+        lambda: legacy_decode([65000], "int16"),
+        lambda: int16.decode([65000])[0],
+    )
+    report(
+        "decode uint32",
+        lambda: legacy_decode([12, 34567], "uint32"),
+        lambda: uint32.decode([12, 34567])[0],
+    )
+
+    # Khối BESS 570–587: 2 giá trị trong một lần đọc
+    block = [0] * 18
+    block[0] = 65000
+    block[17] = 876
+    bess_block = RegisterCodec([(0, "int16", 1), (17, "uint16", 1)], 18)
+    report(
+        "decode khối BESS 570–587",
+        lambda: (
+            legacy_decode(block[0:1], "int16"),
+            legacy_decode(block[17:18], "uint16"),
+        ),
+        lambda: bess_block.decode(block),
+    )
+
+    # Khối đồng hồ tải 30865–30868: 2 giá trị uint32
+    meter_block = RegisterCodec([(0, "uint32", 2), (2, "uint32", 2)], 4)
+    meter = [1, 2, 3, 4]
+    report(
+        "decode khối đồng hồ tải",
+        lambda: (
+            legacy_decode(meter[0:2], "uint32"),
+            legacy_decode(meter[2:4], "uint32"),
+        ),
+        lambda: meter_block.decode(meter),
+    )
+
+    report(
+        "encode int16",
+        lambda: legacy_encode(-1200, "int16"),
+        lambda: int16.encode(-1200),
+    )
+    report(
+        "encode uint32",
+        lambda: legacy_encode(125000, "uint32"),
+        lambda: uint32.encode(125000),
+    )
@@ -0,0 +1,176 @@
+import argparse
+import json
+
+from device_profile import load_profile
+from forecaster import SiteForecaster
+from plant_simulator import PlantModel
+from power_controller import make_controller
+
+# 🎛️ So sánh các bộ điều khiển BESS trên mô hình vật lý của plant_simulator.py
+# Chạy theo thời gian mô phỏng (không qua Modbus) nên vài giờ mô phỏng chỉ mất vài giây
+# Đo: năng lượng nhập/phát lưới, |grid| trung bình, số chu kỳ để lưới về dải ổn định
+# sau mỗi bước tải
+# Chạy: python bench_controller.py --hours 4 --pcs-accuracy 0.95
+#       python bench_controller.py --controller pi '{"ki": 0.5, "kff": 0.3}'
+#       python bench_controller.py --scenario all
+
+SETTLE_BAND = 0.5  # kW
+# Kịch bản PCS: tỉ lệ công suất thực tế / lệnh và hằng số thời gian đáp ứng (giây)
+# - ideal: PCS đáp ứng đúng lệnh, luật tỉ lệ cũ hội tụ nhanh hơn PI
+# - pcs-under: PCS đáp ứng thiếu 10%, luật cũ giữ sai lệch tĩnh, thành phần I của PI
+#   bù được (PI thắng cả |grid| lẫn số chu kỳ hội tụ)
+# - pcs-over: PCS đáp ứng thừa 10%, luật cũ dao động (|grid| lớn) nhưng PI không hội tụ
+#   nhanh hơn
+SCENARIOS = {
+    "ideal": {"pcs_accuracy": 1.0, "pcs_tau": 2.0},
+    "pcs-under": {"pcs_accuracy": 0.9, "pcs_tau": 2.0},
+    "pcs-over": {"pcs_accuracy": 1.1, "pcs_tau": 2.0},
+}
+# Đo và ra lệnh qua các điểm của hồ sơ PCS để có cùng độ phân giải và giới hạn thanh ghi
+PCS = load_profile("pcs")
+BESS_POWER = PCS["bess_power"]
+CHARGE_POWER = PCS["charge_power"]
+
+
+def simulate(
+    controller,
+    hours,
+    period,
+    dt,
+    seed,
+    start_hour,
+    forecast_params=None,
+    **model_kwargs,
+):
+    model = PlantModel(seed=seed, **model_kwargs)
+    controller.reset()
+    forecaster = None
+    if forecast_params is not None:
+        forecaster = SiteForecaster("bench", **forecast_params)
+    setpoint = 0.0
+    elapsed = 0.0
+    next_control = 0.0
+    grid_samples = []
+    settle_cycles = []
+    last_load_step = model.load_step
+    cycles_since_step = None
+    while elapsed < hours * 3600:
+        hour = (start_hour + elapsed / 3600) % 24
+        if elapsed >= next_control:
+            grid_power = model.grid_power
+            bess_power = BESS_POWER.from_registers(
+                BESS_POWER.to_registers(model.bess_power)
+            )
+            forecast = None
+            if forecaster is not None:
+                forecaster.update(elapsed, model.load_power, model.solar_power)
+                forecast = forecaster.forecast(period)
+            command = controller.update(
+                grid_power,
+                bess_power,
+                model.solar_power,
+                model.load_power,
+                period,
+                forecast,
+            )
+            setpoint = CHARGE_POWER.from_registers(CHARGE_POWER.to_registers(command))
+            grid_samples.append(abs(grid_power))
+            next_control += period
+
+            if model.load_step != last_load_step:
+                last_load_step = model.load_step
+                cycles_since_step = 0
+            elif cycles_since_step is not None:
+                cycles_since_step += 1
+                if abs(grid_power) < SETTLE_BAND:
+                    settle_cycles.append(cycles_since_step)
+                    cycles_since_step = None
+        model.step(dt, hour, setpoint, model.pv_peak)
+        elapsed += dt
+
+    return {
+        "import_kwh": model.import_energy,
+        "export_kwh": model.export_energy,
+        "mean_abs_grid_kw": sum(grid_samples) / len(grid_samples),
+        "load_steps": len(settle_cycles),
+        "mean_settle_cycles": (
+            sum(settle_cycles) / len(settle_cycles) if settle_cycles else None
+        ),
+        "max_settle_cycles": max(settle_cycles, default=None),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bộ điều khiển BESS")
+    parser.add_argument(
+        "--controller",
+        nargs=2,
+        action="append",
+        metavar=("NAME", "PARAMS_JSON"),
+        help="Thêm bộ điều khiển cần so sánh, vd. pi '{\"ki\": 0.3}'",
+    )
+    parser.add_argument(
+        "--forecast",
+        metavar="PARAMS_JSON",
+        default="{}",
+        help="Tham số forecaster.SiteForecaster cho feed-forward, 'off' để tắt dự báo",
+    )
+    parser.add_argument("--hours", type=float, default=4.0)
+    parser.add_argument("--period", type=float, default=5.0)
+    parser.add_argument("--dt", type=float, default=0.1)
+    parser.add_argument("--start-hour", type=float, default=8.0)
+    parser.add_argument("--seeds", type=int, default=3)
+    parser.add_argument("--pcs-accuracy", type=float, default=1.0)
+    parser.add_argument("--pcs-tau", type=float, default=2.0)
+    parser.add_argument(
+        "--scenario",
+        choices=[*SCENARIOS, "all"],
+        help="Dùng kịch bản PCS có sẵn thay cho --pcs-accuracy / --pcs-tau",
+    )
+    # Nhiễu tải mặc định của mô phỏng (3% mỗi bước 0.1 s) lấn át động học điều khiển
+    parser.add_argument("--load-noise", type=float, default=0.002)
+    args = parser.parse_args()
+
+    controllers = args.controller or [("proportional", "{}"), ("pi", "{}")]
+    forecast_params = None if args.forecast == "off" else json.loads(args.forecast)
+    if args.scenario is None:
+        scenarios = {None: {"pcs_accuracy": args.pcs_accuracy, "pcs_tau": args.pcs_tau}}
+    elif args.scenario == "all":
+        scenarios = SCENARIOS
+    else:
+        scenarios = {args.scenario: SCENARIOS[args.scenario]}
+    for scenario, pcs in scenarios.items():
+        if scenario is not None:
+            print(f"📋 {scenario} {json.dumps(pcs)}")
+        for name, params in controllers:
+            params = json.loads(params)
+            totals = {}
+            for seed in range(args.seeds):
+                result = simulate(
+                    make_controller(name, **params),
+                    args.hours,
+                    args.period,
+                    args.dt,
+                    seed,
+                    args.start_hour,
+                    forecast_params,
+                    load_noise=args.load_noise,
+                    **pcs,
+                )
+                for key, value in result.items():
+                    if value is not None:
+                        totals.setdefault(key, []).append(value)
+            summary = {key: sum(values) / len(values) for key, values in totals.items()}
+            print(
+                f"{name} {json.dumps(params)}: "
+                f"nhập {summary['import_kwh']:.2f} kWh, "
+                f"phát {summary['export_kwh']:.2f} kWh, "
+                f"|grid| TB {summary['mean_abs_grid_kw']:.2f} kW, "
+                f"hội tụ TB {summary.get('mean_settle_cycles', float('nan')):.1f} "
+                f"chu kỳ (max {summary.get('max_settle_cycles', float('nan')):.0f}, "
+                f"{summary['load_steps']:.0f} bước tải)"
+            )
+
+
+if __name__ == "__main__":
+    main()
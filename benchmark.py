@@ -0,0 +1,250 @@
+from pymodbus.client.sync import ModbusTcpClient
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+import plant_simulator
+from modbus_pool import ModbusConnectionPool
+from register_codec import RegisterCodec, get_codec
+from setpoint_writer import SetpointWriter
+
+# 📊 Bộ benchmark chạy với plant_simulator.py trên localhost
+# Đo: độ trễ chu kỳ zero_bess (p50/p99), số lần đọc/ghi Modbus mỗi giây,
+# tốc độ giải mã codec, thời gian quét DONGHOLOAD.py theo số inverter
+# Chạy: python benchmark.py --output bench.json [--compare bench_cu.json]
+
+DEFAULT_FLEET_SIZES = [1, 10, 50, 100, 200]
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    index = min(int(round(q / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def latency_summary(samples):
+    return {
+        "count": len(samples),
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "max_ms": max(samples) * 1000,
+        "mean_ms": sum(samples) / len(samples) * 1000,
+    }
+
+
+# ⏱️ Độ trễ một chu kỳ control_step() của bess_control.py với site mô phỏng
+def bench_control_cycle(port, cycles):
+    import bess_control
+
+    bess_host, data_management_host = plant_simulator.site_hosts(0)
+    history_dir = tempfile.mkdtemp(prefix="bench_history_")
+    site = bess_control.Site(
+        bess_ip=bess_host,
+        data_management_ip=data_management_host,
+        port=port,
+        history_dir=history_dir,
+    )
+    site.load_discharge_data_from_file()
+
+    samples = []
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            for _ in range(cycles):
+                started = time.perf_counter()
+                bess_control.control_step(site)
+                samples.append(time.perf_counter() - started)
+    site.close()
+    bess_control.modbus_pool.close_all()
+    shutil.rmtree(history_dir, ignore_errors=True)
+    return latency_summary(samples)
+
+
+# 🔁 Số lần đọc/ghi Modbus mỗi giây trên một kết nối
+def bench_round_trips(port, duration):
+    bess_host, _ = plant_simulator.site_hosts(0)
+    client = ModbusTcpClient(bess_host, port=port)
+    client.connect()
+
+    reads = 0
+    read_samples = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        client.read_holding_registers(570, 18, unit=1)
+        read_samples.append(time.perf_counter() - started)
+        reads += 1
+
+    writes = 0
+    write_samples = []
+    payload = get_codec("int16").encode(0)
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        client.write_registers(618, payload, unit=1)
+        write_samples.append(time.perf_counter() - started)
+        writes += 1
+    client.close()
+
+    return {
+        "reads_per_s": reads / duration,
+        "writes_per_s": writes / duration,
+        "read_latency": latency_summary(read_samples),
+        "write_latency": latency_summary(write_samples),
+    }
+
+
+# 🧮 Tốc độ giải mã/mã hóa của codec
+def bench_codec(iterations):
+    int16 = get_codec("int16")
+    block = RegisterCodec([(0, "int16", 1), (17, "uint16", 1)], 18)
+    registers = [0] * 18
+    results = {}
+    for name, func in (
+        ("decode_int16", lambda: int16.decode([65000])),
+        ("decode_bess_block", lambda: block.decode(registers)),
+        ("encode_int16", lambda: int16.encode(-1200)),
+    ):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        results[name + "_per_s"] = iterations / (time.perf_counter() - started)
+    return results
+
+
+# 📈 Thời gian một lượt quét đọc + ghi toàn bộ inverter của DONGHOLOAD.py
+def bench_fleet_scaling(port, fleet_sizes, scans):
+    import DONGHOLOAD
+
+    DONGHOLOAD.modbus_pool = ModbusConnectionPool(
+        port=port, timeout=DONGHOLOAD.DEVICE_TIMEOUT
+    )
+    curve = []
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            for size in fleet_sizes:
+                ips = [plant_simulator.inverter_host(i) for i in range(size)]
+                # Mọi lệnh phải ra tới thiết bị: không deadband / giới hạn tần suất,
+                # refresh_interval=0 để cả lệnh trùng giá trị cũng được ghi
+                DONGHOLOAD.setpoint_writer = SetpointWriter(
+                    DONGHOLOAD.write_register, refresh_interval=0
+                )
+                samples = []
+                for scan in range(scans):
+                    started = time.perf_counter()
+                    powers = DONGHOLOAD.fan_out(DONGHOLOAD.read_inverter_power, ips)
+                    DONGHOLOAD.broadcast_inverter_power(ips, 50 + scan % 2)
+                    samples.append(time.perf_counter() - started)
+                summary = latency_summary(samples)
+                summary["inverters"] = size
+                summary["answered"] = sum(1 for p in powers.values() if p is not None)
+                summary["written"] = DONGHOLOAD.setpoint_writer.stats["written"]
+                curve.append(summary)
+    DONGHOLOAD.modbus_pool.close_all()
+    return curve
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except OSError:
+        return None
+
+
+# So sánh với kết quả lần trước: in % thay đổi của các chỉ số chính
+def compare(current, previous):
+    keys = [
+        ("control_cycle", "p50_ms"),
+        ("control_cycle", "p99_ms"),
+        ("round_trips", "reads_per_s"),
+        ("round_trips", "writes_per_s"),
+        ("codec", "decode_bess_block_per_s"),
+    ]
+    for section, key in keys:
+        old = previous.get(section, {}).get(key)
+        new = current.get(section, {}).get(key)
+        if old and new is not None:
+            print(
+                f"  {section}.{key}: {old:.3f} -> {new:.3f} ({(new - old) / old * 100:+.1f}%)"
+            )
+    old_curve = {row["inverters"]: row for row in previous.get("fleet_scaling", [])}
+    for row in current.get("fleet_scaling", []):
+        old = old_curve.get(row["inverters"])
+        if old:
+            print(
+                f"  fleet_scaling[{row['inverters']}].p50_ms: {old['p50_ms']:.1f} -> "
+                f"{row['p50_ms']:.1f} ({(row['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100:+.1f}%)"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bộ điều khiển BESS")
+    parser.add_argument("--port", type=int, default=plant_simulator.SIM_PORT)
+    parser.add_argument(
+        "--latency", type=float, default=0.002, help="Độ trễ thiết bị (giây)"
+    )
+    parser.add_argument("--cycles", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=2.0)
+    parser.add_argument("--codec-iterations", type=int, default=200000)
+    parser.add_argument(
+        "--fleet-sizes", type=int, nargs="*", default=DEFAULT_FLEET_SIZES
+    )
+    parser.add_argument("--scans", type=int, default=5)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare")
+    args = parser.parse_args()
+
+    simulator = plant_simulator.PlantSimulator(
+        sites=1,
+        inverters=max(args.fleet_sizes, default=0),
+        port=args.port,
+        latency=args.latency,
+    ).start()
+    try:
+        results = {
+            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "latency_s": args.latency,
+        }
+        print("⏱️ Chu kỳ điều khiển...")
+        results["control_cycle"] = bench_control_cycle(args.port, args.cycles)
+        print("🔁 Đọc/ghi Modbus...")
+        results["round_trips"] = bench_round_trips(args.port, args.duration)
+        print("🧮 Codec...")
+        results["codec"] = bench_codec(args.codec_iterations)
+        if args.fleet_sizes:
+            print("📈 Quét inverter theo số lượng...")
+            results["fleet_scaling"] = bench_fleet_scaling(
+                args.port, args.fleet_sizes, args.scans
+            )
+    finally:
+        simulator.stop()
+
+    print(json.dumps(results, indent=4, ensure_ascii=False))
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=4, ensure_ascii=False)
+    print(f"💾 Đã lưu kết quả vào {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            previous = json.load(file)
+        print(f"📊 So sánh với {args.compare} ({previous.get('revision')}):")
+        compare(results, previous)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,52 @@
-from pymodbus.payload import BinaryPayloadBuilder
-from pymodbus.payload import BinaryPayloadDecoder
-from pymodbus.client.sync import ModbusTcpClient
 from pymodbus.constants import Endian
+from pymodbus.exceptions import (
+    ConnectionException,
+    ModbusException,
+    ModbusIOException,
+)
 import datetime
+import functools
 import time
 import sys
 import logging
 from logging.handlers import RotatingFileHandler
-import struct
 import os
 
 import paho.mqtt.client as mqtt
 import json
 import threading
 
+from async_poller import AsyncPoller
+from discharge_schedule import BackgroundJsonWriter, compile_schedule
+from forecaster import SiteForecaster
+from history_store import HistoryStore
+from metrics import Counter, Histogram, start_http_server
+from modbus_pool import ModbusConnectionPool
+from power_controller import make_controller
+from queue_logging import gzip_namer, gzip_rotator, setup_queue_logging
+from read_planner import MAX_READ_GAP
+from device_profile import ReadPlan, load_profile
+from register_codec import get_codec
+from scheduler import CycleScheduler
+from setpoint_writer import SetpointWriter
+from telemetry_buffer import TelemetryRingBuffer
+from telemetry_publisher import TelemetryPublisher
+from tracing import Tracer, chrome_trace, folded_stacks
+from zero_export import (
+    BRANCH_CODES,
+    CONTROLLED_BRANCHES,
+    DEFAULT_PARAMS,
+    PV_HOLD,
+    PV_LIMIT_MODES,
+    PV_MAX,
+    SETPOINT_HOLD,
+    SETPOINT_MODES,
+    bess_setpoint,
+    choose_branch,
+    inverter_action,
+    pv_limit_setpoint,
+)
+
 # import keyboard
 
 
@@ -25,126 +58,241 @@ sys.stdout.reconfigure(encoding="utf-8")
 # LOAD_METER_ID = 12
 
 
-DATA_MANAGEMENT_IP = "192.168.1.2"
+# Có thể đổi địa chỉ qua biến môi trường, vd. để chạy với plant_simulator.py
+DATA_MANAGEMENT_IP = os.environ.get("DATA_MANAGEMENT_IP", "192.168.1.2")
 DATA_MANAGEMENT_ID = 3
 LOAD_METER_ID = 13
 
-PVmax = 125000
+PVmax = 125  # kW
 pcs_gain = 1
 
-LOAD_CONSUMPTION_REG = 30865
-LOAD_CONSUMPTION_REG_2 = 30867
-TOTAL_INVERTER_POWER_REG = 30775
-MAX_POWER_REG = 41463  # Thanh ghi 32-bit
-
-BESS_IP = "192.168.1.100"
+BESS_IP = os.environ.get("BESS_IP", "192.168.1.100")
 BESS_ID = 1
-BESS_POWER_REG = 570
-BESS_SOC_REG = 587
-BESS_CHARGE_POWER_REG = 618
-
-MODBUS_TCP_PORT = 502
 
+# 🗂️ Hồ sơ thiết bị (profiles/<tên>.json): địa chỉ, kiểu, hệ số và giới hạn thanh ghi
+# Đổi model PCS/đồng hồ = đổi hồ sơ, vd. BESS_PROFILE=/etc/modbus/pcs_moi.json
+BESS_PROFILE = os.environ.get("BESS_PROFILE", "pcs")
+DATA_MANAGEMENT_PROFILE = os.environ.get("DATA_MANAGEMENT_PROFILE", "data_manager")
+LOAD_METER_PROFILE = os.environ.get("LOAD_METER_PROFILE", "load_meter")
+
+MODBUS_TCP_PORT = int(os.environ.get("MODBUS_TCP_PORT", 502))
+# ⏱️ Hạn chót cứng của một request Modbus (giây); thiết bị không phản hồi bị ngắt mạch
+# (modbus_pool.CircuitBreaker) nên mỗi chu kỳ chờ nó tối đa ~MODBUS_TIMEOUT
+MODBUS_TIMEOUT = float(os.environ.get("MODBUS_TIMEOUT", 1.0))
+CONTROL_PERIOD = 5  # Chu kỳ điều khiển (giây), có thể < 1
+
+# 🎛️ Bộ điều khiển công suất BESS: "proportional" (luật cũ, mặc định) hoặc "pi"
+# (PI + feed-forward, tùy chọn). Với PCS đáp ứng đúng lệnh, luật cũ hội tụ nhanh hơn PI;
+# PI chỉ thắng khi PCS đáp ứng thiếu so với lệnh (sai lệch tĩnh), vd. BESS_CONTROLLER=pi
+# BESS_CONTROLLER_PARAMS='{"ki": 0.1, "kff": 0.5}'
+# So sánh: python bench_controller.py --scenario all
+# Với "pi", dùng dự báo tải/solar (forecaster.py) làm feed-forward: '{"kff": 0.3, "kfc": 1.0}'
+BESS_CONTROLLER = os.environ.get("BESS_CONTROLLER", "proportional")
+BESS_CONTROLLER_PARAMS = json.loads(os.environ.get("BESS_CONTROLLER_PARAMS", "{}"))
+SETPOINT_REFRESH_INTERVAL = 300  # Ghi lại giá trị cũ sau 5 phút dù không đổi
+TELEMETRY_CAPACITY = 17280  # Số mẫu giữ trong bộ nhớ (1 ngày với chu kỳ 5 s)
+# GET /telemetry trên cổng số liệu: mẫu mới nhất và (thời điểm, min, max, mean) theo từng
+# TELEMETRY_SNAPSHOT_BUCKET giây của TELEMETRY_SNAPSHOT_WINDOW giây gần nhất
+TELEMETRY_SNAPSHOT_WINDOW = 3600
+TELEMETRY_SNAPSHOT_BUCKET = 60
+LOG_QUEUE_SIZE = 10000  # Số bản ghi log chờ tối đa, đầy thì bỏ bản ghi mới
+LOG_COMPRESS_ROTATED = False  # Nén gzip các file log cũ khi xoay vòng
+# 📡 Gửi telemetry lên MQTT theo lô: số mẫu mỗi bản tin, chu kỳ gửi tối đa (giây),
+# QoS và số lô tối đa giữ lại khi mất kết nối broker (1440 lô ~ 1 ngày)
+MQTT_TELEMETRY_BATCH = 12
+MQTT_TELEMETRY_FLUSH_INTERVAL = 60
+MQTT_TELEMETRY_QOS = 1
+MQTT_TELEMETRY_BACKLOG = 1440
+# Thư mục lưu lịch sử từng chu kỳ (file nhị phân theo giờ, gộp theo ngày)
+HISTORY_DIR = os.environ.get(
+    "HISTORY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "history")
+)
+# 📡 MQTT của site khi chạy trực tiếp bess_control.py
+MQTT_BROKER = "core.ziot.vn"
+MQTT_PORT = 5000
+MQTT_TOPIC = "CONFIG/DO000000/PO000012/SI0000014/PL000027/dischargeConfig"
+MQTT_USERNAME = "iot2022"
+MQTT_PASSWORD = "iot2022"
+# 📈 Cổng HTTP số liệu Prometheus (/metrics), 0 để tắt
+# site_supervisor.py: process chính dùng cổng này, worker i dùng cổng + 1 + i
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9108))
+# 🔍 Tỉ lệ chu kỳ được ghi span (0 = tắt, 1 = mọi chu kỳ), xem tracing.py
+# Tải về qua cổng số liệu: /trace (Chrome trace JSON), /trace/folded (flame graph)
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 0))
+
+
+FAULT_DEFINITIONS = (
+    # Thanh ghi 1
+    "Phase-lock alarm",
+    "DC side hardware soft start fault",
+    "AC side hardware soft start fault",
+    "DC software soft start fault",
+    "Grid resonance fault",
+    "Input impedance fault",
+    "Input impedance alarm",
+    "CANB communication abnormal alarm",
+    "The system has address conflict fault",
+    "System master has address conflict fault",
+    "Module address abnormal fault",
+    "DC voltage sampling fault alarm",
+    "AC voltage sampling abnormal alarm",
+    "DC side main relay alarm",
+    "Busbar midpoint uneven alarm",
+    "Overload alarm",
+    # Thanh ghi 2
+    "Positive bus secondary overvoltage alarm",
+    "Negative bus secondary overvoltage alarm",
+    "Module A1 phase overcurrent alarm",
+    "Module B1 phase overcurrent alarm",
+    "Module C1 phase overcurrent alarm",
+    "Module A2 phase overcurrent alarm",
+    "Module B2 phase overcurrent alarm",
+    "Module C2 phase overcurrent alarm",
+    "Auxiliary power supply fault",
+    "Parallel CANA communication fault",
+    "Fan 1 fault",
+    "Fan 2 fault",
+    "Fan 3 fault",
+    "Inverter overvoltage alarm",
+    "Inverter undervoltage alarm",
+    "Emergency stop fault",
+    # Thanh ghi 3
+    "RS485 communication fault",
+    "AC current sampling fault",
+    "AC output short circuit fault",
+    "Inverse amplitude lockout alarm",
+    "Inverter phase sequence alarm",
+    "Grid phase sequence alarm",
+    "DC port undervoltage alarm",
+    "DC port overvoltage alarm",
+    "Negative bus level 1 overvoltage alarm",
+    "Positive bus level 1 overvoltage alarm",
+    "Low busbar voltage alarm",
+    "High busbar voltage alarm",
+    "Grid frequency low alarm",
+    "Grid frequency high alarm",
+    "Low grid voltage alarm",
+    "High grid voltage alarm",
+    # Thanh ghi 4
+    "High ambient temperature alarm at air inlet",
+    "High ambient temperature alarm at air outlet",
+    "Module A2 high temperature alarm",
+    "Module B2 high temperature alarm",
+    "Module C2 high temperature alarm",
+    "Module A1 high temperature alarm",
+    "Module B1 high temperature alarm",
+    "Module C1 high temperature alarm",
+    "Module A2 temperature sensor fault",
+    "Module B2 temperature sensor fault",
+    "Module C2 temperature sensor fault",
+    "Module A1 temperature sensor fault",
+    "Module B1 temperature sensor fault",
+    "Module C1 temperature sensor fault",
+    "Grid access fault in AC constant voltage mode",
+    "DSP software version mismatch fault",
+)
 
-def decode_faults(register_values):
+# 🗂️ Bảng tra tính sẵn: FAULT_INDEX[thanh ghi][bit] -> tên lỗi
+FAULT_INDEX = tuple(
+    FAULT_DEFINITIONS[reg_index * 16 : reg_index * 16 + 16]
+    for reg_index in range((len(FAULT_DEFINITIONS) + 15) // 16)
+)
 
-    fault_definitions = [
-        # Thanh ghi 1
-        "Phase-lock alarm",
-        "DC side hardware soft start fault",
-        "AC side hardware soft start fault",
-        "DC software soft start fault",
-        "Grid resonance fault",
-        "Input impedance fault",
-        "Input impedance alarm",
-        "CANB communication abnormal alarm",
-        "The system has address conflict fault",
-        "System master has address conflict fault",
-        "Module address abnormal fault",
-        "DC voltage sampling fault alarm",
-        "AC voltage sampling abnormal alarm",
-        "DC side main relay alarm",
-        "Busbar midpoint uneven alarm",
-        "Overload alarm",
-        # Thanh ghi 2
-        "Positive bus secondary overvoltage alarm",
-        "Negative bus secondary overvoltage alarm",
-        "Module A1 phase overcurrent alarm",
-        "Module B1 phase overcurrent alarm",
-        "Module C1 phase overcurrent alarm",
-        "Module A2 phase overcurrent alarm",
-        "Module B2 phase overcurrent alarm",
-        "Module C2 phase overcurrent alarm",
-        "Auxiliary power supply fault",
-        "Parallel CANA communication fault",
-        "Fan 1 fault",
-        "Fan 2 fault",
-        "Fan 3 fault",
-        "Inverter overvoltage alarm",
-        "Inverter undervoltage alarm",
-        "Emergency stop fault",
-        # Thanh ghi 3
-        "RS485 communication fault",
-        "AC current sampling fault",
-        "AC output short circuit fault",
-        "Inverse amplitude lockout alarm",
-        "Inverter phase sequence alarm",
-        "Grid phase sequence alarm",
-        "DC port undervoltage alarm",
-        "DC port overvoltage alarm",
-        "Negative bus level 1 overvoltage alarm",
-        "Positive bus level 1 overvoltage alarm",
-        "Low busbar voltage alarm",
-        "High busbar voltage alarm",
-        "Grid frequency low alarm",
-        "Grid frequency high alarm",
-        "Low grid voltage alarm",
-        "High grid voltage alarm",
-        # Thanh ghi 4
-        "High ambient temperature alarm at air inlet",
-        "High ambient temperature alarm at air outlet",
-        "Module A2 high temperature alarm",
-        "Module B2 high temperature alarm",
-        "Module C2 high temperature alarm",
-        "Module A1 high temperature alarm",
-        "Module B1 high temperature alarm",
-        "Module C1 high temperature alarm",
-        "Module A2 temperature sensor fault",
-        "Module B2 temperature sensor fault",
-        "Module C2 temperature sensor fault",
-        "Module A1 temperature sensor fault",
-        "Module B1 temperature sensor fault",
-        "Module C1 temperature sensor fault",
-        "Grid access fault in AC constant voltage mode",
-        "DSP software version mismatch fault",
-    ]
 
+# Giải mã một bộ 4 thanh ghi lỗi, kết quả được cache theo giá trị thanh ghi
+@functools.lru_cache(maxsize=256)
+def _decode_fault_words(words):
     active_faults = []
+    for reg_index, reg_value in enumerate(words[: len(FAULT_INDEX)]):
+        names = FAULT_INDEX[reg_index]
+        # Chỉ duyệt các bit đang bật
+        while reg_value:
+            low_bit = reg_value & -reg_value
+            bit = low_bit.bit_length() - 1
+            if bit < len(names):
+                active_faults.append(names[bit])
+            reg_value ^= low_bit
+    return tuple(active_faults)
 
-    # Duyệt qua 4 thanh ghi
-    for reg_index, reg_value in enumerate(register_values):
-        for bit in range(16):  # Mỗi thanh ghi có 16 bit
-            if reg_value & (1 << bit):  # Kiểm tra bit có đang bật không
-                fault_index = reg_index * 16 + bit
-                if fault_index < len(fault_definitions):
-                    active_faults.append(fault_definitions[fault_index])
 
-    return active_faults
+def decode_faults(register_values):
+    if register_values is None:
+        return ()
+    return _decode_fault_words(tuple(register_values))
+
+
+# Ghép các thanh ghi lỗi thành một số nguyên (thanh ghi 1 ở 16 bit thấp)
+def fault_bits(register_values):
+    bits = 0
+    for reg_index, reg_value in enumerate(register_values or ()):
+        bits |= reg_value << (16 * reg_index)
+    return bits
+
+
+# 🚨 Theo dõi lỗi PCS, chỉ báo khi lỗi xuất hiện hoặc hết lỗi
+class FaultTracker:
+    def __init__(self):
+        self.active = {}  # tên lỗi -> thời điểm xuất hiện
+        self._last_faults = ()
+
+    def update(self, active_faults, timestamp):
+        if active_faults is self._last_faults:
+            return [], []
+        self._last_faults = active_faults
+        raised = [fault for fault in active_faults if fault not in self.active]
+        cleared = [fault for fault in self.active if fault not in active_faults]
+        for fault in raised:
+            self.active[fault] = timestamp
+        for fault in cleared:
+            del self.active[fault]
+        return raised, cleared
+
+
+def log_fault_transitions(site, raised, cleared, timestamp):
+    when = datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+    for fault in raised:
+        site.log_event(
+            "fault_raised",
+            "🚨 %(when)s Lỗi PCS xuất hiện: %(fault)s",
+            logging.WARNING,
+            when=when,
+            fault=fault,
+        )
+    for fault in cleared:
+        site.log_event(
+            "fault_cleared",
+            "✅ %(when)s Lỗi PCS đã hết: %(fault)s",
+            when=when,
+            fault=fault,
+        )
 
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 log_file = os.path.join(script_dir, "logger.txt")
 logger = logging.getLogger("my_logger")
-logger.setLevel(logging.DEBUG)
-handler = RotatingFileHandler(
-    log_file, maxBytes=1024 * 1024 * 20, backupCount=3, encoding="utf-8"
-)
-handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter(
-    "%(asctime)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
-)
-handler.setFormatter(formatter)
-logger.addHandler(handler)
+
+
+# 📝 Ghi log ra file + console trên thread nền, thread điều khiển không bao giờ chờ I/O
+# Gọi một lần khi khởi động (bess_control.py hoặc site_supervisor.py)
+def setup_logging(console=True):
+    logger.setLevel(logging.DEBUG)
+    handler = RotatingFileHandler(
+        log_file, maxBytes=1024 * 1024 * 20, backupCount=3, encoding="utf-8"
+    )
+    handler.setLevel(logging.DEBUG)
+    formatter = logging.Formatter(
+        "%(asctime)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
+    )
+    handler.setFormatter(formatter)
+    if LOG_COMPRESS_ROTATED:
+        handler.namer = gzip_namer
+        handler.rotator = gzip_rotator
+    handlers = [handler]
+    if console:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(logging.Formatter("%(message)s"))
+        handlers.append(console_handler)
+    return setup_queue_logging(logger, handlers, LOG_QUEUE_SIZE)
 
 
 # Địa chỉ file lưu trữ dữ liệu
@@ -161,158 +309,88 @@ default_discharge_data = [
     }
 ]
 
-discharge_data = []
-
-
-def load_discharge_data_from_file():
-    global discharge_data
-    if os.path.exists(data_file_path):
-        try:
-            with open(data_file_path, "r") as file:
-                discharge_data = json.load(file)
-                if not isinstance(discharge_data, list) or not discharge_data:
-                    discharge_data = default_discharge_data.copy()
-            print(discharge_data)
-
-        except (json.JSONDecodeError, FileNotFoundError):
-            discharge_data = default_discharge_data.copy()
-    else:
-        discharge_data = default_discharge_data.copy()
-        print(discharge_data)
-
+# Đánh thức trễ một chút sau mốc chuyển để chắc chắn đã sang phút mới
+TIMER_WAKEUP_MARGIN = 0.05
 
-def save_discharge_data_to_file():
-    with open(data_file_path, "w") as file:
-        json.dump(discharge_data, file, indent=4)
-
-
-has_responded = False
-
-
-def on_message(client, userdata, msg):
-    global discharge_data, has_responded
-    print(f"Received message: {msg.topic} -> {msg.payload.decode()}")
 
+# Như bản gốc: "string" giải mã size byte đầu của size thanh ghi đã đọc
+def value_decode(registers, typeString, size):
     try:
-        received_payload = json.loads(msg.payload.decode())
-        if isinstance(received_payload, list) and received_payload:
-            discharge_data = received_payload
-            discharge_data[0]["TIMESTAMP"] = datetime.datetime.now().strftime(
-                "%Y-%m-%d %H:%M:%S"
-            )
-            has_responded = False  # Cho phép phản hồi lại khi có dữ liệu mới
-            save_discharge_data_to_file()
-    except json.JSONDecodeError:
-        print("Invalid JSON received")
+        codec = get_codec(typeString, size)
+    except ValueError:
+        return "Invalid type"
+    return codec.decode(registers[: codec.count])[0]
 
-    if not has_responded:
-        response_topic = msg.topic.replace(
-            "CONFIG", "HEALTHCHECK", 1
-        )  # Chuyển phản hồi sang topic HEALTHCHECK
-        client.publish(response_topic, json.dumps(discharge_data))
-        has_responded = True
 
-
-def send_healthcheck(client, topic):
-    while True:
-        discharge_data[0]["TIMESTAMP"] = datetime.datetime.now().strftime(
-            "%Y-%m-%d %H:%M:%S"
-        )
-        client.publish(topic, json.dumps(discharge_data))
-        threading.Event().wait(10)  # Chờ 2 phút trước khi gửi lại
+# Pool dùng chung cho mọi site trong process, mỗi (ip, port) một kết nối
+modbus_pool = ModbusConnectionPool(port=MODBUS_TCP_PORT, timeout=MODBUS_TIMEOUT)
 
 
-def mqtt_handler(
-    broker: str,
-    port: int,
-    topic: str,
-    username: str,
-    password: str,
-    client_id: str = "mqtt_client",
-):
-    client = mqtt.Client(client_id)
-    client.username_pw_set(username, password)
-    client.on_message = on_message
+# 🔄 Hàm lấy kết nối Modbus từ pool, tự kết nối lại nếu lỗi; None khi mạch đang ngắt
+def connect_modbus_device(ip, port=None):
+    return modbus_pool.get(ip, port)
 
-    client.connect(broker, port, 60)
-    client.subscribe(topic)
 
-    # Bắt đầu gửi healthcheck định kỳ mỗi 2 phút
-    healthcheck_topic = topic.replace("CONFIG", "HEALTHCHECK", 1)
-    threading.Thread(
-        target=send_healthcheck, args=(client, healthcheck_topic), daemon=True
-    ).start()
-
-    client.loop_forever()
-
-
-def value_decode(registers, typeString, size):
-    decoder = BinaryPayloadDecoder.fromRegisters(
-        registers, byteorder=Endian.Big, wordorder=Endian.Big
-    )
-    if typeString == "int16":
-        value = decoder.decode_16bit_int()
-    elif typeString == "uint16":
-        value = decoder.decode_16bit_uint()
-    elif typeString == "int32":
-        value = decoder.decode_32bit_int()
-    elif typeString == "uint32":
-        value = decoder.decode_32bit_uint()
-    elif typeString == "float16":
-        value = decoder.decode_16bit_float()
-    elif typeString == "float32":
-        value = decoder.decode_32bit_float()
-    elif typeString == "string":
-        value = decoder.decode_string(size).decode()
-    else:
-        value = "Invalid type"
+# 📈 Thời gian và lỗi của từng request Modbus theo thiết bị
+MODBUS_LATENCY = Histogram(
+    "bess_modbus_request_seconds",
+    "Thời gian một request Modbus, kể cả request lỗi",
+    ("device", "unit", "function"),
+)
+MODBUS_ERRORS = Counter(
+    "bess_modbus_errors_total",
+    "Request Modbus lỗi theo nguyên nhân "
+    "(connection, io, exception_response, circuit_open, other)",
+    ("device", "function", "cause"),
+)
+CYCLE_ERRORS = Counter(
+    "bess_cycle_errors_total",
+    "Lỗi trong chu kỳ điều khiển bị bắt và bỏ qua, theo loại lỗi",
+    ("site", "error"),
+)
 
-    return value
 
+def _device_label(client):
+    return "none" if client is None else f"{client.host}:{client.port}"
 
-def is_within_timer():
 
-    now = datetime.datetime.now()
-    current_minutes = now.hour * 60 + now.minute  # Tổng số phút từ 00:00
-    start_minutes = (
-        discharge_data[0]["DISCHARGE_START_H"] * 60
-        + discharge_data[0]["DISCHARGE_START_M"]
-    )
-    end_minutes = (
-        discharge_data[0]["DISCHARGE_END_H"] * 60 + discharge_data[0]["DISCHARGE_END_M"]
-    )
-    # print(f"Thời gian hiện tại: {now.strftime('%Y-%m-%d %H:%M:%S')}")
-    # print(discharge_data)
-    if start_minutes <= end_minutes:
-        return start_minutes <= current_minutes < end_minutes
-    else:  # Trường hợp qua đêm
-        return current_minutes >= start_minutes or current_minutes < end_minutes
-
-
-# 🔄 Hàm kết nối Modbus, tự retry nếu lỗi
-def connect_modbus_device(ip, retries=3, delay=2):
-    for _ in range(retries):
-        client = ModbusTcpClient(ip, port=MODBUS_TCP_PORT)
-        if client.connect():
-            return client
-        print(f"⚠️ Không thể kết nối {ip}, thử lại sau {delay}s...")
-        logger.error(f"⚠️ Không thể kết nối {ip}, thử lại sau {delay}s...")
-        time.sleep(delay)
-    return None
+def _error_cause(error):
+    if isinstance(error, ConnectionException):
+        return "connection"
+    if isinstance(error, ModbusIOException):
+        return "io"
+    if isinstance(error, ModbusException):
+        return "exception_response"
+    return "other"
 
 
 # 📥 Đọc thanh ghi Modbus
 def read_register(client, register, unit_id, type, count):
+    if not modbus_pool.allow(client):
+        MODBUS_ERRORS.labels(_device_label(client), "read", "circuit_open").inc()
+        return None
+    started = time.perf_counter()
     try:
         result = client.read_holding_registers(register, count, unit=unit_id)
-        if count == 4:
+        if isinstance(result, ModbusIOException):
+            raise result
+        modbus_pool.succeeded(client)
+        if result.isError():
+            raise ModbusException(str(result))
+        if type == "raw":
             return result.registers
         else:
             return value_decode(result.registers, type, count)
 
     except Exception as e:
-        print(f"❌ Lỗi khi đọc thanh ghi {register}: {e}")
-        logger.error(f"❌ Lỗi khi đọc thanh ghi {register}: {e}")
+        if isinstance(e, (ConnectionException, ModbusIOException)):
+            modbus_pool.failed(client)
+        MODBUS_ERRORS.labels(_device_label(client), "read", _error_cause(e)).inc()
+        logger.error("❌ Lỗi khi đọc thanh ghi %s: %s", register, e)
+    finally:
+        MODBUS_LATENCY.labels(_device_label(client), unit_id, "read").observe(
+            time.perf_counter() - started
+        )
     return None
 
 
@@ -325,474 +403,759 @@ def write_register(
     byteorder=Endian.Big,
     wordorder=Endian.Big,
 ):
+    if not modbus_pool.allow(client):
+        MODBUS_ERRORS.labels(_device_label(client), "write", "circuit_open").inc()
+        logger.error("❌ Bỏ qua ghi thanh ghi %s: thiết bị đang ngắt mạch", register)
+        return False
     try:
-        builder = BinaryPayloadBuilder(byteorder=byteorder, wordorder=wordorder)
-
-        # Xử lý theo kiểu dữ liệu
-        if data_type == "int16":
-            builder.add_16bit_int(value)
-        elif data_type == "uint16":
-            builder.add_16bit_uint(value)
-        elif data_type == "int32":
-            builder.add_32bit_int(value)
-        elif data_type == "uint32":
-            builder.add_32bit_uint(value)
-        elif data_type == "float32":
-            builder.add_32bit_float(value)
-        else:
-            raise ValueError(f"❌ Kiểu dữ liệu {data_type} không được hỗ trợ")
-
-        payload = builder.to_registers()  # Chuyển thành danh sách thanh ghi
-        result = client.write_registers(register, payload, unit=unit_id)
+        # Chuyển thành danh sách thanh ghi bằng codec biên dịch sẵn
+        payload = get_codec(data_type, None, byteorder, wordorder).encode(value)
+        started = time.perf_counter()
+        try:
+            result = client.write_registers(register, payload, unit=unit_id)
+        finally:
+            MODBUS_LATENCY.labels(_device_label(client), unit_id, "write").observe(
+                time.perf_counter() - started
+            )
 
+        if result and not isinstance(result, ModbusIOException):
+            modbus_pool.succeeded(client)
         if result and not result.isError():
-            print(
-                f"✅ Ghi thành công giá trị {value} ({data_type}) vào thanh ghi {register}"
-            )
             logger.info(
-                f"✅ Ghi thành công giá trị {value} ({data_type}) vào thanh ghi {register}"
+                "✅ Ghi thành công giá trị %s (%s) vào thanh ghi %s",
+                value,
+                data_type,
+                register,
             )
+            return True
         else:
-            print(f"❌ Lỗi khi ghi giá trị {value} vào thanh ghi {register}")
-            logger.error(f"❌ Lỗi khi ghi giá trị {value} vào thanh ghi {register}")
+            if isinstance(result, ModbusIOException):
+                modbus_pool.failed(client)
+                cause = "io"
+            else:
+                cause = "exception_response" if result else "other"
+            MODBUS_ERRORS.labels(_device_label(client), "write", cause).inc()
+            logger.error("❌ Lỗi khi ghi giá trị %s vào thanh ghi %s", value, register)
 
     except Exception as e:
-        print(f"❌ Exception khi ghi {data_type} vào thanh ghi {register}: {e}")
-        logger.error(f"❌ Exception khi ghi {data_type} vào thanh ghi {register}: {e}")
-    return None
+        if isinstance(e, ConnectionException):
+            modbus_pool.failed(client)
+        MODBUS_ERRORS.labels(_device_label(client), "write", _error_cause(e)).inc()
+        logger.error(
+            "❌ Exception khi ghi %s vào thanh ghi %s: %s", data_type, register, e
+        )
+    return False
+
+
+# 📥 Đọc các điểm theo kế hoạch đã gộp, trả về {tên: giá trị}
+def read_points(client, plan):
+    values = {}
+    for unit_id, start, count, raw_members, typed_names, decode in plan:
+        registers = None
+        if client:
+            registers = read_register(client, start, unit_id, "raw", count)
+        if registers is None or len(registers) < count:
+            for name in typed_names:
+                values[name] = None
+            for name, offset, size in raw_members:
+                values[name] = None
+            continue
+        if decode is not None:
+            values.update(zip(typed_names, decode(registers)))
+        for name, offset, size in raw_members:
+            values[name] = registers[offset : offset + size]
+    return values
+
+
+# 🏷️ Thêm tên site vào đầu mỗi dòng log khi chạy nhiều site
+class SiteLogger(logging.LoggerAdapter):
+    def process(self, msg, kwargs):
+        if self.extra["site"]:
+            msg = "[" + self.extra["site"].replace("%", "%%") + "] " + msg
+        kwargs["extra"] = {**self.extra, **kwargs.get("extra", {})}
+        return msg, kwargs
+
+
+# 🏭 Một site: cấu hình thiết bị và toàn bộ trạng thái điều khiển của nó
+# Chạy đơn: Site() dùng các hằng số/biến môi trường ở trên
+# Chạy nhiều site: site_supervisor.py tạo Site(**cấu hình) cho từng site
+class Site:
+    def __init__(
+        self,
+        name="",
+        bess_ip=BESS_IP,
+        data_management_ip=DATA_MANAGEMENT_IP,
+        port=MODBUS_TCP_PORT,
+        bess_id=BESS_ID,
+        data_management_id=DATA_MANAGEMENT_ID,
+        load_meter_id=LOAD_METER_ID,
+        pv_max=PVmax,
+        pcs_gain=pcs_gain,
+        decision_params=None,
+        controller=BESS_CONTROLLER,
+        controller_params=None,
+        forecaster_params=None,
+        mqtt_topic=None,
+        config_file=None,
+        history_dir=None,
+        bess_profile=BESS_PROFILE,
+        data_management_profile=DATA_MANAGEMENT_PROFILE,
+        load_meter_profile=LOAD_METER_PROFILE,
+    ):
+        self.name = name
+        self.bess_ip = bess_ip
+        self.data_management_ip = data_management_ip
+        self.port = port
+        self.bess_id = bess_id
+        self.data_management_id = data_management_id
+        self.load_meter_id = load_meter_id
+        self.pv_max = pv_max
+        # Tham số của cây quyết định (zero_export.DEFAULT_PARAMS), vd. đã chọn bằng replay.py
+        self.decision_params = {
+            **DEFAULT_PARAMS,
+            "pcs_gain": pcs_gain,
+            **(decision_params or {}),
+        }
+        self.mqtt_topic = mqtt_topic
+        self.logger = SiteLogger(logger, {"site": name})
+        if config_file is None:
+            config_file = (
+                os.path.join(script_dir, f"time_conf_{name}.txt")
+                if name
+                else data_file_path
+            )
+        if history_dir is None:
+            history_dir = os.path.join(HISTORY_DIR, name) if name else HISTORY_DIR
+
+        # 🗂️ Hồ sơ thiết bị biên dịch thành kế hoạch đọc (gộp các thanh ghi gần nhau thành
+        # ít lần đọc nhất, giải mã và đổi đơn vị sẵn) và các điểm ghi lệnh
+        bess = load_profile(bess_profile)
+        data_management = load_profile(data_management_profile)
+        load_meter = load_profile(load_meter_profile)
+        self.bess_reads = ReadPlan([(bess_id, bess)], max_gap=MAX_READ_GAP)
+        self.data_management_reads = ReadPlan(
+            [(data_management_id, data_management), (load_meter_id, load_meter)],
+            max_gap=MAX_READ_GAP,
+        )
+        self.write_points = {}  # tên -> (unit_id, điểm, byteorder, wordorder)
+        for unit_id, profile in (
+            (bess_id, bess),
+            (data_management_id, data_management),
+            (load_meter_id, load_meter),
+        ):
+            for point_name, point in profile.write_points().items():
+                self.write_points[point_name] = (
+                    unit_id,
+                    point,
+                    profile.byteorder,
+                    profile.wordorder,
+                )
+
+        self.telemetry = TelemetryRingBuffer(TELEMETRY_CAPACITY)
+        if controller_params is None:
+            controller_params = BESS_CONTROLLER_PARAMS
+        self.controller = make_controller(controller, **controller_params)
+        # Dự báo tải/solar cho chu kỳ sau, luôn chạy để theo dõi sai số dự báo
+        self.forecaster = SiteForecaster(name, **(forecaster_params or {}))
+        self.history = HistoryStore(history_dir)
+        self.telemetry_publisher = TelemetryPublisher(
+            batch_size=MQTT_TELEMETRY_BATCH,
+            flush_interval=MQTT_TELEMETRY_FLUSH_INTERVAL,
+            qos=MQTT_TELEMETRY_QOS,
+            backlog=MQTT_TELEMETRY_BACKLOG,
+        )
+        self.setpoint_writer = SetpointWriter(
+            write_register,
+            deadband={
+                point.address: point.deadband
+                for _, point, _, _ in self.write_points.values()
+            },
+            min_interval={
+                point.address: point.min_interval
+                for _, point, _, _ in self.write_points.values()
+            },
+            refresh_interval=SETPOINT_REFRESH_INTERVAL,
+        )
+        self.fault_tracker = FaultTracker()
+        self.tracer = Tracer(name, TRACE_SAMPLE_RATE)
+        # BESS và Data Management được đọc song song mỗi chu kỳ
+        self.poller = AsyncPoller([self.read_bess_data, self.read_data_management_data])
+
+        self.enb_inv = True
+        self.cycle_record = {}  # Dữ liệu chu kỳ hiện tại, ghi vào lịch sử khi kết thúc
+
+        self.config_file = config_file
+        self.discharge_data = []
+        # Lịch xả đã biên dịch, chỉ được thay thế nguyên khối (không sửa tại chỗ)
+        self.discharge_schedule = compile_schedule(default_discharge_data)
+        self.config_writer = BackgroundJsonWriter(config_file)
+        self.has_responded = False
+        # (lịch, đang trong giờ xả, hết hiệu lực lúc) - chỉ tra lại lịch khi qua mốc chuyển
+        self.timer_state = (None, False, 0.0)
+
+    # 📝 Một sự kiện có cấu trúc cho mỗi quyết định/trạng thái
+    # Giá trị được truyền riêng, chuỗi chỉ được format trên thread ghi log (lazy)
+    def log_event(self, event, template, level=logging.INFO, **fields):
+        if event in BRANCH_CODES:
+            self.cycle_record["branch"] = BRANCH_CODES[event]
+        # Không có trường nào thì không truyền args: logging chỉ nhận dict args khác rỗng
+        args = (fields,) if fields else ()
+        self.logger.log(
+            level, template, *args, extra={"event": event, "fields": fields}
+        )
 
+    def connect(self, ip):
+        with self.tracer.span("connect", ip=ip):
+            return connect_modbus_device(ip, self.port)
+
+    # 📥 Đọc các điểm của một địa chỉ IP theo đơn vị kỹ thuật (kW, %)
+    def read_device(self, ip, plan):
+        client = self.connect(ip)
+        values = read_points(client, plan.cycle)
+        if plan.slow_due():
+            plan.slow_values = read_points(client, plan.slow)
+        values.update(plan.slow_values)
+        return values
+
+    # 🔄 Đọc dữ liệu BESS
+    def read_bess_data(self):
+        with self.tracer.span("read.bess"):
+            return self.read_device(self.bess_ip, self.bess_reads)
+
+    # ☀️ Đọc công suất inverter và đồng hồ tải từ Data Management
+    def read_data_management_data(self):
+        with self.tracer.span("read.meter"):
+            return self.read_device(self.data_management_ip, self.data_management_reads)
+
+    # ✍️ Ghi một điểm lệnh theo đơn vị kỹ thuật, hồ sơ đổi sang giá trị thanh ghi
+    # (làm tròn theo hệ số, kẹp trong giới hạn min/max của điểm)
+    def write(self, client, name, value):
+        unit_id, point, byteorder, wordorder = self.write_points[name]
+        with self.tracer.span("write", point=name, value=value):
+            return self.setpoint_writer.write(
+                client,
+                point.address,
+                point.encode(value),
+                unit_id=unit_id,
+                data_type=point.type,
+                byteorder=byteorder,
+                wordorder=wordorder,
+            )
 
-# 🔄 Đọc dữ liệu BESS
-def read_bess_data():
-    bess_client = connect_modbus_device(BESS_IP)
-    if not bess_client:
-        return None, None
+    def load_discharge_data_from_file(self):
+        if os.path.exists(self.config_file):
+            try:
+                with open(self.config_file, "r") as file:
+                    self.discharge_data = json.load(file)
+                self.discharge_schedule = compile_schedule(self.discharge_data)
+                self.logger.info("Lịch xả: %s", self.discharge_data)
+                return
+
+            except (json.JSONDecodeError, FileNotFoundError, ValueError):
+                self.discharge_data = default_discharge_data.copy()
+        else:
+            self.discharge_data = default_discharge_data.copy()
+            self.logger.info("Lịch xả mặc định: %s", self.discharge_data)
+        self.discharge_schedule = compile_schedule(self.discharge_data)
 
-    bess_power = read_register(
-        bess_client,
-        BESS_POWER_REG,
-        BESS_ID,
-        "int16",
-        1,
-    )
-    bess_soc = read_register(
-        bess_client,
-        BESS_SOC_REG,
-        BESS_ID,
-        "uint16",
-        1,
+    # Lưu cấu hình trên thread nền (ghi file tạm rồi đổi tên), không chặn MQTT
+    def save_discharge_data_to_file(self):
+        self.config_writer.save(self.discharge_data)
+
+    def on_message(self, client, userdata, msg):
+        payload = msg.payload.decode()
+        self.logger.info("Received message: %s -> %s", msg.topic, payload)
+
+        try:
+            received_payload = json.loads(payload)
+            if isinstance(received_payload, list) and received_payload:
+                # Biên dịch trước, cấu hình lỗi thì giữ nguyên lịch đang chạy
+                schedule = compile_schedule(received_payload)
+                self.discharge_data = received_payload
+                self.discharge_schedule = schedule
+                self.discharge_data[0]["TIMESTAMP"] = datetime.datetime.now().strftime(
+                    "%Y-%m-%d %H:%M:%S"
+                )
+                self.has_responded = False  # Cho phép phản hồi lại khi có dữ liệu mới
+                self.save_discharge_data_to_file()
+        except json.JSONDecodeError:
+            self.logger.warning("Invalid JSON received on %s", msg.topic)
+        except ValueError as e:
+            self.logger.error("%s", e)
+
+        if not self.has_responded:
+            response_topic = msg.topic.replace(
+                "CONFIG", "HEALTHCHECK", 1
+            )  # Chuyển phản hồi sang topic HEALTHCHECK
+            client.publish(response_topic, json.dumps(self.discharge_data))
+            self.has_responded = True
+
+    def send_healthcheck(self, client):
+        self.discharge_data[0]["TIMESTAMP"] = datetime.datetime.now().strftime(
+            "%Y-%m-%d %H:%M:%S"
+        )
+        client.publish(
+            self.mqtt_topic.replace("CONFIG", "HEALTHCHECK", 1),
+            json.dumps(self.discharge_data),
+        )
+
+    # 📡 Gắn site vào một kết nối MQTT (có thể dùng chung cho nhiều site)
+    def attach_mqtt(self, client):
+        client.message_callback_add(self.mqtt_topic, self.on_message)
+        client.subscribe(self.mqtt_topic)
+        # Telemetry dùng chung kết nối, gửi theo lô lên topic TELEMETRY
+        self.telemetry_publisher.attach(
+            client, self.mqtt_topic.replace("CONFIG", "TELEMETRY", 1)
+        )
+
+    def is_within_timer(self):
+        schedule, active, until = self.timer_state
+        now = time.time()
+        if schedule is self.discharge_schedule and now < until:
+            return active
+        schedule = self.discharge_schedule
+        active, transition = schedule.state_at(datetime.datetime.fromtimestamp(now))
+        until = transition.timestamp() if transition else float("inf")
+        self.timer_state = (schedule, active, until)
+        return active
+
+    # ⏰ Thời điểm chuyển trạng thái xả tiếp theo, để bộ lập lịch chạy đúng mốc
+    def next_timer_wakeup(self):
+        self.is_within_timer()
+        until = self.timer_state[2]
+        return None if until == float("inf") else until + TIMER_WAKEUP_MARGIN
+
+    # 🗄️ Ghi chu kỳ vừa chạy vào lịch sử: số đo, lỗi, lệnh đã ra và nhánh quyết định
+    def record_history(self):
+        cycle_record = self.cycle_record
+        if "timestamp" not in cycle_record:
+            return
+        requested = self.setpoint_writer.requested
+        bess_setpoint = self._requested(requested, "charge_power")
+        pv_limit = self._requested(requested, "pv_limit")
+        nan = float("nan")
+        self.history.append(
+            cycle_record["timestamp"],
+            cycle_record.get("grid_power", nan),
+            cycle_record.get("solar_power", nan),
+            cycle_record.get("bess_power", nan),
+            cycle_record.get("bess_soc", nan),
+            cycle_record.get("load_power", nan),
+            cycle_record.get("fault_bits", 0),
+            nan if bess_setpoint is None else bess_setpoint,
+            nan if pv_limit is None else pv_limit,
+            cycle_record.get("branch", 0),
+        )
+        cycle_record.clear()
+
+    # Lệnh đã yêu cầu trong chu kỳ của một điểm ghi, theo đơn vị kỹ thuật
+    def _requested(self, requested, name):
+        _, point, _, _ = self.write_points[name]
+        value = requested.pop(point.address, None)
+        if value is None or point.decode is None:
+            return value
+        return point.decode(value)
+
+    # Một chu kỳ hoàn chỉnh: điều khiển rồi ghi lịch sử, lỗi không làm dừng vòng lặp
+    def step(self):
+        with self.tracer.cycle():
+            try:
+                control_step(self)
+            except Exception as e:
+                CYCLE_ERRORS.labels(self.name or "main", type(e).__name__).inc()
+                self.logger.exception(
+                    "🛑 Có lỗi xảy ra trong vòng lập. thực hiện vòng lập khác."
+                )
+            try:
+                with self.tracer.span("history"):
+                    self.record_history()
+            except OSError as e:
+                CYCLE_ERRORS.labels(self.name or "main", "history").inc()
+                self.logger.error("❌ Lỗi khi ghi lịch sử: %s", e)
+
+    # Số liệu thống kê gửi về supervisor / in định kỳ
+    def metrics(self):
+        return {
+            "setpoints": dict(self.setpoint_writer.stats),
+            "telemetry": dict(self.telemetry_publisher.stats),
+            "forecast": self.forecaster.stats(),
+        }
+
+    def report(self):
+        self.setpoint_writer.report()
+
+    def close(self):
+        self.poller.close()
+        self.history.close()
+
+    # 📈 Ảnh chụp bộ đệm telemetry trong bộ nhớ, cho /telemetry
+    def telemetry_snapshot(
+        self, seconds=TELEMETRY_SNAPSHOT_WINDOW, bucket=TELEMETRY_SNAPSHOT_BUCKET
+    ):
+        count = len(self.telemetry.window_since(seconds)["timestamp"])
+        samples = max(1, round(bucket / CONTROL_PERIOD))
+        return {
+            "latest": self.telemetry.latest(),
+            "series": {
+                field: self.telemetry.downsample(field, samples, count)
+                for field in self.telemetry.fields
+            },
+        }
+
+
+# Đường dẫn tải trace của các site qua cổng số liệu (metrics.start_http_server)
+def trace_routes(sites):
+    tracers = [site.tracer for site in sites]
+    return {
+        "/trace": ("application/json", lambda: chrome_trace(tracers)),
+        "/trace/folded": ("text/plain", lambda: folded_stacks(tracers)),
+    }
+
+
+# Đường dẫn xem telemetry gần nhất của các site qua cổng số liệu
+def telemetry_routes(sites):
+    def render():
+        return json.dumps({site.name: site.telemetry_snapshot() for site in sites})
+
+    return {"/telemetry": ("application/json", render)}
+
+
+# ⚙️ Một chu kỳ điều khiển: đọc snapshot, quyết định và ghi lệnh
+def control_step(site):
+    bess_client = site.connect(site.bess_ip)
+    data_management_client = site.connect(site.data_management_ip)
+    with site.tracer.span("poll"):
+        snapshot = site.poller.poll()
+    site.cycle_record.clear()
+    site.cycle_record["timestamp"] = snapshot["timestamp"]
+    # Lịch xả chỉ được tra một lần mỗi chu kỳ
+    within_timer = site.is_within_timer()
+    bess_power = snapshot.get("bess_power")
+    bess_soc = snapshot.get("bess_soc")
+    faults_word = snapshot.get("faults_word")
+    total_solar_production = snapshot.get("total_solar_production")
+    grid_import = snapshot.get("grid_import")
+    grid_export = snapshot.get("grid_export")
+
+    with site.tracer.span("faults"):
+        active_faults = decode_faults(faults_word)
+        site.cycle_record["fault_bits"] = fault_bits(faults_word)
+        bess_faults = bool(active_faults)
+        raised, cleared = site.fault_tracker.update(
+            active_faults, snapshot["timestamp"]
+        )
+        if raised or cleared:
+            log_fault_transitions(site, raised, cleared, snapshot["timestamp"])
+    # 🔋 BESS không phản hồi (mạch ngắt, mất kết nối) nhưng đồng hồ và PV vẫn đọc được:
+    # vẫn điều khiển PV, coi BESS như bị lỗi, 0 kW, SOC 0 % và ngoài giờ xả (không tắt PV
+    # để xả một BESS không điều khiển được, bật lại PV nếu đang tắt để xả)
+    bess_offline = bess_power is None or bess_soc is None
+    if bess_offline:
+        within_timer = False
+        bess_faults = True
+        bess_power = bess_soc = 0.0
+    if not data_management_client:
+        site.log_event(
+            "data_management_offline",
+            "❌ Không thể kết nối với Data Management. Dừng chương trình.",
+            logging.ERROR,
+        )
+        return
+
+    inverter = inverter_action(
+        within_timer,
+        total_solar_production,
+        bess_soc,
+        site.enb_inv,
+        site.decision_params,
     )
+    if inverter == "inverter_off":
+        site.write(data_management_client, "pv_limit", 0)
+        site.enb_inv = False
+        site.log_event("inverter_off", "🔌 Đã tắt inverter. Đang xả BESS.")
+        return
+
+    elif inverter == "inverter_on":
+        site.write(data_management_client, "pv_limit", site.pv_max)
+        site.write(bess_client, "charge_power", 0)
+
+        site.enb_inv = True
+        site.log_event(
+            "inverter_on",
+            "🔌 Hết thời gian xả - Đã tắt xả BESS. Bật tối đa công xuất inverter.",
+        )
+
+    # ☀️ Tổng công suất inverter (đã đọc cùng khối với đồng hồ tải)
+    if total_solar_production is not None and total_solar_production <= 0:
+        total_solar_production = 0
+
+    # ❌ Nếu có lỗi khi đọc đồng hồ / PV, bỏ qua vòng lặp này
+    if None in [grid_import, grid_export, total_solar_production]:
+        site.log_event(
+            "missing_data", "⚠️ Dữ liệu thiếu, bỏ qua vòng lặp.", logging.WARNING
+        )
+        return
+
+    # Các giá trị đã theo đơn vị kỹ thuật (kW, %) từ hồ sơ thiết bị
+    # Làm tròn theo độ phân giải 1 W của đồng hồ để bỏ sai số dấu phẩy động của phép trừ
+    grid_power = round(grid_import - grid_export, 3)
+    load_power = grid_power + total_solar_production + bess_power
+    if bess_offline:
+        # Không có số đo BESS: lịch sử giữ NaN, không cập nhật dự báo / telemetry
+        site.cycle_record.update(
+            grid_power=grid_power, solar_power=total_solar_production
+        )
+        site.log_event(
+            "bess_offline",
+            "⚠️ Không đọc được BESS, chỉ điều khiển PV. "
+            "⚡ Grid: %(grid_power)s kW, ☀️ Solar: %(solar_power)s kW",
+            logging.WARNING,
+            grid_power=grid_power,
+            solar_power=total_solar_production,
+        )
+    else:
+        site.cycle_record.update(
+            grid_power=grid_power,
+            solar_power=total_solar_production,
+            bess_power=bess_power,
+            bess_soc=bess_soc,
+            load_power=load_power,
+        )
+        site.forecaster.update(
+            snapshot["timestamp"], load_power, total_solar_production
+        )
+        site.telemetry.append(
+            snapshot["timestamp"],
+            grid_power,
+            total_solar_production,
+            bess_power,
+            bess_soc,
+            load_power,
+        )
+        site.telemetry_publisher.add(
+            snapshot["timestamp"],
+            grid_power,
+            total_solar_production,
+            bess_power,
+            bess_soc,
+            load_power,
+        )
+
+        site.log_event(
+            "telemetry",
+            "⚡ Grid: %(grid_power)s kW, ☀️ Solar: %(solar_power)s kW, "
+            "🔋 BESS Power: %(bess_power)s kW, SOC: %(bess_soc)s%% "
+            "🏠 Load : %(load_power)s kW🔋 BESS Faults: %(faults)s",
+            grid_power=grid_power,
+            solar_power=total_solar_production,
+            bess_power=bess_power,
+            bess_soc=bess_soc,
+            load_power=load_power,
+            faults=len(active_faults),
+        )
 
-    bess_state = read_register(
-        bess_client,
-        25134,
-        BESS_ID,
-        "uint16",
-        1,
+    with site.tracer.span("decide"):
+        decide(
+            site,
+            bess_client,
+            data_management_client,
+            within_timer,
+            bess_faults,
+            grid_power,
+            bess_power,
+            bess_soc,
+            total_solar_production,
+            load_power,
+        )
+
+
+# 🧭 Thực hiện nhánh của cây quyết định zero-export (zero_export.choose_branch):
+# ghi lệnh cho BESS / inverter (mọi công suất theo kW)
+def decide(
+    site,
+    bess_client,
+    data_management_client,
+    within_timer,
+    bess_faults,
+    grid_power,
+    bess_power,
+    bess_soc,
+    total_solar_production,
+    load_power,
+):
+    params = site.decision_params
+    branch = choose_branch(
+        grid_power,
+        bess_power,
+        bess_soc,
+        total_solar_production,
+        within_timer,
+        bess_faults,
+        params,
     )
+    # Lệnh công suất BESS (kW), chỉ tính trong nhánh cần điều khiển BESS
+    # để tích phân của bộ điều khiển không tích lũy khi BESS không được điều khiển
+    command = 0.0
+    if branch in CONTROLLED_BRANCHES:
+        command = site.controller.update(
+            grid_power,
+            bess_power,
+            total_solar_production,
+            load_power,
+            CONTROL_PERIOD,
+            site.forecaster.forecast(CONTROL_PERIOD),
+        )
 
-    bess_soc = bess_soc / 10
-    # bess_client.close()
-    return bess_power, bess_soc, bess_state
+    # Lệnh ghi của nhánh theo bảng dùng chung với replay.py (zero_export)
+    pv_mode = PV_LIMIT_MODES.get(branch, PV_HOLD)
+    if pv_mode != PV_HOLD:
+        pv_limit = float(
+            pv_limit_setpoint(pv_mode, grid_power, total_solar_production, site.pv_max)
+        )
+        site.write(data_management_client, "pv_limit", pv_limit)
+        if pv_mode == PV_MAX:
+            site.write(data_management_client, "pv_limit_percent", 100)
+    setpoint_mode = SETPOINT_MODES.get(branch, SETPOINT_HOLD)
+    if setpoint_mode != SETPOINT_HOLD and bess_client:
+        site.write(
+            bess_client,
+            "charge_power",
+            bess_setpoint(setpoint_mode, command, params["pcs_gain"]),
+        )
 
+    if branch == "stable":
+        site.log_event("stable", "✅ Hệ thống chạy ổn định")
 
-def zero_bess():
-    while True:
-        # if keyboard.is_pressed("q"):
-        #     print("\nChương trình dừng lại!")
-        #     break
-        try:
+    elif branch == "discharge_increase":
+        site.log_event(
+            "discharge_increase",
+            "🔌 Điều chỉnh tăng công suất xả BESS: %(power)s kW.",
+            power=round(abs(command), 1),
+        )
 
-            bess_client = connect_modbus_device(BESS_IP)
-            data_management_client = connect_modbus_device(DATA_MANAGEMENT_IP)
-            bess_power, bess_soc, PCS_state = read_bess_data()
+    elif branch == "charge_decrease":
+        site.log_event(
+            "charge_decrease",
+            "🔌 Điều chỉnh giảm công suất sạc BESS: %(power)s kW.",
+            power=round(command, 1),
+        )
 
-            faults_word = read_register(bess_client, 25132, BESS_ID, "uint16", 4)
-            if decode_faults(faults_word):
-                bess_faults = True
-            else:
-                bess_faults = False
-
-            total_solar_production = read_register(
-                data_management_client,
-                TOTAL_INVERTER_POWER_REG,
-                DATA_MANAGEMENT_ID,
-                "int32",
-                2,
-            )
-            load_1 = read_register(
-                data_management_client, LOAD_CONSUMPTION_REG, LOAD_METER_ID, "uint32", 2
-            )
-            time.sleep(0.1)
-            load_2 = read_register(
-                data_management_client,
-                LOAD_CONSUMPTION_REG_2,
-                LOAD_METER_ID,
-                "uint32",
-                2,
-            )
-            if is_within_timer() and total_solar_production > 0 and enb_inv == True:
-                write_register(
-                    data_management_client,
-                    MAX_POWER_REG,
-                    value=0,
-                    unit_id=DATA_MANAGEMENT_ID,
-                    data_type="uint32",
-                )
-                time.sleep(5)
-                enb_inv = False
-                print("🔌 Đã tắt inverter. Đang xả BESS.")
-                logger.info("🔌 Đã tắt inverter. Đang xả BESS.")
-                continue
-
-            elif (
-                not is_within_timer()
-                and total_solar_production < 5
-                and enb_inv == False
-            ) or (bess_soc <= 10 and enb_inv == False):
-                write_register(
-                    data_management_client,
-                    MAX_POWER_REG,
-                    value=PVmax,
-                    unit_id=DATA_MANAGEMENT_ID,
-                    data_type="uint32",
-                )
-                write_register(
-                    bess_client,
-                    register=BESS_CHARGE_POWER_REG,
-                    value=0,
-                    unit_id=1,
-                    data_type="int16",
-                )
+    elif branch == "bess_full_raise_pv":
+        site.log_event(
+            "bess_full_raise_pv",
+            "📌 Thiếu công suất . Tăng công suất inverter %(pv_power)s kW. "
+            "🔌 Bess đã đầy. Điều chỉnh công suất sạc BESS: 0 kW.",
+            pv_power=grid_power + total_solar_production,
+        )
 
-                enb_inv = True
-                print(
-                    "🔌 Hết thời gian xả - Đã tắt xả BESS. Bật tối đa công xuất inverter."
-                )
-                logger.info(
-                    "🔌 Hết thời gian xả - Đã tắt xả BESS. Bật tối đa công xuất inverter."
-                )
-            if not data_management_client:
-                print("❌ Không thể kết nối với Data Management. Dừng chương trình.")
-                logger.error(
-                    "❌ Không thể kết nối với Data Management. Dừng chương trình."
-                )
-                break
-
-            # ☀️ Đọc tổng công suất inverter
-            total_solar_production = read_register(
-                data_management_client,
-                TOTAL_INVERTER_POWER_REG,
-                DATA_MANAGEMENT_ID,
-                "int32",
-                2,
-            )
-            if total_solar_production <= 0:
-                total_solar_production = 0
-
-            # ❌ Nếu có lỗi khi đọc, bỏ qua vòng lặp này
-            if None in [load_1, load_2, total_solar_production, bess_power, bess_soc]:
-                print("⚠️ Dữ liệu thiếu, bỏ qua vòng lặp.")
-                logger.warning("⚠️ Dữ liệu thiếu, bỏ qua vòng lặp.")
-                time.sleep(0.1)
-                continue
-
-            grid_power = (load_1 - load_2) / 1000
-            total_solar_production = total_solar_production / 1000
-
-            print(
-                f"⚡ Grid: {grid_power} kW, ☀️ Solar: {total_solar_production} kW, "
-                f"🔋 BESS Power: {bess_power/10} kW, SOC: {bess_soc}% "
-                f"🏠 Load : {grid_power+total_solar_production+round(bess_power*0.1,2)} kW"
-                f"🔋 BESS State: {decode_faults(faults_word)}"
-            )
-            logger.info(
-                f"⚡ Grid: {grid_power} kW, ☀️ Solar: {total_solar_production} kW, "
-                f"🔋 BESS Power: {bess_power/10} kW, SOC: {bess_soc}% "
-                f"🏠 Load : {grid_power+total_solar_production+round(bess_power*0.1,2)} kW"
-                f"🔋 BESS State: {decode_faults(faults_word)}"
+    elif branch == "discharge_start":
+        site.log_event(
+            "discharge_start",
+            "🔌 Đến giờ xả. Bắt đầu xả BESS: %(power)s kW.",
+            power=round(abs(command)),
+        )
+
+    elif branch == "pv_max":
+        site.log_event(
+            "pv_max",
+            "📌 Thiếu công suất . Tăng công suất inverter %(pv_power)s kW",
+            pv_power=site.pv_max,
+        )
+
+    elif branch == "pv_increase":
+        site.log_event(
+            "pv_increase",
+            "📌 Thiếu công suất . Tăng công suất inverter %(pv_power)s kW",
+            pv_power=grid_power + total_solar_production,
+        )
+
+    elif branch == "standby":
+        site.log_event(
+            "standby", "🔌 Hết thời gian xả BESS. Chuyển mode standby: 0 kW."
+        )
+
+    elif branch == "charge_increase":
+        if bess_client:  # xem lại vòng lặp có cần hay ko
+            site.log_event(
+                "charge_increase",
+                "🔌 Solar dư - Điều chỉnh tăng công suất sạc BESS: %(power)s kW.",
+                power=round(command, 1),
             )
 
-            if grid_power > -0.1 and grid_power < 0.2:
-                print("✅ Hệ thống chạy ổn định")
-                logger.info("✅ Hệ thống chạy ổn định")
-
-            elif grid_power > 0:
-
-                deficit = grid_power
-
-                if is_within_timer() and bess_soc > 10 and total_solar_production <= 10:
-
-                    # trong giờ xả ít , tăng công suất xả, solar < 10
-                    print("AAAAAAAAAAAaa")
-                    discharge_power = abs(grid_power * 10 + bess_power)
-
-                    if bess_client:
-                        write_register(
-                            bess_client,
-                            register=BESS_CHARGE_POWER_REG,
-                            value=min(round(discharge_power) * pcs_gain, 1200),
-                            unit_id=1,
-                            data_type="int16",
-                        )
-                    print(
-                        f"🔌 Điều chỉnh tăng công suất xả BESS: {min(round(discharge_power)/10,1200)} kW."
-                    )
-                    logger.info(
-                        f"🔌 Điều chỉnh tăng công suất xả BESS: {min(round(discharge_power)/10,1200)} kW."
-                    )
-                elif (
-                    bess_power < -0.5
-                    and bess_soc < 100
-                    and total_solar_production > 5
-                    and not is_within_timer()
-                    and bess_faults == False
-                ):
-                    # solar cấp ko đủ ,đang sạc bằng lưới -> giảm công suất
-                    print("BBBBBBBBBBBB")
-                    write_register(
-                        bess_client,
-                        register=BESS_CHARGE_POWER_REG,
-                        value=max(
-                            round(grid_power * 10 + bess_power / 1) * pcs_gain, -1200
-                        ),
-                        unit_id=1,
-                        data_type="int16",
-                    )
-                    print(
-                        f"🔌 Điều chỉnh giảm công suất sạc BESS: {max(round((grid_power*10 + bess_power/1))/10,-1200)} kW."
-                    )
-                    logger.info(
-                        f"🔌 Điều chỉnh giảm công suất sạc BESS: {max(round((grid_power*10 + bess_power/1))/10,-1200)} kW."
-                    )
-
-                elif not is_within_timer() and bess_soc >= 100:
-                    # bess đầy, lấy lưới dùng -> tăng solar
-                    print("CCCCCCCCCCCC")
-                    write_register(
-                        data_management_client,
-                        MAX_POWER_REG,
-                        value=min(
-                            round((deficit + total_solar_production) * 1000), PVmax
-                        ),
-                        unit_id=DATA_MANAGEMENT_ID,
-                        data_type="uint32",
-                    )
-                    print(
-                        f"📌 Thiếu công suất . Tăng công suất inverter {deficit + total_solar_production} kW"
-                    )
-                    logger.info(
-                        f"📌 Thiếu công suất . Tăng công suất inverter {deficit + total_solar_production} kW"
-                    )
-                    write_register(
-                        bess_client,
-                        register=BESS_CHARGE_POWER_REG,
-                        value=0,
-                        unit_id=1,
-                        data_type="int16",
-                    )
-                    print(f"🔌 Bess đã đầy. Điều chỉnh công suất sạc BESS: {0} kW.")
-                    logger.info(
-                        f"🔌 Bess đã đầy. Điều chỉnh công suất sạc BESS: {0} kW."
-                    )
-
-                else:
-
-                    if is_within_timer():
-                        write_register(
-                            bess_client,
-                            register=BESS_CHARGE_POWER_REG,
-                            value=min(
-                                round(grid_power * 10 + bess_power) * pcs_gain, 1200
-                            ),
-                            unit_id=1,
-                            data_type="int16",
-                        )
-                        print(
-                            f"🔌 Đến giờ xả. Bắt đầu xả BESS: {min(round(abs(grid_power*10+ bess_power)/10),1200)} kW."
-                        )
-                        logger.info(
-                            f"🔌 Đến giờ xả. Bắt đầu xả BESS: {min(round(abs(grid_power*10+ bess_power)/10),1200)} kW."
-                        )
-
-                    elif bess_soc < 100 and bess_faults == False:
-
-                        write_register(
-                            data_management_client,
-                            MAX_POWER_REG,
-                            value=PVmax,
-                            unit_id=DATA_MANAGEMENT_ID,
-                            data_type="uint32",
-                        )
-
-                        write_register(
-                            data_management_client,
-                            40016,
-                            value=100,
-                            unit_id=DATA_MANAGEMENT_ID,
-                            data_type="int16",
-                        )
-
-                        print(f"📌 Thiếu công suất . Tăng công suất inverter {150} kW")
-                        logger.info(
-                            f"📌 Thiếu công suất . Tăng công suất inverter {150} kW"
-                        )
-
-                    else:
-
-                        write_register(
-                            data_management_client,
-                            MAX_POWER_REG,
-                            value=min(
-                                round((deficit + total_solar_production) * 1000), PVmax
-                            ),
-                            unit_id=DATA_MANAGEMENT_ID,
-                            data_type="uint32",
-                        )
-
-                        print(
-                            f"📌 Thiếu công suất . Tăng công suất inverter {grid_power+total_solar_production} kW"
-                        )
-                        logger.info(
-                            f"📌 Thiếu công suất . Tăng công suất inverter {grid_power+total_solar_production} kW"
-                        )
-            elif grid_power < 0:
-
-                excess_energy = abs(grid_power)
-
-                if (
-                    bess_soc < 100
-                    and total_solar_production >= 0
-                    and not is_within_timer()
-                    and bess_faults == False
-                ):
-
-                    # Solar dư đang dư
-                    if bess_power > 3:
-                        write_register(
-                            bess_client,
-                            register=BESS_CHARGE_POWER_REG,
-                            value=0,
-                            unit_id=1,
-                            data_type="int16",
-                        )
-                        print(f"🔌 Hết thời gian xả BESS. Chuyển mode standby: {0} kW.")
-                        logger.info(
-                            f"🔌 Hết thời gian xả BESS. Chuyển mode standby: {0} kW."
-                        )
-                        time.sleep(5)
-                        continue
-
-                    if (
-                        bess_client and total_solar_production >= 5
-                    ):  # xem lại vòng lặp có cần hay ko
-
-                        write_register(
-                            bess_client,
-                            register=BESS_CHARGE_POWER_REG,
-                            value=max(
-                                round(-excess_energy * 10 + bess_power * 1) * pcs_gain,
-                                -1200,
-                            ),
-                            unit_id=1,
-                            data_type="int16",
-                        )
-                        print(
-                            f"🔌 Solar dư - Điều chỉnh tăng công suất sạc BESS: {max(round((-excess_energy * 10 + bess_power * 1))/10,-1200)} kW."
-                        )
-                        logger.info(
-                            f"🔌 Solar dư - Điều chỉnh tăng công suất sạc BESS: {max(round((-excess_energy * 10 + bess_power * 1))/10,-1200)} kW."
-                        )
-
-                elif (
-                    bess_soc >= 100 and total_solar_production > 0
-                ) or bess_faults == True:
-                    # bess đầy, giảm công suất inverter
-
-                    write_register(
-                        data_management_client,
-                        MAX_POWER_REG,
-                        value=max(
-                            round((abs(total_solar_production - excess_energy)) * 1000),
-                            0,
-                        ),
-                        unit_id=DATA_MANAGEMENT_ID,
-                        data_type="uint32",
-                    )
-
-                    print(
-                        f"📌 Công suất dư thừa, giảm công suất inverter {max(round((abs(total_solar_production - excess_energy)) * 1000), 0)}"
-                    )
-                    logger.info(
-                        f"📌 Công suất dư thừa, giảm công suất inverter {max(round((abs(total_solar_production - excess_energy)) * 1000), 0)}"
-                    )
-                elif bess_power > 0 and bess_soc >= 10:
-                    # bess đang xả, giảm công suất xả
-                    write_register(
-                        bess_client,
-                        register=BESS_CHARGE_POWER_REG,
-                        value=min(
-                            round(abs(grid_power * 10 + bess_power)) * pcs_gain, 1200
-                        ),
-                        unit_id=1,
-                        data_type="int16",
-                    )
-                    print(
-                        f"🔌 Điều chỉnh công suất xả BESS: {min(round(abs(grid_power*10 + bess_power))/10,1200)} kW."
-                    )
-                    logger.info(
-                        f"🔌 Điều chỉnh công suất xả BESS: {min(round(abs(grid_power*10 + bess_power))/10,1200)} kW."
-                    )
-                else:
-                    print("Lưới < 0, sai hết")
-
-            time.sleep(5)
-            data_management_client.close()
-            bess_client.close()
-            print("🔄 Chờ 5 giây để cập nhật dữ liệu mới.")
-            logger.info("🔄 Chờ 5 giây để cập nhật dữ liệu mới.")
-
-        except:
-            print("🛑 Có lỗi xảy ra trong vòng lập. thực hiện vòng lập khác.")
-            logger.error("🛑 Có lỗi xảy ra trong vòng lập. thực hiện vòng lập khác.")
-            time.sleep(0.3)
-            continue
+    elif branch == "pv_curtail":
+        site.log_event(
+            "pv_curtail",
+            "📌 Công suất dư thừa, giảm công suất inverter %(pv_limit)s kW",
+            pv_limit=round(pv_limit, 3),
+        )
 
-        finally:
-            if data_management_client:
-                data_management_client.close()
-            time.sleep(0.3)
-            continue
+    elif branch == "discharge_decrease":
+        site.log_event(
+            "discharge_decrease",
+            "🔌 Điều chỉnh công suất xả BESS: %(power)s kW.",
+            power=round(abs(command), 1),
+        )
 
+    elif branch == "no_action":
+        site.log_event("no_action", "Lưới < 0, sai hết")
 
-if __name__ == "__main__":
 
-    load_discharge_data_from_file()
-    print("🚀 Bắt đầu quản lý năng lượng...")
+def zero_bess(site):
+    scheduler = CycleScheduler(
+        CONTROL_PERIOD,
+        reporters=[site.report],
+        next_wakeup=site.next_timer_wakeup,
+    )
+    scheduler.run(site.step)
+
+
+# Gửi healthcheck của các site định kỳ
+def send_healthcheck(client, sites):
+    while True:
+        for site in sites:
+            site.send_healthcheck(client)
+        threading.Event().wait(10)  # Chờ 2 phút trước khi gửi lại
+
+
+def mqtt_handler(
+    broker: str,
+    port: int,
+    username: str,
+    password: str,
+    sites,
+    client_id: str = "mqtt_client",
+):
+    client = mqtt.Client(client_id)
+    client.username_pw_set(username, password)
+
+    client.connect(broker, port, 60)
+    for site in sites:
+        site.attach_mqtt(client)
+
+    # Bắt đầu gửi healthcheck định kỳ mỗi 2 phút
+    threading.Thread(target=send_healthcheck, args=(client, sites), daemon=True).start()
+
+    client.loop_forever()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    site = Site(mqtt_topic=MQTT_TOPIC)
+    if METRICS_PORT:
+        start_http_server(
+            METRICS_PORT, routes={**trace_routes([site]), **telemetry_routes([site])}
+        )
+    site.load_discharge_data_from_file()
     logger.info("🚀 Bắt đầu quản lý năng lượng...")
 
-    data_management_client = connect_modbus_device(DATA_MANAGEMENT_IP)
+    data_management_client = site.connect(site.data_management_ip)
     if not data_management_client:
-        print("❌ Không thể kết nối với Data Management. Dừng chương trình.")
         logger.error("❌ Không thể kết nối với Data Management. Dừng chương trình.")
 
-    write_register(
-        data_management_client,
-        MAX_POWER_REG,
-        value=PVmax,
-        unit_id=DATA_MANAGEMENT_ID,
-        data_type="uint32",
-    )
+    site.write(data_management_client, "pv_limit", site.pv_max)
     time.sleep(5)
-    enb_inv = True
     threading.Thread(
         target=mqtt_handler,
-        args=(
-            "core.ziot.vn",
-            5000,
-            "CONFIG/DO000000/PO000012/SI0000014/PL000027/dischargeConfig",
-            "iot2022",
-            "iot2022",
-        ),
+        args=(MQTT_BROKER, MQTT_PORT, MQTT_USERNAME, MQTT_PASSWORD, [site]),
     ).start()
-    threading.Thread(target=zero_bess).start()
+    threading.Thread(target=zero_bess, args=(site,)).start()
@@ -0,0 +1,276 @@
+from pymodbus.constants import Endian
+import json
+import os
+import time
+
+from read_planner import MAX_READ_GAP, plan_reads
+from register_codec import TYPE_FORMATS, get_codec
+
+# 🗂️ Hồ sơ thiết bị: bản đồ thanh ghi của một model PCS/đồng hồ/data manager khai báo
+# bằng JSON trong thư mục profiles/, biên dịch một lần lúc khởi động thành khối đọc
+# và hàm mã hóa/giải mã, chu kỳ điều khiển không tra bảng hay so chuỗi kiểu nữa
+# Thêm model mới = viết một file hồ sơ, không sửa code
+#
+# {
+#     "model": "PCS",
+#     "byteorder": "big",            # Thứ tự byte trong thanh ghi
+#     "wordorder": "big",            # Thứ tự thanh ghi của giá trị 32-bit
+#     "points": {
+#         "bess_soc": {"address": 587, "type": "uint16", "scale": 0.1, "unit": "%"},
+#         "faults_word": {"address": 25132, "type": "raw", "count": 4},
+#         "charge_power": {"address": 618, "type": "int16", "scale": 0.1,
+#                          "access": "write", "min": -120, "max": 120,
+#                          "deadband": 0.2, "min_interval": 1}
+#     }
+# }
+# - scale: giá trị kỹ thuật = thanh ghi * scale (mặc định 1)
+# - access: "read" (mặc định) hoặc "write" (điểm lệnh, không đọc mỗi chu kỳ)
+# - poll: "cycle" đọc mỗi chu kỳ (mặc định), "slow" đọc mỗi SLOW_POLL_INTERVAL giây
+# - min/max, deadband (đơn vị kỹ thuật), min_interval (giây): giới hạn của điểm ghi
+
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")
+SLOW_POLL_INTERVAL = 60
+POLL_CLASSES = ("cycle", "slow")
+ACCESS_MODES = ("read", "write")
+ENDIANNESS = {"big": Endian.Big, "little": Endian.Little}
+
+# Khoảng giá trị thanh ghi của từng kiểu nguyên, dùng để kẹp lệnh ghi
+TYPE_RANGES = {
+    "int16": (-(2**15), 2**15 - 1),
+    "uint16": (0, 2**16 - 1),
+    "int32": (-(2**31), 2**31 - 1),
+    "uint32": (0, 2**32 - 1),
+}
+
+
+# Hệ số 0.1, 0.001... được đổi thành phép chia cho 10, 1000 để kết quả đúng như
+# số thập phân (587 / 10 = 58.7, còn 3 * 0.1 = 0.30000000000000004)
+def _divisor(scale):
+    divisor = round(1 / scale)
+    if divisor > 1 and 1 / divisor == scale:
+        return divisor
+    return None
+
+
+def _decoder(scale):
+    if scale == 1:
+        return None
+    divisor = _divisor(scale)
+    if divisor is not None:
+        return lambda value: value / divisor
+    return lambda value: value * scale
+
+
+# Giới hạn min/max (đơn vị kỹ thuật) đổi sang thanh ghi, không vượt khoảng của kiểu
+def _raw_limits(type, scale, minimum, maximum):
+    low, high = TYPE_RANGES[type]
+    raw_min, raw_max = (
+        None if limit is None else round(limit / scale) for limit in (minimum, maximum)
+    )
+    if scale < 0:
+        raw_min, raw_max = raw_max, raw_min
+    if raw_min is not None:
+        low = max(low, raw_min)
+    if raw_max is not None:
+        high = min(high, raw_max)
+    return low, high
+
+
+def _encoder(scale, low, high):
+    divisor = _divisor(scale)
+    if scale == 1:
+        to_raw = round
+    elif divisor is not None:
+        to_raw = lambda value: round(value * divisor)
+    else:
+        to_raw = lambda value: round(value / scale)
+    return lambda value: max(low, min(to_raw(value), high))
+
+
+# 📍 Một điểm đã biên dịch
+# decode(thanh ghi đã giải mã kiểu) -> đơn vị kỹ thuật, encode(đơn vị kỹ thuật) -> số
+# nguyên ghi vào thanh ghi (làm tròn, kẹp trong min/max và khoảng của kiểu)
+class ProfilePoint:
+    __slots__ = (
+        "name",
+        "address",
+        "type",
+        "count",
+        "scale",
+        "unit",
+        "access",
+        "poll",
+        "minimum",
+        "maximum",
+        "deadband",
+        "min_interval",
+        "codec",
+        "decode",
+        "encode",
+    )
+
+    def __init__(
+        self,
+        name,
+        address,
+        type,
+        count=None,
+        scale=1,
+        unit="",
+        access="read",
+        poll="cycle",
+        min=None,
+        max=None,
+        deadband=0,
+        min_interval=0,
+        byteorder=Endian.Big,
+        wordorder=Endian.Big,
+    ):
+        if type != "raw" and type not in TYPE_FORMATS:
+            raise ValueError(f"❌ Điểm {name}: kiểu {type} không được hỗ trợ")
+        if access not in ACCESS_MODES:
+            raise ValueError(f"❌ Điểm {name}: access {access} không hợp lệ")
+        if poll not in POLL_CLASSES:
+            raise ValueError(f"❌ Điểm {name}: poll {poll} không hợp lệ")
+        if type == "raw" and access == "write":
+            raise ValueError(f"❌ Điểm {name}: điểm raw không ghi được")
+        if not scale:
+            raise ValueError(f"❌ Điểm {name}: scale phải khác 0")
+        self.name = name
+        self.address = address
+        self.type = type
+        self.count = count or (TYPE_FORMATS[type][1] if type in TYPE_FORMATS else 1)
+        self.scale = scale
+        self.unit = unit
+        self.access = access
+        self.poll = poll
+        self.minimum = min
+        self.maximum = max
+        self.min_interval = min_interval
+
+        self.decode = _decoder(scale)
+        self.codec = None
+        self.encode = None
+        self.deadband = 0
+        if type in TYPE_RANGES:
+            self.encode = _encoder(scale, *_raw_limits(type, scale, min, max))
+            self.deadband = abs(round(deadband / scale))
+        if type != "raw":
+            self.codec = get_codec(type, self.count, byteorder, wordorder)
+
+    # Giá trị kỹ thuật -> danh sách thanh ghi (dùng cho mô phỏng và kiểm tra)
+    def to_registers(self, value):
+        return self.codec.encode(self.encode(value))
+
+    def from_registers(self, registers):
+        value = self.codec.decode(registers)[0]
+        return value if self.decode is None else self.decode(value)
+
+
+# 📄 Hồ sơ của một model thiết bị
+class DeviceProfile:
+    def __init__(self, model, points, byteorder="big", wordorder="big"):
+        try:
+            self.byteorder = ENDIANNESS[byteorder]
+            self.wordorder = ENDIANNESS[wordorder]
+        except KeyError as e:
+            raise ValueError(f"❌ Thứ tự byte {e} không hợp lệ") from None
+        self.model = model
+        self.points = {}
+        for name, spec in points.items():
+            try:
+                self.points[name] = ProfilePoint(
+                    name,
+                    byteorder=self.byteorder,
+                    wordorder=self.wordorder,
+                    **spec,
+                )
+            except TypeError as e:
+                raise ValueError(f"❌ Điểm {name} của {model}: {e}") from e
+
+    def __getitem__(self, name):
+        return self.points[name]
+
+    # Các điểm cần đọc của một lớp poll, theo định dạng của plan_reads()
+    def read_points(self, unit_id, poll="cycle"):
+        return {
+            name: (unit_id, point.address, point.type, point.count, point.decode)
+            for name, point in self.points.items()
+            if point.access == "read" and point.poll == poll
+        }
+
+    def write_points(self):
+        return {
+            name: point
+            for name, point in self.points.items()
+            if point.access == "write"
+        }
+
+
+_profile_cache = {}
+
+
+# Nạp hồ sơ theo tên (profiles/<tên>.json) hoặc đường dẫn file, dùng chung giữa các site
+def load_profile(name):
+    if os.sep in name or name.endswith(".json"):
+        path = os.path.abspath(name)
+    else:
+        path = os.path.join(PROFILE_DIR, name + ".json")
+    profile = _profile_cache.get(path)
+    if profile is None:
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, json.JSONDecodeError) as e:
+            raise ValueError(f"❌ Không đọc được hồ sơ thiết bị {path}: {e}") from e
+        profile = DeviceProfile(
+            data.get("model", name),
+            data["points"],
+            data.get("byteorder", "big"),
+            data.get("wordorder", "big"),
+        )
+        _profile_cache[path] = profile
+    return profile
+
+
+# 📋 Kế hoạch đọc của một địa chỉ IP (có thể nhiều unit/thiết bị)
+# devices: [(unit_id, DeviceProfile)]; điểm "slow" được đọc lại sau mỗi slow_interval
+# giây, giữa 2 lần đọc dùng giá trị cũ
+class ReadPlan:
+    def __init__(self, devices, slow_interval=SLOW_POLL_INTERVAL, max_gap=MAX_READ_GAP):
+        names = set()
+        for unit_id, profile in devices:
+            duplicates = names.intersection(profile.points)
+            if duplicates:
+                raise ValueError(f"❌ Điểm {sorted(duplicates)} bị khai báo trùng")
+            names.update(profile.points)
+        self.cycle = self._compile(devices, "cycle", max_gap)
+        self.slow = self._compile(devices, "slow", max_gap)
+        self.slow_interval = slow_interval
+        self.slow_values = {}
+        self._next_slow = 0.0
+
+    @staticmethod
+    def _compile(devices, poll, max_gap):
+        plan = []
+        for unit_id, profile in devices:
+            plan.extend(
+                plan_reads(
+                    profile.read_points(unit_id, poll),
+                    max_gap=max_gap,
+                    byteorder=profile.byteorder,
+                    wordorder=profile.wordorder,
+                )
+            )
+        return plan
+
+    # Đến lúc đọc lại các điểm "slow" chưa
+    def slow_due(self, now=None):
+        if not self.slow:
+            return False
+        if now is None:
+            now = time.monotonic()
+        if now < self._next_slow:
+            return False
+        self._next_slow = now + self.slow_interval
+        return True
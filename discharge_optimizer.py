@@ -0,0 +1,461 @@
+import argparse
+import datetime
+import json
+import os
+import time
+
+import numpy as np
+import paho.mqtt.publish as publish
+
+import bess_control
+from device_profile import load_profile
+from discharge_schedule import (
+    ALL_DAYS,
+    MINUTES_PER_DAY,
+    atomic_write_json,
+    compile_schedule,
+)
+from history_store import HistoryStore
+from replay import BESS_CAPACITY, synthetic_day
+from zero_export import DEFAULT_PARAMS
+
+# 🗓️ Tối ưu khung giờ xả BESS (DISCHARGE_START/END) theo lịch sử tải/PV và giá điện
+# theo khung giờ (TOU), thay cho việc chọn tay rồi gửi qua topic dischargeConfig
+# - Hồ sơ tải và PV trung bình mỗi SLOT_MINUTES phút lấy từ kho lịch sử của site
+# - Quy hoạch động ngược trên lưới SOC rời rạc (SOC_STEPS mức), trạng thái
+#   (SOC, đang trong khung xả), mỗi bước chọn xả hay không; mở thêm một khung xả bị phạt
+#   switch_penalty để lịch không bị vụn
+# - Mô hình giống cây quyết định zero-export: trong khung xả inverter bị tắt và BESS cấp
+#   tải trong giới hạn công suất tới SOC sàn, ngoài khung xả BESS chỉ sạc bằng PV dư
+# - Năng lượng còn lại cuối ngày được tính theo giá rẻ nhất (xả bù được ngày hôm sau)
+# - Kết quả theo định dạng discharge_data (time_conf.txt / topic dischargeConfig)
+# Một ngày 5 phút (288 bước × 201 mức SOC) giải trong vài chục ms
+#
+# Chạy hằng đêm: python discharge_optimizer.py --history history/PL000027 --days 14 \
+#                    --tariff tariff.json --output time_conf_PL000027.txt
+# Gửi thẳng cho site đang chạy: thêm --publish (topic dischargeConfig của site)
+
+SLOT_MINUTES = 5
+SOC_STEPS = 201  # Lưới SOC 0.5 %
+CHARGE_EFFICIENCY = 0.95
+DISCHARGE_EFFICIENCY = 0.95
+SWITCH_PENALTY = 1000.0  # Chi phí ảo (đơn vị giá) cho mỗi khung xả mở thêm
+
+# Giá điện theo khung giờ (đơn vị/kWh), các khoảng [start, end) phủ kín 24 giờ,
+# khoảng có end < start là qua nửa đêm
+# Ví dụ theo biểu giá kinh doanh 3 khung giờ: thấp điểm, bình thường, cao điểm
+DEFAULT_TARIFF = [
+    {"start": "22:00", "end": "04:00", "price": 1190},
+    {"start": "04:00", "end": "09:30", "price": 1833},
+    {"start": "09:30", "end": "11:30", "price": 3398},
+    {"start": "11:30", "end": "17:00", "price": 1833},
+    {"start": "17:00", "end": "20:00", "price": 3398},
+    {"start": "20:00", "end": "22:00", "price": 1833},
+]
+
+CHARGE_POWER = load_profile(bess_control.BESS_PROFILE)["charge_power"]
+
+
+def _minute(text):
+    try:
+        hour, minute = (int(part) for part in text.split(":"))
+    except (AttributeError, ValueError):
+        raise ValueError(f"❌ Giờ {text!r} không hợp lệ (HH:MM)") from None
+    if not (0 <= hour <= 24 and 0 <= minute < 60) or hour * 60 + minute > 1440:
+        raise ValueError(f"❌ Giờ {text!r} không hợp lệ (HH:MM)")
+    return hour * 60 + minute
+
+
+# 💰 Giá của từng bước thời gian trong ngày (theo phút đầu bước)
+def tariff_prices(tariff, slot_minutes=SLOT_MINUTES):
+    prices = np.full(MINUTES_PER_DAY, np.nan)
+    for period in tariff:
+        try:
+            start = _minute(period["start"])
+            end = _minute(period["end"])
+            price = float(period["price"])
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"❌ Khung giá không hợp lệ: {period!r}") from e
+        if start < end:
+            prices[start:end] = price
+        else:
+            prices[start:] = price
+            prices[:end] = price
+    if np.isnan(prices).any():
+        missing = int(np.flatnonzero(np.isnan(prices))[0])
+        raise ValueError(
+            f"❌ Biểu giá không phủ {missing // 60:02d}:{missing % 60:02d}"
+        )
+    return prices[::slot_minutes].copy()
+
+
+# 📈 Hồ sơ tải/PV trung bình theo bước thời gian trong ngày từ kho lịch sử
+# first_day..last_day tính cả hai đầu
+# Trả về (tải, PV, SOC gần nhất) hoặc None nếu không có dữ liệu
+# Lưu ý: PV đã ghi là công suất sau khi bị cắt (và bằng 0 khi inverter bị tắt trong khung
+# xả cũ), nên PV khả dụng của những lúc đó bị đánh giá thấp
+def history_profiles(store, first_day, last_day, slot_minutes=SLOT_MINUTES):
+    slots = MINUTES_PER_DAY // slot_minutes
+    load_sum = np.zeros(slots)
+    solar_sum = np.zeros(slots)
+    counts = np.zeros(slots)
+    last_soc = None
+    day = first_day
+    while day <= last_day:
+        start = datetime.datetime.combine(day, datetime.time()).timestamp()
+        rows = store.query(start, start + 86400)
+        day += datetime.timedelta(days=1)
+        valid = ~(np.isnan(rows["load_power"]) | np.isnan(rows["solar_power"]))
+        rows = rows[valid]
+        if not len(rows):
+            continue
+        slot = ((rows["timestamp"] - start) // (slot_minutes * 60)).astype(np.int64)
+        slot = np.minimum(slot, slots - 1)
+        load_sum += np.bincount(slot, rows["load_power"], slots)
+        solar_sum += np.bincount(slot, np.maximum(rows["solar_power"], 0), slots)
+        counts += np.bincount(slot, minlength=slots)
+        soc = rows["bess_soc"][~np.isnan(rows["bess_soc"])]
+        if len(soc):
+            last_soc = float(soc[-1])
+    if not counts.any():
+        return None
+    # Bước không có dữ liệu: nội suy từ các bước lân cận (vòng qua nửa đêm)
+    seen = np.flatnonzero(counts)
+    profiles = []
+    for total in (load_sum, solar_sum):
+        mean = total[seen] / counts[seen]
+        profiles.append(np.interp(np.arange(slots), seen, mean, period=slots))
+    return profiles[0], profiles[1], last_soc
+
+
+# 🔋 Một bước của mô hình site cho mọi mức SOC, ở trong hoặc ngoài khung xả
+# Trả về (SOC sau bước, công suất nhập lưới kW)
+def _step(
+    soc,
+    load,
+    solar,
+    discharging,
+    capacity,
+    max_power,
+    soc_min,
+    soc_max,
+    hours,
+):
+    if discharging:
+        # Trong khung xả inverter bị tắt, BESS cấp tải tới SOC sàn; hết năng lượng thì
+        # inverter được bật lại (nhánh inverter_on) nhưng không sạc trong giờ xả
+        available = np.maximum(soc - soc_min, 0) / 100 * capacity
+        power = np.minimum(
+            min(load, max_power), available * DISCHARGE_EFFICIENCY / hours
+        )
+        grid = np.where(power > 0, load - power, max(load - solar, 0.0))
+        return soc - power * hours / DISCHARGE_EFFICIENCY / capacity * 100, grid
+    # Ngoài khung xả: PV dư sạc BESS, thiếu thì lấy lưới
+    room = np.maximum(soc_max - soc, 0) / 100 * capacity
+    power = np.minimum(
+        min(max(solar - load, 0.0), max_power), room / CHARGE_EFFICIENCY / hours
+    )
+    grid = np.full(np.shape(soc), max(load - solar, 0.0))
+    return soc + power * hours * CHARGE_EFFICIENCY / capacity * 100, grid
+
+
+# 🧮 Quy hoạch động: khung xả tối ưu cho một ngày
+# load, solar: kW theo từng bước; prices: giá theo từng bước
+# Trả về mảng bool theo bước (True = trong khung xả)
+def optimize_windows(
+    load,
+    solar,
+    prices,
+    capacity=BESS_CAPACITY,
+    max_power=CHARGE_POWER.maximum,
+    soc_min=DEFAULT_PARAMS["soc_min"],
+    soc_max=100.0,
+    soc_start=50.0,
+    slot_minutes=SLOT_MINUTES,
+    soc_steps=SOC_STEPS,
+    switch_penalty=SWITCH_PENALTY,
+):
+    hours = slot_minutes / 60
+    slots = len(load)
+    grid_soc = np.linspace(0.0, 100.0, soc_steps)
+    model = (capacity, max_power, soc_min, soc_max, hours)
+    transitions = [
+        [
+            _step(grid_soc, load[t], solar[t], discharging, *model)
+            for discharging in (False, True)
+        ]
+        for t in range(slots)
+    ]
+
+    # values[t][m]: chi phí nhỏ nhất từ bước t tới cuối ngày, m = bước trước đang xả
+    terminal = -(
+        np.maximum(grid_soc - soc_min, 0)
+        / 100
+        * capacity
+        * DISCHARGE_EFFICIENCY
+        * prices.min()
+    )
+    values = np.empty((slots + 1, 2, soc_steps))
+    values[slots] = terminal
+    for t in range(slots - 1, -1, -1):
+        (soc_off, grid_off), (soc_on, grid_on) = transitions[t]
+        cost_off = prices[t] * grid_off * hours + np.interp(
+            soc_off, grid_soc, values[t + 1][0]
+        )
+        cost_on = prices[t] * grid_on * hours + np.interp(
+            soc_on, grid_soc, values[t + 1][1]
+        )
+        values[t][0] = np.minimum(cost_off, cost_on + switch_penalty)
+        values[t][1] = np.minimum(cost_off, cost_on)
+
+    # Đi xuôi từ SOC đầu ngày, mỗi bước chọn lại theo giá trị tại đúng SOC thực
+    windows = np.zeros(slots, dtype=bool)
+    soc = float(soc_start)
+    discharging = False
+    for t in range(slots):
+        best = None
+        for option in (False, True):
+            next_soc, grid = _step(np.array([soc]), load[t], solar[t], option, *model)
+            cost = prices[t] * grid[0] * hours + np.interp(
+                next_soc[0], grid_soc, values[t + 1][int(option)]
+            )
+            if option and not discharging:
+                cost += switch_penalty
+            if best is None or cost < best[0]:
+                best = (cost, option, next_soc[0])
+        _, discharging, soc = best
+        windows[t] = discharging
+    return windows
+
+
+# Chạy mô hình với một lịch xả cho trước, để so sánh
+# Trả về {"cost", "import_kwh", "discharged_kwh", "final_soc"}
+def evaluate_windows(
+    windows,
+    load,
+    solar,
+    prices,
+    capacity=BESS_CAPACITY,
+    max_power=CHARGE_POWER.maximum,
+    soc_min=DEFAULT_PARAMS["soc_min"],
+    soc_max=100.0,
+    soc_start=50.0,
+    slot_minutes=SLOT_MINUTES,
+):
+    hours = slot_minutes / 60
+    model = (capacity, max_power, soc_min, soc_max, hours)
+    soc = np.array([float(soc_start)])
+    cost = imported = discharged = 0.0
+    for t, discharging in enumerate(windows):
+        next_soc, grid = _step(soc, load[t], solar[t], bool(discharging), *model)
+        cost += prices[t] * grid[0] * hours
+        imported += grid[0] * hours
+        discharged += max(soc[0] - next_soc[0], 0) / 100 * capacity
+        soc = next_soc
+    return {
+        "cost": cost,
+        "import_kwh": imported,
+        "discharged_kwh": discharged,
+        "final_soc": float(soc[0]),
+    }
+
+
+# Mặt nạ bước xả -> các khung (phút bắt đầu, phút kết thúc); khung chạm 24:00 và khung
+# bắt đầu lúc 00:00 được gộp thành một khung qua đêm (start > end)
+def mask_to_windows(windows, slot_minutes=SLOT_MINUTES):
+    edges = np.diff(np.concatenate(([0], windows.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1) * slot_minutes
+    ends = np.flatnonzero(edges == -1) * slot_minutes
+    intervals = list(zip(starts.tolist(), ends.tolist()))
+    if (
+        len(intervals) > 1
+        and intervals[0][0] == 0
+        and intervals[-1][1] == MINUTES_PER_DAY
+    ):
+        first = intervals.pop(0)
+        last = intervals.pop()
+        intervals.append((last[0], first[1]))
+    return intervals
+
+
+# 📝 Các khung xả theo định dạng discharge_data
+def windows_to_discharge_data(intervals, days=None):
+    discharge_data = []
+    for start, end in intervals:
+        entry = {
+            "DISCHARGE_START_H": start // 60,
+            "DISCHARGE_START_M": start % 60,
+            "DISCHARGE_END_H": end // 60,
+            "DISCHARGE_END_M": end % 60,
+        }
+        if days is not None and tuple(days) != ALL_DAYS:
+            entry["DAYS"] = list(days)
+        discharge_data.append(entry)
+    if not discharge_data:
+        # Không có khung xả nào có lợi: khung rỗng (start = end) để tắt xả theo lịch
+        discharge_data.append(
+            {
+                "DISCHARGE_START_H": 0,
+                "DISCHARGE_START_M": 0,
+                "DISCHARGE_END_H": 0,
+                "DISCHARGE_END_M": 0,
+            }
+        )
+    discharge_data[0]["TIMESTAMP"] = datetime.datetime.now().strftime(
+        "%Y-%m-%d %H:%M:%S"
+    )
+    return discharge_data
+
+
+# Mặt nạ bước xả theo một discharge_data có sẵn (vd. lịch đang chạy), cho một ngày
+def discharge_data_mask(discharge_data, day, slot_minutes=SLOT_MINUTES):
+    schedule = compile_schedule(discharge_data)
+    midnight = datetime.datetime.combine(day, datetime.time())
+    return np.array(
+        [
+            schedule.is_active(midnight + datetime.timedelta(minutes=minute))
+            for minute in range(0, MINUTES_PER_DAY, slot_minutes)
+        ],
+        dtype=bool,
+    )
+
+
+def _format_windows(intervals):
+    return ", ".join(
+        f"{start // 60:02d}:{start % 60:02d}-{end // 60:02d}:{end % 60:02d}"
+        for start, end in intervals
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tối ưu khung giờ xả BESS")
+    parser.add_argument("--history", default=bess_control.HISTORY_DIR)
+    parser.add_argument(
+        "--days", type=int, default=14, help="Số ngày lịch sử gần nhất dùng làm hồ sơ"
+    )
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        metavar="SEED",
+        help="Dùng một ngày giả lập thay cho lịch sử",
+    )
+    parser.add_argument("--tariff", help="File JSON biểu giá, mặc định DEFAULT_TARIFF")
+    parser.add_argument("--capacity", type=float, default=BESS_CAPACITY)
+    parser.add_argument("--max-power", type=float, default=CHARGE_POWER.maximum)
+    parser.add_argument("--soc-min", type=float, default=DEFAULT_PARAMS["soc_min"])
+    parser.add_argument("--soc-max", type=float, default=100.0)
+    parser.add_argument(
+        "--soc-start", type=float, help="SOC lúc 00:00, mặc định SOC cuối hôm qua"
+    )
+    parser.add_argument("--switch-penalty", type=float, default=SWITCH_PENALTY)
+    parser.add_argument(
+        "--day-types",
+        type=int,
+        nargs="+",
+        help="Loại ngày áp dụng (0 = thứ 2 ... 6 = chủ nhật, 7 = ngày lễ)",
+    )
+    parser.add_argument(
+        "--current", help="Lịch xả đang dùng (time_conf.txt) để so sánh"
+    )
+    parser.add_argument("--output", help="Ghi discharge_data ra file (time_conf.txt)")
+    parser.add_argument(
+        "--publish",
+        action="store_true",
+        help="Gửi lên topic dischargeConfig của site qua MQTT",
+    )
+    parser.add_argument("--mqtt-topic", default=bess_control.MQTT_TOPIC)
+    args = parser.parse_args()
+
+    tariff = DEFAULT_TARIFF
+    if args.tariff:
+        with open(args.tariff, "r", encoding="utf-8") as file:
+            tariff = json.load(file)
+    prices = tariff_prices(tariff)
+
+    today = datetime.date.today()
+    tomorrow = today + datetime.timedelta(days=1)
+    last_soc = None
+    if args.synthetic is not None:
+        schedule = compile_schedule(bess_control.default_discharge_data)
+        day = synthetic_day(tomorrow, schedule, args.synthetic).resample(
+            SLOT_MINUTES * 60
+        )
+        load, solar = day.load, day.solar
+    else:
+        if not os.path.isdir(args.history):
+            parser.error(f"Không có thư mục lịch sử {args.history}")
+        store = HistoryStore(args.history)
+        # args.days ngày trọn vẹn gần nhất (tới hôm qua), bỏ phần đã qua của hôm nay
+        profiles = history_profiles(
+            store,
+            today - datetime.timedelta(days=args.days),
+            today - datetime.timedelta(days=1),
+        )
+        store.close()
+        if profiles is None:
+            parser.error(f"Không có dữ liệu trong {args.days} ngày gần nhất")
+        load, solar, last_soc = profiles
+    soc_start = args.soc_start
+    if soc_start is None:
+        soc_start = last_soc if last_soc is not None else 50.0
+
+    model = dict(
+        capacity=args.capacity,
+        max_power=args.max_power,
+        soc_min=args.soc_min,
+        soc_max=args.soc_max,
+        soc_start=soc_start,
+    )
+    started = time.perf_counter()
+    windows = optimize_windows(
+        load, solar, prices, switch_penalty=args.switch_penalty, **model
+    )
+    elapsed = time.perf_counter() - started
+    intervals = mask_to_windows(windows)
+    discharge_data = windows_to_discharge_data(intervals, args.day_types)
+
+    optimized = evaluate_windows(windows, load, solar, prices, **model)
+    baseline = evaluate_windows(
+        np.zeros(len(windows), dtype=bool), load, solar, prices, **model
+    )
+    print(f"🗓️ Khung xả tối ưu ({elapsed * 1000:.0f} ms): {_format_windows(intervals)}")
+    comparisons = [("Không xả", baseline), ("Tối ưu", optimized)]
+    if args.current:
+        with open(args.current, "r") as file:
+            current = json.load(file)
+        comparisons.insert(
+            1,
+            (
+                "Lịch hiện tại",
+                evaluate_windows(
+                    discharge_data_mask(current, tomorrow), load, solar, prices, **model
+                ),
+            ),
+        )
+    for label, result in comparisons:
+        print(
+            f"{label}: chi phí {result['cost']:.0f}, nhập {result['import_kwh']:.1f} kWh, "
+            f"BESS xả {result['discharged_kwh']:.1f} kWh, "
+            f"SOC cuối ngày {result['final_soc']:.1f}%"
+        )
+    print(json.dumps(discharge_data, indent=4))
+
+    if args.output:
+        atomic_write_json(args.output, discharge_data)
+    if args.publish:
+        publish.single(
+            args.mqtt_topic,
+            json.dumps(discharge_data),
+            qos=1,
+            hostname=bess_control.MQTT_BROKER,
+            port=bess_control.MQTT_PORT,
+            auth={
+                "username": bess_control.MQTT_USERNAME,
+                "password": bess_control.MQTT_PASSWORD,
+            },
+        )
+        print(f"📡 Đã gửi lên {args.mqtt_topic}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import bisect
+import datetime
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger("my_logger")
+
+MINUTES_PER_DAY = 24 * 60
+
+
+HOLIDAY = 7  # Loại ngày: 0 = thứ 2 ... 6 = chủ nhật, 7 = ngày lễ
+ALL_DAYS = tuple(range(8))
+MAX_LOOKAHEAD_DAYS = 31  # Tìm thời điểm chuyển trạng thái tiếp theo tối đa 31 ngày
+
+
+# Gộp các khoảng [start, end) chồng nhau thành dãy mốc đã sắp xếp (s1, e1, s2, e2, ...)
+def _merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return tuple(minute for interval in merged for minute in interval)
+
+
+# 🗓️ Lịch xả đã biên dịch, không đổi sau khi tạo
+# Cập nhật từ MQTT tạo đối tượng mới rồi gán thay thế (gán tham chiếu là nguyên tử),
+# thread điều khiển không bao giờ thấy lịch đang sửa dở
+# - windows: (phút bắt đầu, phút kết thúc, các loại ngày áp dụng); qua đêm khi start > end,
+#   phần sau nửa đêm thuộc về ngày hôm sau
+# - Mỗi cặp (loại ngày hôm nay, loại ngày hôm qua) có sẵn dãy mốc đã gộp,
+#   tra một thời điểm bằng bisect: O(log n)
+class DischargeSchedule:
+    __slots__ = ("windows", "holidays", "_boundaries")
+
+    def __init__(self, windows, holidays=()):
+        heads = {day_type: [] for day_type in ALL_DAYS}
+        tails = {day_type: [] for day_type in ALL_DAYS}  # Phần qua nửa đêm
+        for start, end, days in windows:
+            for day_type in days:
+                if start <= end:
+                    heads[day_type].append((start, end))
+                else:
+                    heads[day_type].append((start, MINUTES_PER_DAY))
+                    tails[day_type].append((0, end))
+        boundaries = {
+            (today, yesterday): _merge_intervals(heads[today] + tails[yesterday])
+            for today in ALL_DAYS
+            for yesterday in ALL_DAYS
+        }
+        object.__setattr__(self, "windows", tuple(windows))
+        object.__setattr__(self, "holidays", frozenset(holidays))
+        object.__setattr__(self, "_boundaries", boundaries)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("DischargeSchedule không thay đổi được")
+
+    def _day_type(self, day):
+        return HOLIDAY if day in self.holidays else day.weekday()
+
+    def _day_boundaries(self, day):
+        yesterday = day - datetime.timedelta(days=1)
+        return self._boundaries[self._day_type(day), self._day_type(yesterday)]
+
+    def is_active(self, now=None):
+        if now is None:
+            now = datetime.datetime.now()
+        boundaries = self._day_boundaries(now.date())
+        return bisect.bisect_right(boundaries, now.hour * 60 + now.minute) % 2 == 1
+
+    # ⏭️ Thời điểm gần nhất sau `now` mà trạng thái xả thay đổi, None nếu không đổi
+    def next_transition(self, now=None):
+        if now is None:
+            now = datetime.datetime.now()
+        active = self.is_active(now)
+        midnight = datetime.datetime.combine(now.date(), datetime.time())
+        minute = now.hour * 60 + now.minute
+        for offset in range(MAX_LOOKAHEAD_DAYS):
+            boundaries = self._day_boundaries(now.date() + datetime.timedelta(offset))
+            if offset:
+                candidates = (0,) + boundaries
+            else:
+                candidates = boundaries[bisect.bisect_right(boundaries, minute) :]
+            for candidate in candidates:
+                if candidate >= MINUTES_PER_DAY:
+                    continue
+                moment = midnight + datetime.timedelta(days=offset, minutes=candidate)
+                if self.is_active(moment) != active:
+                    return moment
+        return None
+
+    # Trạng thái hiện tại và thời điểm nó hết hiệu lực
+    def state_at(self, now=None):
+        if now is None:
+            now = datetime.datetime.now()
+        return self.is_active(now), self.next_transition(now)
+
+
+# Biên dịch cấu hình nhận từ MQTT / time_conf.txt thành DischargeSchedule
+# Mỗi phần tử của danh sách là một khung giờ xả và/hoặc danh sách ngày lễ:
+#   {"DISCHARGE_START_H": 17, "DISCHARGE_START_M": 0,
+#    "DISCHARGE_END_H": 20, "DISCHARGE_END_M": 0,
+#    "DAYS": [0, 1, 2, 3, 4]}            # Không có DAYS: áp dụng mọi ngày
+#   {"HOLIDAYS": ["2026-01-01", "2026-09-02"]}  # Ngày lễ là loại ngày 7
+# Cấu hình cũ chỉ có một khung giờ vẫn dùng được nguyên như trước
+# Lỗi cấu hình (thiếu khóa, sai kiểu, giờ ngoài khoảng) ném ValueError
+def compile_schedule(discharge_data):
+    if not isinstance(discharge_data, list) or not discharge_data:
+        raise ValueError("❌ Cấu hình lịch xả phải là danh sách không rỗng")
+    windows = []
+    holidays = set()
+    for entry in discharge_data:
+        try:
+            for day in entry.get("HOLIDAYS", ()):
+                holidays.add(datetime.date.fromisoformat(day))
+            if "DISCHARGE_START_H" not in entry:
+                continue
+            start = entry["DISCHARGE_START_H"] * 60 + entry["DISCHARGE_START_M"]
+            end = entry["DISCHARGE_END_H"] * 60 + entry["DISCHARGE_END_M"]
+            days = tuple(entry.get("DAYS", ALL_DAYS))
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"❌ Cấu hình lịch xả không hợp lệ: {e!r}") from e
+        for minute in (start, end):
+            if not isinstance(minute, int) or not 0 <= minute <= MINUTES_PER_DAY:
+                raise ValueError(f"❌ Thời điểm {minute} phút không hợp lệ")
+        if any(day_type not in ALL_DAYS for day_type in days):
+            raise ValueError(f"❌ Loại ngày {days} không hợp lệ")
+        windows.append((start, end, days))
+    return DischargeSchedule(windows, holidays)
+
+
+# 💾 Ghi file JSON nguyên tử: ghi file tạm, fsync rồi os.replace
+def atomic_write_json(path, data):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as file:
+        json.dump(data, file, indent=4)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+# ✍️ Ghi cấu hình trên thread nền, chỉ giữ bản mới nhất đang chờ ghi
+# save() không chặn thread MQTT; nhiều lần save() liên tiếp chỉ ghi bản cuối
+class BackgroundJsonWriter:
+    def __init__(self, path):
+        self.path = path
+        self._pending = None
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run, name="config_writer", daemon=True
+        )
+        self._thread.start()
+
+    def save(self, data):
+        with self._condition:
+            self._pending = json.loads(json.dumps(data))  # Bản sao độc lập
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None:
+                    self._condition.wait()
+                data, self._pending = self._pending, None
+            try:
+                atomic_write_json(self.path, data)
+            except OSError as e:
+                logger.error("❌ Lỗi khi lưu %s: %s", self.path, e)
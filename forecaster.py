@@ -0,0 +1,149 @@
+import math
+
+import numpy as np
+
+from metrics import Gauge, Histogram
+
+# 🔮 Dự báo ngắn hạn tải và solar từ các mẫu trực tiếp, cho feed-forward của bộ điều khiển
+# - Mô hình AR(2) trên biến thiên giữa 2 mẫu: d(k+1) = w1 * d(k) + w2 * d(k-1), hệ số
+#   học trực tuyến bằng bình phương tối thiểu đệ quy (RLS) có hệ số quên
+# - Mỗi mẫu chỉ vài chục phép nhân/cộng, bộ nhớ O(1), không giữ cửa sổ mẫu
+# - Phần biến thiên đoán trước được (vd. inverter đang tăng/giảm dần theo mây) được học,
+#   phần ngẫu nhiên (bước tải) cho hệ số ~0, tức dự báo = giá trị hiện tại
+# - forecast(h): giá trị dự báo sau h giây (lặp mô hình theo số chu kỳ), vài giây - vài phút
+# - Sai số dự báo 1 chu kỳ (mẫu mới so với dự báo từ mẫu trước) được ghi vào số liệu
+# RlsForecaster chạy được trên số hoặc mảng NumPy (replay.py: mỗi phần tử một bộ tham số)
+# So sánh: python bench_controller.py --forecast off
+
+FORGETTING = 0.995  # Hệ số quên của RLS (~200 mẫu gần nhất)
+INITIAL_COVARIANCE = 100.0  # Hiệp phương sai ban đầu, cũng là trần chống bùng nổ
+WEIGHT_LIMIT = 1.0  # |hệ số AR| tối đa để dự báo nhiều bước không phân kỳ
+MAX_GAP = 60.0  # Giây, mất dữ liệu lâu hơn thì bắt đầu chuỗi mới (giữ hệ số đã học)
+
+FORECAST_ERROR = Histogram(
+    "bess_forecast_error_kw",
+    "|Sai số dự báo 1 chu kỳ| (kW)",
+    ("site", "series"),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0),
+)
+FORECAST_MAE = Gauge(
+    "bess_forecast_mae_kw",
+    "Sai số tuyệt đối trung bình (trượt) của dự báo 1 chu kỳ (kW)",
+    ("site", "series"),
+)
+
+
+class RlsForecaster:
+    def __init__(self, forgetting=FORGETTING, covariance=INITIAL_COVARIANCE):
+        self.forgetting = forgetting
+        self.covariance = covariance
+        self.w1 = self.w2 = 0.0
+        self.p11 = self.p22 = covariance
+        self.p12 = 0.0
+        self.reset()
+
+    # Bắt đầu lại chuỗi mẫu, giữ hệ số đã học
+    def reset(self):
+        self.value = None
+        self.d1 = self.d2 = 0.0
+        self.period = 0.0
+
+    # Thêm một mẫu cách mẫu trước dt giây, trả về sai số của dự báo 1 chu kỳ cho mẫu này
+    # (0 với mẫu đầu tiên)
+    def update(self, value, dt):
+        if self.value is None or dt <= 0 or dt > MAX_GAP:
+            self.reset()
+            self.value = value
+            return value * 0.0
+        d1, d2 = self.d1, self.d2
+        change = value - self.value
+        error = change - (self.w1 * d1 + self.w2 * d2)
+
+        # RLS: K = P x / (lambda + x' P x), w += K e, P = (P - K x' P) / lambda
+        px1 = self.p11 * d1 + self.p12 * d2
+        px2 = self.p12 * d1 + self.p22 * d2
+        denominator = self.forgetting + d1 * px1 + d2 * px2
+        k1 = px1 / denominator
+        k2 = px2 / denominator
+        limit = WEIGHT_LIMIT
+        self.w1 = np.minimum(np.maximum(self.w1 + k1 * error, -limit), limit)
+        self.w2 = np.minimum(np.maximum(self.w2 + k2 * error, -limit), limit)
+        # Khi tín hiệu đứng yên (solar ban đêm) P không được lớn mãi
+        grow = np.minimum(
+            1 / self.forgetting, 2 * self.covariance / (self.p11 + self.p22)
+        )
+        self.p11 = (self.p11 - k1 * px1) * grow
+        self.p12 = (self.p12 - k1 * px2) * grow
+        self.p22 = (self.p22 - k2 * px2) * grow
+
+        self.value = value
+        self.d2 = d1
+        self.d1 = change
+        self.period = dt
+        return error
+
+    def forecast(self, horizon):
+        value = self.value
+        if not self.period:
+            return value
+        d1, d2 = self.d1, self.d2
+        for _ in range(max(1, round(horizon / self.period))):
+            d1, d2 = self.w1 * d1 + self.w2 * d2, d1
+            value = value + d1
+        return value
+
+
+# 🏭 Dự báo tải và solar của một site, cập nhật mỗi chu kỳ có đủ số đo
+class SiteForecaster:
+    SERIES = ("load", "solar")
+
+    def __init__(self, name="", forgetting=FORGETTING, mae_tau=300):
+        self.models = {series: RlsForecaster(forgetting) for series in self.SERIES}
+        self.mae_tau = mae_tau  # Giây, hằng số thời gian của MAE trượt
+        self.mae = dict.fromkeys(self.SERIES)
+        self._error_metrics = {
+            series: FORECAST_ERROR.labels(name or "main", series)
+            for series in self.SERIES
+        }
+        self._mae_metrics = {
+            series: FORECAST_MAE.labels(name or "main", series)
+            for series in self.SERIES
+        }
+        self.last_timestamp = None
+
+    def update(self, timestamp, load_power, solar_power):
+        dt = 0.0 if self.last_timestamp is None else timestamp - self.last_timestamp
+        self.last_timestamp = timestamp
+        for series, value in zip(self.SERIES, (load_power, solar_power)):
+            model = self.models[series]
+            first = model.value is None or dt <= 0 or dt > MAX_GAP
+            error = abs(float(model.update(value, dt)))
+            if first:
+                continue
+            self._error_metrics[series].observe(error)
+            mae = self.mae[series]
+            if mae is None:
+                mae = error
+            else:
+                mae += (error - mae) * (1 - math.exp(-dt / self.mae_tau))
+            self.mae[series] = mae
+            self._mae_metrics[series].set(mae)
+
+    # (tải, solar) dự báo sau horizon giây (kW), None khi chưa có mẫu nào
+    def forecast(self, horizon):
+        load = self.models["load"]
+        if load.value is None:
+            return None
+        return (
+            float(load.forecast(horizon)),
+            max(0.0, float(self.models["solar"].forecast(horizon))),
+        )
+
+    def stats(self):
+        return {
+            series: {
+                "mae": self.mae[series],
+                "weights": (float(model.w1), float(model.w2)),
+            }
+            for series, model in self.models.items()
+        }
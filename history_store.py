@@ -0,0 +1,211 @@
+import bisect
+import datetime
+import logging
+import os
+import struct
+import threading
+
+import numpy as np
+
+logger = logging.getLogger("my_logger")
+
+# 🗄️ Các cột lưu mỗi chu kỳ: (tên, mã kiểu struct), bản ghi cố định, không padding
+HISTORY_FIELDS = (
+    ("timestamp", "d"),
+    ("grid_power", "f"),  # kW
+    ("solar_power", "f"),  # kW
+    ("bess_power", "f"),  # kW
+    ("bess_soc", "f"),  # %
+    ("load_power", "f"),  # kW
+    ("fault_bits", "Q"),  # 4 thanh ghi lỗi PCS ghép thành 64 bit
+    ("bess_setpoint", "f"),  # kW, NaN nếu chu kỳ không ra lệnh
+    ("pv_limit", "f"),  # kW, NaN nếu chu kỳ không ra lệnh
+    ("branch", "B"),  # Mã nhánh quyết định
+)
+
+SEGMENT_SECONDS = 3600  # Mỗi file segment chứa 1 giờ dữ liệu
+SEGMENT_PREFIX = "seg-"  # seg-<epoch bắt đầu>.bin
+DAY_PREFIX = "day-"  # day-YYYYMMDD.bin sau khi gộp
+SUFFIX = ".bin"
+
+
+def record_layout(fields):
+    record_struct = struct.Struct("<" + "".join(code for _, code in fields))
+    dtype = np.dtype([(name, "<" + code) for name, code in fields])
+    assert dtype.itemsize == record_struct.size
+    return record_struct, dtype
+
+
+def _day_start(timestamp):
+    day = datetime.date.fromtimestamp(timestamp)
+    return datetime.datetime(day.year, day.month, day.day).timestamp()
+
+
+# 📚 Kho lịch sử dạng cột, chỉ ghi nối (append-only)
+# - Mỗi chu kỳ ghi một bản ghi nhị phân cố định vào file segment của giờ hiện tại
+# - Chỉ mục thời gian: danh sách (thời điểm bắt đầu, file) đã sắp xếp, tìm bằng bisect
+# - query() mmap các file liên quan và trả về mảng NumPy, không phải phân tích text
+# - Sang ngày mới, các segment của ngày cũ được gộp thành một file ngày trên thread nền
+class HistoryStore:
+    def __init__(
+        self, directory, fields=HISTORY_FIELDS, segment_seconds=SEGMENT_SECONDS
+    ):
+        self.directory = directory
+        self.fields = tuple(fields)
+        self.segment_seconds = segment_seconds
+        self.record_struct, self.dtype = record_layout(self.fields)
+        self._lock = threading.Lock()
+        self._starts = []  # Chỉ mục thời gian, song song với self._paths
+        self._paths = []
+        self._file = None
+        self._segment_end = None
+        self._compacting = None
+        if os.path.isdir(directory):
+            self._load_index()
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            start = self._parse_start(name)
+            if start is not None:
+                entries.append((start, os.path.join(self.directory, name)))
+        entries.sort()
+        self._starts = [start for start, _ in entries]
+        self._paths = [path for _, path in entries]
+
+    @staticmethod
+    def _parse_start(name):
+        if not name.endswith(SUFFIX):
+            return None
+        stem = name[: -len(SUFFIX)]
+        try:
+            if stem.startswith(SEGMENT_PREFIX):
+                return float(stem[len(SEGMENT_PREFIX) :])
+            if stem.startswith(DAY_PREFIX):
+                day = datetime.datetime.strptime(stem[len(DAY_PREFIX) :], "%Y%m%d")
+                return day.timestamp()
+        except ValueError:
+            pass
+        return None
+
+    def _add_index(self, start, path):
+        index = bisect.bisect_left(self._starts, start)
+        self._starts.insert(index, start)
+        self._paths.insert(index, path)
+
+    def _open_segment(self, timestamp):
+        os.makedirs(self.directory, exist_ok=True)
+        start = int(timestamp // self.segment_seconds * self.segment_seconds)
+        path = os.path.join(self.directory, f"{SEGMENT_PREFIX}{start}{SUFFIX}")
+        previous_day = self._segment_end and _day_start(self._segment_end - 1)
+        if self._file is not None:
+            self._file.close()
+        # Không đệm: mỗi bản ghi là một lần write(), file luôn đọc được ngay
+        self._file = open(path, "ab", buffering=0)
+        self._segment_end = start + self.segment_seconds
+        with self._lock:
+            if path not in self._paths:
+                self._add_index(start, path)
+        # Lần mở đầu tiên hoặc sang ngày mới: gộp các segment còn sót của ngày cũ
+        if previous_day != _day_start(start):
+            self.compact_in_background(before=_day_start(start))
+
+    # ✍️ Ghi một bản ghi, values theo thứ tự fields (gồm timestamp ở đầu)
+    def append(self, *values):
+        timestamp = values[0]
+        if self._file is None or timestamp >= self._segment_end:
+            self._open_segment(timestamp)
+        self._file.write(self.record_struct.pack(*values))
+
+    def _map(self, path):
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return None
+        count = size // self.dtype.itemsize  # Bỏ bản ghi dở dang nếu bị ngắt khi ghi
+        if not count:
+            return None
+        return np.memmap(path, dtype=self.dtype, mode="r", shape=(count,))
+
+    # 🔍 Các bản ghi có start <= timestamp < end, trả về mảng NumPy có cấu trúc
+    # vd. rows = store.query(t0, t1); rows["grid_power"], rows["bess_soc"]
+    def query(self, start, end):
+        with self._lock:
+            first = max(bisect.bisect_right(self._starts, start) - 1, 0)
+            last = bisect.bisect_left(self._starts, end)
+            paths = self._paths[first:last]
+        chunks = []
+        for path in paths:
+            records = self._map(path)
+            if records is None:
+                continue
+            timestamps = records["timestamp"]
+            lo = np.searchsorted(timestamps, start, "left")
+            hi = np.searchsorted(timestamps, end, "left")
+            if hi > lo:
+                chunks.append(np.array(records[lo:hi]))
+        if not chunks:
+            return np.empty(0, dtype=self.dtype)
+        return np.concatenate(chunks)
+
+    # 🗜️ Gộp các segment của những ngày trước `before` thành file day-YYYYMMDD.bin
+    def compact(self, before=None):
+        if before is None:
+            before = _day_start(datetime.datetime.now().timestamp())
+        with self._lock:
+            segments = [
+                (start, path)
+                for start, path in zip(self._starts, self._paths)
+                if start < before and os.path.basename(path).startswith(SEGMENT_PREFIX)
+            ]
+        days = {}
+        for start, path in segments:
+            days.setdefault(_day_start(start), []).append(path)
+
+        for day_start, paths in sorted(days.items()):
+            day = datetime.date.fromtimestamp(day_start)
+            day_path = os.path.join(
+                self.directory, f"{DAY_PREFIX}{day.strftime('%Y%m%d')}{SUFFIX}"
+            )
+            temp_path = day_path + ".tmp"
+            itemsize = self.dtype.itemsize
+            with open(temp_path, "wb") as output:
+                for path in ([day_path] if os.path.exists(day_path) else []) + paths:
+                    with open(path, "rb") as source:
+                        data = source.read()
+                    output.write(data[: len(data) // itemsize * itemsize])
+                output.flush()
+                os.fsync(output.fileno())
+            os.replace(temp_path, day_path)
+            with self._lock:
+                if day_path not in self._paths:
+                    self._add_index(day_start, day_path)
+                for path in paths:
+                    index = self._paths.index(path)
+                    del self._starts[index]
+                    del self._paths[index]
+            for path in paths:
+                os.remove(path)
+            logger.info(
+                "🗜️ Đã gộp %s segment vào %s", len(paths), os.path.basename(day_path)
+            )
+
+    def compact_in_background(self, before=None):
+        if self._compacting is not None and self._compacting.is_alive():
+            return
+
+        def run():
+            try:
+                self.compact(before)
+            except OSError as e:
+                logger.error("❌ Lỗi khi gộp lịch sử: %s", e)
+
+        self._compacting = threading.Thread(
+            target=run, name="history_compact", daemon=True
+        )
+        self._compacting.start()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,267 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import bisect
+import logging
+import threading
+
+logger = logging.getLogger("my_logger")
+
+# 📈 Số liệu theo định dạng Prometheus (text 0.0.4), không cần thư viện ngoài
+# - Mỗi thread ghi vào ô riêng của mình (threading.local) nên inc()/observe() không
+#   lấy lock, chỉ là một phép cộng vào list; lock chỉ dùng khi thread ghi lần đầu
+# - Khi scrape, các ô của mọi thread được cộng lại trên thread HTTP nền
+# Dùng: READS = Counter("bess_reads_total", "Số lần đọc", ("device",))
+#       READS.labels("192.168.1.100:502").inc()
+#       start_http_server(9108) -> GET http://<máy>:9108/metrics
+
+# Giây: từ 1 ms (đọc Modbus trong LAN) tới 10 s (timeout, chu kỳ bị kẹt)
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+# Ô đếm theo từng thread, cộng dồn khi đọc
+class _Shards:
+    __slots__ = ("_size", "_local", "_cells", "_lock")
+
+    def __init__(self, size):
+        self._size = size
+        self._local = threading.local()
+        self._cells = []
+        self._lock = threading.Lock()
+
+    def cell(self):
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = [0] * self._size
+            with self._lock:
+                self._cells.append(cell)
+            self._local.cell = cell
+            return cell
+
+    def totals(self):
+        with self._lock:
+            cells = list(self._cells)
+        totals = [0] * self._size
+        for cell in cells:
+            for index, value in enumerate(cell):
+                totals[index] += value
+        return totals
+
+
+class _CounterChild:
+    __slots__ = ("_shards",)
+
+    def __init__(self):
+        self._shards = _Shards(1)
+
+    def inc(self, amount=1):
+        self._shards.cell()[0] += amount
+
+    def samples(self):
+        yield "", (), self._shards.totals()[0]
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        yield "", (), self.value
+
+
+# Ô của histogram: [số mẫu theo từng bucket..., +Inf, tổng giá trị, số mẫu]
+class _HistogramChild:
+    __slots__ = ("_bounds", "_shards")
+
+    def __init__(self, bounds):
+        self._bounds = bounds
+        self._shards = _Shards(len(bounds) + 3)
+
+    def observe(self, value):
+        cell = self._shards.cell()
+        cell[bisect.bisect_left(self._bounds, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    def samples(self):
+        totals = self._shards.totals()
+        cumulative = 0
+        for bound, count in zip(self._bounds + (float("inf"),), totals):
+            cumulative += count
+            yield "_bucket", (("le", _format_value(bound)),), cumulative
+        yield "_sum", (), totals[-2]
+        yield "_count", (), totals[-1]
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        (REGISTRY if registry is None else registry).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    # Con theo bộ giá trị nhãn, tạo một lần rồi dùng lại (tra dict, không lock)
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"❌ {self.name} cần nhãn {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for values, child in list(self._children.items()):
+            labels = tuple(zip(self.labelnames, values))
+            for suffix, extra, value in child.samples():
+                lines.append(
+                    f"{self.name}{suffix}{_format_labels(labels + extra)} "
+                    f"{_format_value(value)}"
+                )
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name,
+        documentation,
+        labelnames=(),
+        buckets=DEFAULT_BUCKETS,
+        registry=None,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if any(existing.name == metric.name for existing in self._metrics):
+                raise ValueError(f"❌ Số liệu {metric.name} đã được khai báo")
+            self._metrics.append(metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# 🌐 Phục vụ GET /metrics trên thread nền
+# routes: {đường dẫn: (content type, hàm trả về chuỗi)} phục vụ thêm, vd. /trace
+def start_http_server(port, addr="0.0.0.0", registry=REGISTRY, routes=None):
+    routes = {
+        "/metrics": ("text/plain; version=0.0.4", registry.render),
+        "/": ("text/plain; version=0.0.4", registry.render),
+        **(routes or {}),
+    }
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            route = routes.get(self.path.split("?")[0])
+            if route is None:
+                self.send_error(404)
+                return
+            content_type, render = route
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type + "; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((addr, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="metrics_http", daemon=True
+    ).start()
+    logger.info("📈 Số liệu Prometheus tại http://%s:%s/metrics", addr, port)
+    return server
@@ -0,0 +1,281 @@
+from pymodbus.client.sync import ModbusTcpClient
+import logging
+import select
+import socket
+import threading
+import time
+
+from metrics import Counter, Gauge
+
+logger = logging.getLogger("my_logger")
+
+MODBUS_TCP_PORT = 502
+
+MODBUS_CONNECTS = Counter(
+    "bess_modbus_connects_total",
+    "Lần mở kết nối Modbus theo kết quả "
+    "(ok, failed, backoff = bỏ qua khi mạch đang ngắt)",
+    ("device", "result"),
+)
+MODBUS_BREAKER_STATE = Gauge(
+    "bess_modbus_breaker_state",
+    "Trạng thái ngắt mạch của thiết bị (0 đóng, 1 ngắt, 2 nửa mở)",
+    ("device",),
+)
+MODBUS_BREAKER_TRIPS = Counter(
+    "bess_modbus_breaker_trips_total", "Số lần ngắt mạch theo thiết bị", ("device",)
+)
+
+
+# ⚡ Ngắt mạch (circuit breaker) cho một thiết bị
+# - CLOSED: request đi bình thường, failure_threshold lỗi liên tiếp thì chuyển OPEN
+# - OPEN: mọi request bị từ chối ngay (không chờ timeout) trong thời gian nghỉ;
+#   thời gian nghỉ tăng gấp đôi sau mỗi lần ngắt liên tiếp, từ backoff_base tới backoff_max
+# - HALF_OPEN: hết thời gian nghỉ, chỉ một request thử được đi; thành công thì CLOSED,
+#   lỗi thì OPEN lại; request thử không báo kết quả sau probe_timeout thì cho thử request khác
+# Lỗi = không có phản hồi (timeout, mất kết nối); phản hồi exception Modbus vẫn là thiết bị sống
+class CircuitBreaker:
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+    def __init__(
+        self,
+        name="",
+        failure_threshold=1,
+        backoff_base=0.5,
+        backoff_max=30,
+        probe_timeout=5,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.probe_timeout = probe_timeout
+        self.state = self.CLOSED
+        self.failures = 0  # Lỗi liên tiếp
+        self.trips = 0  # Số lần ngắt liên tiếp chưa có request thành công
+        self.retry_at = 0.0  # time.monotonic() hết thời gian nghỉ
+        self._probe_until = 0.0
+        self._lock = threading.Lock()
+        self._state_metric = MODBUS_BREAKER_STATE.labels(name)
+        self._state_metric.set(self.CLOSED)
+        self._trip_metric = MODBUS_BREAKER_TRIPS.labels(name)
+
+    def _set_state(self, state):
+        self.state = state
+        self._state_metric.set(state)
+
+    # Còn trong thời gian nghỉ (không đổi trạng thái, dùng trước khi mở kết nối)
+    def is_open(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        return self.state == self.OPEN and now < self.retry_at
+
+    # Cho phép một request đi hay không; ở HALF_OPEN chỉ một request thử
+    def allow(self, now=None):
+        if self.state == self.CLOSED:
+            return True
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if now < self.retry_at:
+                    return False
+                self._set_state(self.HALF_OPEN)
+            elif now < self._probe_until:
+                return False
+            self._probe_until = now + self.probe_timeout
+            return True
+
+    # Trả về True nếu request thành công này đóng lại mạch đang ngắt
+    def record_success(self):
+        if self.state == self.CLOSED and not self.failures:
+            return False
+        with self._lock:
+            self.failures = 0
+            self.trips = 0
+            if self.state == self.CLOSED:
+                return False
+            self._set_state(self.CLOSED)
+            return True
+
+    # Trả về thời gian nghỉ (giây) nếu lỗi này làm ngắt mạch, ngược lại None
+    def record_failure(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            self.failures += 1
+            if self.state == self.CLOSED and self.failures < self.failure_threshold:
+                return None
+            self.trips += 1
+            delay = min(self.backoff_base * 2 ** (self.trips - 1), self.backoff_max)
+            self.retry_at = now + delay
+            self._set_state(self.OPEN)
+            self._trip_metric.inc()
+            return delay
+
+
+# ⏱️ Client có hạn chót cứng cho cả một request: pymodbus chờ tối đa timeout cho từng
+# bước (tự kết nối lại trong execute, đọc header, đọc phần thân) nên một request lỗi có thể
+# mất gấp 3 lần timeout; ở đây mỗi bước chỉ được chờ phần thời gian còn lại
+class DeadlineModbusTcpClient(ModbusTcpClient):
+    def __init__(self, host, port=MODBUS_TCP_PORT, timeout=3, **kwargs):
+        super().__init__(host, port=port, timeout=timeout, **kwargs)
+        self.request_timeout = timeout
+        self._deadline = None
+
+    def _remaining(self):
+        if self._deadline is None:
+            return self.request_timeout
+        return max(self._deadline - time.monotonic(), 0.001)
+
+    def execute(self, request=None):
+        self._deadline = time.monotonic() + self.request_timeout
+        try:
+            return super().execute(request)
+        finally:
+            self._deadline = None
+
+    def connect(self):
+        self.timeout = self._remaining()
+        return super().connect()
+
+    def _recv(self, size):
+        self.timeout = self._remaining()
+        return super()._recv(size)
+
+
+# 🔌 Pool kết nối Modbus TCP giữ kết nối lâu dài, mỗi (ip, port) một client
+# - timeout: hạn chót cứng của một lần kết nối / một request (giây)
+# - Mỗi thiết bị một CircuitBreaker: thiết bị chết bị bỏ qua ngay thay vì làm chậm cả
+#   chu kỳ, nên một chu kỳ chờ mỗi thiết bị hỏng tối đa ~timeout rồi tiếp tục với thiết bị
+#   khác; người gọi báo kết quả request qua succeeded() / failed()
+class ModbusConnectionPool:
+    def __init__(
+        self,
+        port=MODBUS_TCP_PORT,
+        timeout=3,
+        backoff_base=0.5,
+        backoff_max=30,
+        failure_threshold=1,
+    ):
+        self.port = port
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self._clients = {}
+        self._breakers = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _key(self, ip, port):
+        return (ip, port or self.port)
+
+    # Mỗi thiết bị một lock để kết nối lại thiết bị chậm không chặn thiết bị khác
+    def _device_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _breaker(self, key):
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(key)
+                if breaker is None:
+                    breaker = CircuitBreaker(
+                        f"{key[0]}:{key[1]}",
+                        self.failure_threshold,
+                        self.backoff_base,
+                        self.backoff_max,
+                        probe_timeout=2 * self.timeout,
+                    )
+                    self._breakers[key] = breaker
+        return breaker
+
+    def breaker(self, ip, port=None):
+        return self._breaker(self._key(ip, port))
+
+    # Kiểm tra socket còn sống: đọc thử không chặn, b"" nghĩa là thiết bị đã đóng kết nối
+    @staticmethod
+    def _is_healthy(client):
+        sock = client.socket
+        if sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            if readable and not sock.recv(1, socket.MSG_PEEK):
+                return False
+        except (OSError, ValueError):
+            return False
+        return True
+
+    # 📥 Lấy client đang mở, tự kết nối lại khi mạch cho phép thay vì sleep chặn vòng lặp
+    def get(self, ip, port=None):
+        key = self._key(ip, port)
+        breaker = self._breaker(key)
+        if breaker.is_open():
+            MODBUS_CONNECTS.labels(breaker.name, "backoff").inc()
+            return None
+        with self._device_lock(key):
+            client = self._clients.get(key)
+            if client is not None and self._is_healthy(client):
+                return client
+
+            if client is None:
+                client = DeadlineModbusTcpClient(
+                    key[0], port=key[1], timeout=self.timeout
+                )
+                self._clients[key] = client
+            else:
+                client.close()
+
+            if client.connect():
+                MODBUS_CONNECTS.labels(breaker.name, "ok").inc()
+                return client
+
+            MODBUS_CONNECTS.labels(breaker.name, "failed").inc()
+            delay = breaker.record_failure()
+            if delay is not None:
+                logger.error("⚠️ Không thể kết nối %s, thử lại sau %ss...", ip, delay)
+            return None
+
+    # ⚡ Request tới thiết bị của client có được đi không (False: mạch đang ngắt)
+    def allow(self, client):
+        if client is None:
+            return True
+        return self._breaker(self._key(client.host, client.port)).allow()
+
+    def succeeded(self, client):
+        if client is None:
+            return
+        key = self._key(client.host, client.port)
+        if self._breaker(key).record_success():
+            logger.info("✅ %s đã phản hồi lại", key[0])
+
+    # ❌ Request không có phản hồi: đóng kết nối để lần get() sau mở lại, tính lỗi cho mạch
+    def failed(self, client):
+        if client is None:
+            return
+        self.invalidate(client)
+        key = self._key(client.host, client.port)
+        delay = self._breaker(key).record_failure()
+        if delay is not None:
+            logger.error("⚡ %s không phản hồi, tạm ngắt %ss", key[0], delay)
+
+    # Đánh dấu kết nối hỏng để lần get() sau mở lại
+    def invalidate(self, client):
+        if client is None:
+            return
+        with self._device_lock(self._key(client.host, client.port)):
+            client.close()
+
+    def close_all(self):
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+            self._breakers.clear()
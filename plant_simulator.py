@@ -0,0 +1,376 @@
+from pymodbus.datastore import ModbusSequentialDataBlock
+from pymodbus.datastore import ModbusServerContext
+from pymodbus.datastore import ModbusSlaveContext
+from pymodbus.server.sync import ModbusTcpServer
+import argparse
+import math
+import random
+import threading
+import time
+
+from device_profile import load_profile
+from register_codec import get_codec
+
+# 🏭 Mô phỏng nhà máy qua Modbus TCP trên localhost để chạy bess_control.py không cần thiết bị thật
+# Mỗi site gồm (bản đồ thanh ghi lấy từ cùng hồ sơ thiết bị bess_control.py dùng):
+#   BESS (unit 1): hồ sơ profiles/pcs.json - công suất, SOC, lệnh công suất, lỗi PCS
+#   Data Management: unit 3: profiles/data_manager.json - tổng công suất inverter,
+#                            giới hạn công suất (kW và %)
+#                    unit 13: profiles/load_meter.json - công suất nhập/phát lưới
+# Inverter kiểu DONGHOLOAD.py: 100 công suất (kW), 101 lệnh giới hạn công suất (kW)
+#
+# Chạy: python plant_simulator.py --sites 1 --latency 0.01 --speed 60
+
+SIM_PORT = 1502
+
+BESS_ID = 1
+DATA_MANAGEMENT_ID = 3
+LOAD_METER_ID = 13
+
+PCS = load_profile("pcs")
+DATA_MANAGER = load_profile("data_manager")
+LOAD_METER = load_profile("load_meter")
+
+INVERTER_SOLAR_POWER_REG = 100
+INVERTER_POWER_CMD = 101
+
+UINT16 = get_codec("uint16")
+
+
+# ⏳ Datastore có độ trễ mỗi request để giả lập thiết bị chậm
+# Mô hình vật lý đọc/ghi thẳng vào store nên không bị trễ
+# size: số holding register cần phục vụ (giữ bộ nhớ nhỏ khi mô phỏng hàng trăm thiết bị)
+class LatencySlaveContext(ModbusSlaveContext):
+    def __init__(self, size, latency=0.0):
+        super().__init__(
+            di=ModbusSequentialDataBlock(0, [0]),
+            co=ModbusSequentialDataBlock(0, [0]),
+            ir=ModbusSequentialDataBlock(0, [0]),
+            hr=ModbusSequentialDataBlock(0, [0] * size),
+            zero_mode=True,
+        )
+        self.latency = latency
+        self.registers = self.store["h"]
+
+    def getValues(self, fx, address, count=1):
+        if self.latency:
+            time.sleep(self.latency)
+        return super().getValues(fx, address, count)
+
+    def setValues(self, fx, address, values):
+        if self.latency:
+            time.sleep(self.latency)
+        super().setValues(fx, address, values)
+
+    def get(self, codec, address):
+        return codec.decode(self.registers.getValues(address, codec.count))[0]
+
+    def set(self, codec, address, value):
+        self.registers.setValues(address, codec.encode(value))
+
+    # Đọc/ghi một điểm của hồ sơ thiết bị theo đơn vị kỹ thuật
+    def get_point(self, point):
+        return point.from_registers(
+            self.registers.getValues(point.address, point.count)
+        )
+
+    def set_point(self, point, value):
+        self.registers.setValues(point.address, point.to_registers(value))
+
+
+# Số thanh ghi cần phục vụ để chứa mọi điểm của hồ sơ
+def store_size(profile):
+    return max(point.address + point.count for point in profile.points.values()) + 1
+
+
+def start_server(context, host, port):
+    server = ModbusTcpServer(context, address=(host, port), allow_reuse_address=True)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ☀️ Công suất PV khả dụng theo giờ trong ngày (kW), có mây ngẫu nhiên
+def solar_profile(hour, pv_peak, cloud):
+    if hour <= 6 or hour >= 18:
+        return 0.0
+    return pv_peak * math.sin(math.pi * (hour - 6) / 12) * cloud
+
+
+# 🏠 Tải theo giờ trong ngày (kW): nền + cao điểm trưa và tối
+def daily_load_profile(hour, base_load):
+    return base_load * (
+        1.0
+        + 0.4 * math.exp(-((hour - 12) ** 2) / 8)
+        + 0.8 * math.exp(-((hour - 19) ** 2) / 4)
+    )
+
+
+# ⚡ Mô hình vật lý một site: PV, tải, BESS với tích phân SOC và độ trễ đáp ứng PCS
+class PlantModel:
+    def __init__(
+        self,
+        pv_peak=125.0,
+        base_load=60.0,
+        bess_capacity=200.0,
+        bess_max_power=120.0,
+        soc=50.0,
+        pcs_tau=2.0,
+        pcs_accuracy=1.0,
+        inverter_tau=3.0,
+        load_noise=0.03,
+        load_steps=True,
+        seed=None,
+    ):
+        self.pv_peak = pv_peak
+        self.base_load = base_load
+        self.bess_capacity = bess_capacity  # kWh
+        self.bess_max_power = bess_max_power  # kW
+        self.soc = soc  # %
+        self.pcs_tau = pcs_tau  # Hằng số thời gian đáp ứng PCS (giây)
+        self.pcs_accuracy = pcs_accuracy  # Tỉ lệ công suất thực tế / lệnh
+        self.inverter_tau = inverter_tau
+        self.load_noise = load_noise
+        self.load_steps = load_steps
+        self.random = random.Random(seed)
+
+        self.bess_power = 0.0  # kW, + là xả
+        self.solar_power = 0.0
+        self.load_power = base_load
+        self.grid_power = 0.0  # kW, + là nhập lưới
+        self.cloud = 1.0
+        self.load_step = 0.0
+        self.import_energy = 0.0  # kWh
+        self.export_energy = 0.0
+        self.fault_words = [0, 0, 0, 0]
+
+    def step(self, dt, hour, bess_setpoint, solar_limit):
+        # Mây và bước tải ngẫu nhiên (random walk có giới hạn)
+        self.cloud = min(1.0, max(0.2, self.cloud + self.random.gauss(0, 0.02) * dt))
+        if self.load_steps and self.random.random() < dt / 600:
+            self.load_step = self.random.choice([-0.3, 0.0, 0.3]) * self.base_load
+
+        load = daily_load_profile(hour, self.base_load) + self.load_step
+        self.load_power = max(load * (1 + self.random.gauss(0, self.load_noise)), 0.0)
+
+        available = min(solar_profile(hour, self.pv_peak, self.cloud), solar_limit)
+        self.solar_power += (available - self.solar_power) * min(
+            dt / self.inverter_tau, 1
+        )
+
+        target = max(-self.bess_max_power, min(self.bess_max_power, bess_setpoint))
+        target *= self.pcs_accuracy
+        if (target > 0 and self.soc <= 0) or (target < 0 and self.soc >= 100):
+            target = 0.0
+        self.bess_power += (target - self.bess_power) * min(dt / self.pcs_tau, 1)
+        self.soc -= self.bess_power * dt / 3600 / self.bess_capacity * 100
+        self.soc = min(100.0, max(0.0, self.soc))
+
+        self.grid_power = self.load_power - self.solar_power - self.bess_power
+        if self.grid_power > 0:
+            self.import_energy += self.grid_power * dt / 3600
+        else:
+            self.export_energy -= self.grid_power * dt / 3600
+
+
+# 🔋 Một site gồm BESS và Data Management phục vụ qua Modbus TCP
+class SimulatedSite:
+    def __init__(
+        self, bess_host, data_management_host, port, latency=0.0, **model_kwargs
+    ):
+        self.model = PlantModel(**model_kwargs)
+        self.bess = LatencySlaveContext(store_size(PCS), latency)
+        self.data_management = LatencySlaveContext(store_size(DATA_MANAGER), latency)
+        self.load_meter = LatencySlaveContext(store_size(LOAD_METER), latency)
+        self.bess_host = bess_host
+        self.data_management_host = data_management_host
+        self.port = port
+
+        self.data_management.set_point(DATA_MANAGER["pv_limit"], self.model.pv_peak)
+        self.data_management.set_point(DATA_MANAGER["pv_limit_percent"], 100)
+        self.publish()
+
+        self.servers = [
+            start_server(
+                ModbusServerContext(slaves={BESS_ID: self.bess}, single=False),
+                bess_host,
+                port,
+            ),
+            start_server(
+                ModbusServerContext(
+                    slaves={
+                        DATA_MANAGEMENT_ID: self.data_management,
+                        LOAD_METER_ID: self.load_meter,
+                    },
+                    single=False,
+                ),
+                data_management_host,
+                port,
+            ),
+        ]
+
+    # Đọc lệnh controller đã ghi, chạy mô hình, cập nhật thanh ghi đo
+    def step(self, dt, hour):
+        bess_setpoint = self.bess.get_point(PCS["charge_power"])
+        percent = self.data_management.get_point(DATA_MANAGER["pv_limit_percent"])
+        solar_limit = self.data_management.get_point(DATA_MANAGER["pv_limit"])
+        if 0 < percent < 100:
+            solar_limit = min(solar_limit, self.model.pv_peak * percent / 100)
+        self.model.step(dt, hour, bess_setpoint, solar_limit)
+        self.publish()
+
+    def publish(self):
+        model = self.model
+        self.bess.set_point(PCS["bess_power"], model.bess_power)
+        self.bess.set_point(PCS["bess_soc"], model.soc)
+        self.bess.registers.setValues(PCS["faults_word"].address, model.fault_words)
+        self.data_management.set_point(
+            DATA_MANAGER["total_solar_production"], model.solar_power
+        )
+        self.load_meter.set_point(LOAD_METER["grid_import"], max(model.grid_power, 0))
+        self.load_meter.set_point(LOAD_METER["grid_export"], max(-model.grid_power, 0))
+
+    def close(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+
+# ☀️ Inverter theo bản đồ thanh ghi DONGHOLOAD.py
+class SimulatedInverter:
+    def __init__(self, host, port, latency=0.0, rated_power=100):
+        self.context = LatencySlaveContext(INVERTER_POWER_CMD + 100, latency)
+        self.rated_power = rated_power
+        self.context.set(UINT16, INVERTER_POWER_CMD, rated_power)
+        self.server = start_server(
+            ModbusServerContext(slaves=self.context, single=True), host, port
+        )
+
+    def step(self, dt, hour):
+        limit = self.context.get(UINT16, INVERTER_POWER_CMD)
+        power = min(solar_profile(hour, self.rated_power, 1.0), limit)
+        self.context.set(UINT16, INVERTER_SOLAR_POWER_REG, round(power))
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# Địa chỉ loopback cho site/inverter thứ i (cả dải 127.0.0.0/8 đều trỏ về localhost)
+def site_hosts(index):
+    return f"127.0.{index + 1}.100", f"127.0.{index + 1}.2"
+
+
+def inverter_host(index):
+    return f"127.1.{index // 250}.{index % 250 + 1}"
+
+
+# 🏭 Toàn bộ nhà máy mô phỏng, mô hình vật lý chạy trên thread riêng
+# speed: số giây mô phỏng trên mỗi giây thực, để thử hội tụ nhanh
+class PlantSimulator:
+    def __init__(
+        self,
+        sites=1,
+        inverters=0,
+        port=SIM_PORT,
+        latency=0.0,
+        speed=1.0,
+        start_hour=12.0,
+        step=0.1,
+        **model_kwargs,
+    ):
+        self.speed = speed
+        self.step_size = step
+        self.sim_time = start_hour * 3600
+        self.sites = [
+            SimulatedSite(*site_hosts(i), port, latency, seed=i, **model_kwargs)
+            for i in range(sites)
+        ]
+        self.inverters = [
+            SimulatedInverter(inverter_host(i), port, latency) for i in range(inverters)
+        ]
+        self.running = False
+        self._thread = None
+
+    @property
+    def hour(self):
+        return (self.sim_time / 3600) % 24
+
+    def advance(self, dt):
+        self.sim_time += dt
+        for device in self.sites + self.inverters:
+            device.step(dt, self.hour)
+
+    def _run(self):
+        last = time.monotonic()
+        while self.running:
+            time.sleep(self.step_size)
+            now = time.monotonic()
+            self.advance((now - last) * self.speed)
+            last = now
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self._thread:
+            self._thread.join()
+        for device in self.sites + self.inverters:
+            device.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mô phỏng nhà máy BESS qua Modbus TCP")
+    parser.add_argument("--sites", type=int, default=1)
+    parser.add_argument("--inverters", type=int, default=0)
+    parser.add_argument("--port", type=int, default=SIM_PORT)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Độ trễ mỗi request (giây)"
+    )
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="Tốc độ thời gian mô phỏng"
+    )
+    parser.add_argument("--start-hour", type=float, default=12.0)
+    parser.add_argument("--soc", type=float, default=50.0)
+    args = parser.parse_args()
+
+    simulator = PlantSimulator(
+        sites=args.sites,
+        inverters=args.inverters,
+        port=args.port,
+        latency=args.latency,
+        speed=args.speed,
+        start_hour=args.start_hour,
+        soc=args.soc,
+    ).start()
+    for i in range(args.sites):
+        bess_host, data_management_host = site_hosts(i)
+        print(
+            f"🔋 Site {i}: BESS {bess_host}:{args.port}, Data Management {data_management_host}:{args.port}"
+        )
+    if args.inverters:
+        print(f"☀️ {args.inverters} inverter từ {inverter_host(0)}:{args.port}")
+
+    try:
+        while True:
+            time.sleep(5)
+            for i, site in enumerate(simulator.sites):
+                model = site.model
+                print(
+                    f"🕒 {simulator.hour:05.2f}h Site {i}: ⚡ Grid {model.grid_power:.2f} kW, "
+                    f"☀️ Solar {model.solar_power:.2f} kW, 🏠 Load {model.load_power:.2f} kW, "
+                    f"🔋 BESS {model.bess_power:.2f} kW, SOC {model.soc:.1f}%, "
+                    f"nhập {model.import_energy:.2f} kWh, phát {model.export_energy:.2f} kWh"
+                )
+    except KeyboardInterrupt:
+        print("Dừng mô phỏng...")
+    finally:
+        simulator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import gzip
+import os
+import queue
+import shutil
+
+
+# 📨 QueueHandler không bao giờ chặn thread gọi log
+# - Không format trong prepare(): chuỗi log chỉ được ghép trên thread listener
+# - Hàng đợi đầy thì bỏ bản ghi và đếm số bản ghi bị bỏ thay vì chờ
+class NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+# 🗜️ Nén file log cũ khi RotatingFileHandler xoay vòng (chạy trên thread listener)
+def gzip_namer(name):
+    return name + ".gz"
+
+
+def gzip_rotator(source, dest):
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+# Gắn hàng đợi vào logger, mọi ghi file/console chạy trên một thread nền
+def setup_queue_logging(logger, handlers, maxsize=10000):
+    log_queue = queue.Queue(maxsize)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    logger.addHandler(queue_handler)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return queue_handler, listener
@@ -0,0 +1,88 @@
+from pymodbus.constants import Endian
+
+from register_codec import RegisterCodec
+
+MAX_READ_GAP = 20  # Số thanh ghi trống tối đa được đọc kèm để gộp 2 điểm
+MAX_READ_COUNT = 125  # Giới hạn của read_holding_registers theo chuẩn Modbus
+
+
+# 📋 Gộp các điểm cần đọc thành ít khối read_holding_registers nhất
+# points: {tên: (unit_id, địa chỉ, kiểu, số thanh ghi[, hàm đổi đơn vị])}
+# Trả về danh sách khối
+# (unit_id, địa chỉ bắt đầu, số thanh ghi, điểm raw, tên điểm có kiểu, hàm giải mã)
+def plan_reads(
+    points,
+    max_gap=MAX_READ_GAP,
+    max_count=MAX_READ_COUNT,
+    byteorder=Endian.Big,
+    wordorder=Endian.Big,
+):
+    by_unit = {}
+    for name, (unit_id, address, type, count, *scale) in points.items():
+        scale = scale[0] if scale else None
+        by_unit.setdefault(unit_id, []).append((address, count, type, name, scale))
+
+    plan = []
+    for unit_id, items in by_unit.items():
+        items.sort(key=lambda item: item[:4])
+        span_start = span_end = None
+        members = []
+        for address, count, type, name, scale in items:
+            end = address + count
+            if (
+                span_start is not None
+                and address - span_end <= max_gap
+                and max(end, span_end) - span_start <= max_count
+            ):
+                span_end = max(span_end, end)
+            else:
+                if span_start is not None:
+                    plan.append(
+                        _build_span(
+                            unit_id, span_start, span_end, members, byteorder, wordorder
+                        )
+                    )
+                span_start, span_end, members = address, end, []
+            members.append((name, address, type, count, scale))
+        if span_start is not None:
+            plan.append(
+                _build_span(
+                    unit_id, span_start, span_end, members, byteorder, wordorder
+                )
+            )
+    return plan
+
+
+# Mỗi khối mang sẵn hàm giải mã tất cả điểm có kiểu trong một lần gọi (codec biên dịch
+# sẵn, đổi đơn vị nếu có), điểm "raw" được cắt nguyên danh sách thanh ghi
+def _build_span(unit_id, start, end, members, byteorder, wordorder):
+    raw_members = []
+    typed_names = []
+    fields = []
+    scales = []
+    for name, address, type, count, scale in members:
+        if type == "raw":
+            raw_members.append((name, address - start, count))
+        else:
+            typed_names.append(name)
+            fields.append((address - start, type, count))
+            scales.append(scale)
+    decode = None
+    if fields:
+        decode = RegisterCodec(fields, end - start, byteorder, wordorder).decode
+        if any(scales):
+            decode = _scaled(decode, scales)
+    return (unit_id, start, end - start, raw_members, typed_names, decode)
+
+
+def _scaled(decode, scales):
+    scales = tuple(scale or _identity for scale in scales)
+
+    def scaled_decode(registers):
+        return tuple(scale(value) for scale, value in zip(scales, decode(registers)))
+
+    return scaled_decode
+
+
+def _identity(value):
+    return value
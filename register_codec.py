@@ -0,0 +1,107 @@
+from pymodbus.constants import Endian
+import operator
+import struct
+
+# Kiểu dữ liệu -> (ký tự struct, số thanh ghi)
+TYPE_FORMATS = {
+    "int16": ("h", 1),
+    "uint16": ("H", 1),
+    "int32": ("i", 2),
+    "uint32": ("I", 2),
+    "float16": ("e", 1),
+    "float32": ("f", 2),
+}
+
+
+# ⚙️ Bộ mã hóa/giải mã một khối thanh ghi, biên dịch sẵn thành struct.Struct
+# fields: [(offset thanh ghi, kiểu, số thanh ghi)], các thanh ghi không khai báo được bỏ qua;
+# riêng "string" khai báo số byte (như decode_string của pymodbus), chiếm số thanh ghi làm tròn lên
+# byteorder áp dụng trong từng thanh ghi, wordorder áp dụng giữa các thanh ghi của một giá trị
+class RegisterCodec:
+    __slots__ = ("count", "_fields", "_registers", "_reorder", "_strings")
+
+    def __init__(self, fields, count=None, byteorder=Endian.Big, wordorder=Endian.Big):
+        fields = sorted(fields)
+        fmt = ">"
+        position = 0
+        perm = []
+        strings = []
+        for index, (offset, type, size) in enumerate(fields):
+            if offset < position:
+                raise ValueError(f"❌ Thanh ghi {offset} bị khai báo chồng lấn")
+            if offset > position:
+                fmt += f"{(offset - position) * 2}x"
+                perm.extend(range(position, offset))
+            if type == "string":
+                length = size
+                size = (length + 1) // 2
+                fmt += f"{length}s{size * 2 - length}x"
+                strings.append(index)
+            elif type in TYPE_FORMATS:
+                code, size = TYPE_FORMATS[type]
+                fmt += code
+            else:
+                raise ValueError(f"❌ Kiểu dữ liệu {type} không được hỗ trợ")
+            words = range(offset, offset + size)
+            perm.extend(reversed(words) if wordorder == Endian.Little else words)
+            position = offset + size
+
+        count = position if count is None else count
+        if count < position:
+            raise ValueError(f"❌ Khối {count} thanh ghi không đủ cho {position}")
+        perm.extend(range(position, count))
+        fmt += f"{(count - position) * 2}x"
+
+        self.count = count
+        self._fields = struct.Struct(fmt)
+        self._registers = struct.Struct(f"{byteorder}{count}H")
+        self._strings = strings
+        if perm == list(range(count)):
+            self._reorder = None
+        else:
+            self._reorder = operator.itemgetter(*perm)
+
+    # Giải mã cả khối trong một lần gọi, trả về tuple theo thứ tự offset
+    def decode(self, registers):
+        if self._reorder is not None:
+            registers = self._reorder(registers)
+        values = self._fields.unpack(self._registers.pack(*registers))
+        if self._strings:
+            values = list(values)
+            for index in self._strings:
+                values[index] = values[index].decode()
+            values = tuple(values)
+        return values
+
+    # Mã hóa các giá trị thành danh sách thanh ghi (thanh ghi trống = 0)
+    def encode(self, *values):
+        if self._strings:
+            values = list(values)
+            for index in self._strings:
+                values[index] = values[index].encode()
+        registers = self._registers.unpack(self._fields.pack(*values))
+        if self._reorder is not None:
+            registers = self._reorder(registers)
+        return list(registers)
+
+
+_codec_cache = {}
+
+
+# 📦 Codec cho một giá trị đơn, dùng chung giữa các lần gọi
+# size: số thanh ghi của khối, riêng "string" là số byte
+def get_codec(type, size=None, byteorder=Endian.Big, wordorder=Endian.Big):
+    key = (type, size, byteorder, wordorder)
+    codec = _codec_cache.get(key)
+    if codec is None:
+        if type in TYPE_FORMATS:
+            size = size or TYPE_FORMATS[type][1]
+            count = max(size, TYPE_FORMATS[type][1])
+        elif type == "string":
+            size = size or 2
+            count = (size + 1) // 2
+        else:
+            size = count = size or 1
+        codec = RegisterCodec([(0, type, size)], count, byteorder, wordorder)
+        _codec_cache[key] = codec
+    return codec
@@ -0,0 +1,479 @@
+import argparse
+import datetime
+import itertools
+import json
+import os
+import random
+import time
+
+import numpy as np
+
+import bess_control
+from device_profile import load_profile
+from discharge_schedule import compile_schedule
+from forecaster import RlsForecaster
+from history_store import HistoryStore
+from plant_simulator import daily_load_profile, solar_profile
+from power_controller import PIController, make_controller
+from zero_export import (
+    CONTROLLED_BRANCHES,
+    DEFAULT_PARAMS,
+    DECISION_BRANCHES,
+    PV_HOLD,
+    PV_LIMIT_MODES,
+    SETPOINT_HOLD,
+    SETPOINT_MODES,
+    bess_setpoint,
+    branch_keys,
+    branch_table,
+    inverter_actions,
+    pv_limit_setpoint,
+)
+
+# 🔁 Chạy lại cây quyết định zero-export (zero_export.py) trên dữ liệu các ngày đã ghi
+# trong lịch sử, với hàng nghìn bộ tham số cùng lúc, không cần đụng tới plant thật
+# - Vector hóa theo bộ tham số: mỗi chu kỳ là vài chục phép NumPy trên mảng N bộ tham số,
+#   vòng lặp Python chỉ chạy theo thời gian
+# - Mô hình plant đơn giản: tải và PV khả dụng lấy từ dữ liệu đã ghi, BESS đáp ứng lệnh
+#   bậc nhất (hằng số thời gian PCS_TAU) trong giới hạn của điểm charge_power, PV bị kẹp
+#   bởi pv_limit, SOC tích phân theo dung lượng BESS
+# - Bộ điều khiển: luật PI + feed-forward của power_controller.PIController
+#   (kp = ki = kff = 0 là luật tỉ lệ cũ); với kfc khác 0, dự báo tải/solar của
+#   forecaster.py cập nhật mỗi mẫu (trên site, chu kỳ tắt inverter không cập nhật)
+#   Mặc định là bộ điều khiển đang chạy trên site (BESS_CONTROLLER, BESS_CONTROLLER_PARAMS)
+# - Kết quả mỗi bộ tham số: năng lượng nhập/phát lưới, năng lượng qua BESS (cycling),
+#   PV bị cắt, số lệnh ghi BESS
+# - Tốc độ (đo trên một nhân CPU, synthetic 1 ngày): mỗi chu kỳ có ~0.3 ms chi phí Python
+#   cố định nên ở chu kỳ 5 s gốc chỉ ~100 bộ-ngày/s với 500 bộ tham số, ~250 với 2000 bộ,
+#   ~630 với 10000 bộ (chưa đạt hàng nghìn bộ-ngày/s); --step 60 nhanh hơn ~10 lần
+#   (~1100 bộ-ngày/s với 500 bộ), dùng để sàng lọc nhanh rồi chạy lại các bộ tốt nhất ở 5 s
+# Lưu ý: solar trong lịch sử là công suất sau khi đã bị cắt, nên PV khả dụng của những
+# lúc inverter bị giới hạn bị đánh giá thấp
+#
+# Chạy: python replay.py --history history/PL000027 --days 2026-10-01 2026-10-07 \
+#           --grid '{"pcs_gain": [0.8, 0.9, 1.0], "band_high": [0.2, 0.5, 1.0]}'
+#       python replay.py --synthetic 3 --step 60 --grid '{"ki": [0, 0.1, 0.3], "soc_min": [5, 10]}'
+
+BESS_CAPACITY = 200.0  # kWh
+PCS_TAU = 2.0  # Giây, hằng số thời gian đáp ứng của PCS
+MAX_SAMPLE_GAP = 60  # Giây, khoảng mất dữ liệu dài hơn bị cắt bớt
+
+PI_PARAMS = ("kp", "ki", "kff", "kfc", "target")
+
+
+# Tham số PI tương đương của một bộ điều khiển bess_control: luật tỉ lệ cũ với gain 1
+# là PI với kp = ki = kff = kfc = 0
+def controller_params(name, params):
+    controller = make_controller(name, **params)
+    if isinstance(controller, PIController):
+        return {key: float(getattr(controller, key)) for key in PI_PARAMS}
+    if controller.gain != 1:
+        raise ValueError("❌ Replay chỉ mô phỏng luật tỉ lệ với gain = 1")
+    return dict.fromkeys(PI_PARAMS, 0.0)
+
+
+CONTROLLER_PARAMS = controller_params(
+    bess_control.BESS_CONTROLLER, bess_control.BESS_CONTROLLER_PARAMS
+)
+REPLAY_DEFAULTS = {**DEFAULT_PARAMS, **CONTROLLER_PARAMS}
+
+CHARGE_POWER = load_profile(bess_control.BESS_PROFILE)["charge_power"]
+PV_LIMIT = load_profile(bess_control.DATA_MANAGEMENT_PROFILE)["pv_limit"]
+
+CONTROLLED_BIT = 16
+
+
+# Hành động của mỗi khóa đặc trưng (zero_export.branch_keys) gói trong một byte:
+# bit 0-1 chế độ lệnh BESS, bit 2-3 chế độ pv_limit (bảng dùng chung với
+# bess_control.decide(): zero_export.SETPOINT_MODES / PV_LIMIT_MODES), bit 4 có gọi bộ
+# điều khiển
+# Mỗi chu kỳ chỉ cần một lần tra bảng cho mọi bộ tham số
+def _action_table():
+    actions = np.zeros(len(DECISION_BRANCHES), dtype=np.uint8)
+    for code, branch in enumerate(DECISION_BRANCHES):
+        actions[code] = (
+            SETPOINT_MODES.get(branch, SETPOINT_HOLD)
+            | PV_LIMIT_MODES.get(branch, PV_HOLD) << 2
+            | (CONTROLLED_BIT if branch in CONTROLLED_BRANCHES else 0)
+        )
+    return actions.take(branch_table())
+
+
+ACTION_TABLE = _action_table()
+
+
+# 📅 Một ngày dữ liệu để replay: các mảng theo thời gian
+# (timestamp, dt, load, solar, within_timer, faults) và SOC lúc đầu ngày
+class ReplayDay:
+    def __init__(
+        self, label, timestamp, load, solar, within_timer, faults, soc, dt=None
+    ):
+        self.label = label
+        self.timestamp = timestamp
+        # Khoảng thời gian mỗi mẫu có hiệu lực, mẫu cuối lấy bằng mẫu trước đó
+        if dt is None:
+            dt = np.minimum(
+                np.diff(timestamp, append=timestamp[-1:] * 2 - timestamp[-2:-1]),
+                MAX_SAMPLE_GAP,
+            )
+        self.dt = dt
+        self.load = load
+        self.solar = solar
+        self.within_timer = within_timer
+        self.faults = faults
+        self.soc = soc
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    # Gộp các mẫu thành bước step giây (vd. 60) để quét nhiều bộ tham số nhanh hơn:
+    # tải/PV lấy trung bình theo thời gian, lịch xả lấy ở đầu bước, lỗi nếu có trong bước
+    # Bộ điều khiển khi đó chạy mỗi bước một lần nên chỉ là ước lượng của chu kỳ 5 s
+    def resample(self, step):
+        bins = ((self.timestamp - self.timestamp[0]) // step).astype(np.int64)
+        first = np.flatnonzero(np.diff(bins, prepend=-1))
+        dt = np.add.reduceat(self.dt, first)
+        return ReplayDay(
+            self.label,
+            self.timestamp[first],
+            np.add.reduceat(self.load * self.dt, first) / dt,
+            np.add.reduceat(self.solar * self.dt, first) / dt,
+            self.within_timer[first],
+            np.logical_or.reduceat(self.faults, first),
+            self.soc,
+            dt,
+        )
+
+
+def _timer_mask(schedule, timestamps):
+    return np.array(
+        [
+            schedule.is_active(datetime.datetime.fromtimestamp(timestamp))
+            for timestamp in timestamps
+        ],
+        dtype=bool,
+    )
+
+
+# Đọc một ngày (00:00 - 24:00 giờ máy) từ kho lịch sử, bỏ các chu kỳ thiếu dữ liệu
+def load_history_day(store, day, schedule):
+    start = datetime.datetime.combine(day, datetime.time()).timestamp()
+    rows = store.query(start, start + 86400)
+    valid = ~(np.isnan(rows["load_power"]) | np.isnan(rows["solar_power"]))
+    valid &= ~np.isnan(rows["bess_soc"])
+    rows = rows[valid]
+    if len(rows) < 2:
+        return None
+    timestamp = rows["timestamp"]
+    return ReplayDay(
+        day.isoformat(),
+        timestamp,
+        rows["load_power"].astype(np.float64),
+        np.maximum(rows["solar_power"], 0).astype(np.float64),
+        _timer_mask(schedule, timestamp),
+        rows["fault_bits"] != 0,
+        float(rows["bess_soc"][0]),
+    )
+
+
+# ☁️ Một ngày giả lập từ hồ sơ tải/PV của plant_simulator.py (khi chưa có lịch sử)
+def synthetic_day(
+    day, schedule, seed=0, period=5.0, pv_peak=125.0, base_load=60.0, soc=50.0
+):
+    rng = random.Random(seed)
+    start = datetime.datetime.combine(day, datetime.time()).timestamp()
+    timestamp = start + np.arange(0, 86400, period)
+    cloud = 1.0
+    load_step = 0.0
+    load = np.empty(len(timestamp))
+    solar = np.empty(len(timestamp))
+    for index, elapsed in enumerate(timestamp - start):
+        hour = elapsed / 3600
+        cloud = min(1.0, max(0.2, cloud + rng.gauss(0, 0.02) * period))
+        if rng.random() < period / 600:
+            load_step = rng.choice([-0.3, 0.0, 0.3]) * base_load
+        noise = 1 + rng.gauss(0, 0.01)
+        load[index] = max(
+            (daily_load_profile(hour, base_load) + load_step) * noise, 0.0
+        )
+        solar[index] = solar_profile(hour, pv_peak, cloud)
+    return ReplayDay(
+        f"{day.isoformat()} (giả lập {seed})",
+        timestamp,
+        load,
+        solar,
+        _timer_mask(schedule, timestamp),
+        np.zeros(len(timestamp), dtype=bool),
+        soc,
+    )
+
+
+# 🧮 Tích Descartes của các giá trị tham số -> {tên: mảng 1 chiều}; tham số không có
+# trong values giữ giá trị mặc định dạng số (so sánh với số nhanh hơn với mảng)
+def param_grid(defaults=REPLAY_DEFAULTS, **values):
+    names = list(values)
+    combos = list(itertools.product(*(np.atleast_1d(values[name]) for name in names)))
+    grid = {name: float(value) for name, value in defaults.items()}
+    for index, name in enumerate(names):
+        grid[name] = np.array([combo[index] for combo in combos], dtype=np.float64)
+    return grid
+
+
+# ▶️ Chạy một ngày với mọi bộ tham số trong params (mảng cùng độ dài N hoặc số)
+# Trả về {chỉ số: mảng N} theo kWh (trừ bess_writes, final_soc)
+# Mặt nạ được dùng như số 0/1 trong phép nhân thay vì np.where: với mặt nạ ngẫu nhiên
+# phép gán theo mặt nạ chậm hơn vài lần
+def replay_day(
+    day,
+    params,
+    pv_max=bess_control.PVmax,
+    capacity=BESS_CAPACITY,
+    pcs_tau=PCS_TAU,
+    period=bess_control.CONTROL_PERIOD,
+):
+    size = max(np.size(value) for value in params.values())
+    gain = params["pcs_gain"]
+    kp, ki, kff, kfc, target = (
+        params[name] for name in ("kp", "ki", "kff", "kfc", "target")
+    )
+    forecast = np.any(kfc)
+    load_forecaster = RlsForecaster()
+    solar_forecaster = RlsForecaster()
+    limit = CHARGE_POWER.maximum
+
+    bess = np.zeros(size)
+    soc = np.full(size, day.soc)
+    setpoint = np.zeros(size)
+    pv_limit = np.full(size, float(pv_max))
+    enabled = np.ones(size, dtype=bool)
+    integral = np.zeros(size)
+    last_net_load = np.zeros(size)
+    has_last = np.zeros(size, dtype=bool)  # Bộ điều khiển đã chạy ít nhất một lần
+    imported = np.zeros(size)
+    grid_energy = np.zeros(size)
+    cycled = np.zeros(size)
+    solar_energy = np.zeros(size)
+    writes = np.zeros(size)
+    available_energy = 0.0
+
+    response = 1 - np.exp(-day.dt / pcs_tau)
+    for index in range(len(day)):
+        load = float(day.load[index])
+        available = float(day.solar[index])
+        dt = float(day.dt[index])
+        within_timer = bool(day.within_timer[index])
+
+        solar = np.minimum(pv_limit, available)
+        grid = load - solar - bess
+        imported += np.maximum(grid, 0) * dt
+        grid_energy += grid * dt
+        cycled += np.abs(bess) * dt
+        solar_energy += solar * dt
+        available_energy += available * dt
+
+        # Bật/tắt inverter trước, chu kỳ tắt inverter không chạy cây quyết định
+        turn_off, turn_on = inverter_actions(within_timer, solar, soc, enabled, params)
+        pv_limit = pv_limit * ~(turn_off | turn_on) + turn_on * float(pv_max)
+        setpoint *= ~turn_on
+        enabled = (enabled & ~turn_off) | turn_on
+
+        key = branch_keys(
+            grid, bess, soc, solar, within_timer, bool(day.faults[index]), params
+        )
+        action = ACTION_TABLE.take(key) * ~turn_off
+
+        # PI + feed-forward, trạng thái chỉ cập nhật ở bộ tham số có nhánh điều khiển BESS
+        controlled = action >= CONTROLLED_BIT
+        error = grid - target
+        net_load = load - solar
+        feed_forward = kff * (net_load - last_net_load) * has_last
+        if forecast:
+            load_forecaster.update(load, dt)
+            solar_forecaster.update(solar, dt)
+            feed_forward += kfc * (
+                load_forecaster.forecast(period)
+                - np.maximum(solar_forecaster.forecast(period), 0)
+                - net_load
+            )
+        last_net_load += controlled * (net_load - last_net_load)
+        has_last |= controlled
+        command = error * (1 + kp) + bess + integral + feed_forward
+        saturated = ((command >= limit) & (error > 0)) | (
+            (command <= -limit) & (error < 0)
+        )
+        updated = np.minimum(
+            np.maximum(integral + ki * error * (dt / period), -limit), limit
+        )
+        integral += (controlled & ~saturated) * (updated - integral)
+
+        setpoint_mode = action & 3
+        keep = setpoint_mode == SETPOINT_HOLD
+        setpoint = setpoint * keep + bess_setpoint(setpoint_mode, command, gain)
+        setpoint = np.minimum(
+            np.maximum(setpoint, CHARGE_POWER.minimum), CHARGE_POWER.maximum
+        )
+        writes += ~keep | turn_on
+
+        pv_mode = action >> 2 & 3
+        pv_limit = np.maximum(
+            pv_limit * (pv_mode == PV_HOLD)
+            + pv_limit_setpoint(pv_mode, grid, solar, float(pv_max)),
+            PV_LIMIT.minimum,
+        )
+
+        # BESS đáp ứng lệnh tới mẫu tiếp theo, không xả khi cạn / không sạc khi đầy
+        blocked = ((setpoint > 0) & (soc <= 0)) | ((setpoint < 0) & (soc >= 100))
+        bess += (setpoint * ~blocked - bess) * response[index]
+        soc -= bess * (dt / 3600 / capacity * 100)
+        soc = np.minimum(np.maximum(soc, 0), 100)
+
+    return {
+        "import_kwh": imported / 3600,
+        "export_kwh": (imported - grid_energy) / 3600,
+        "cycled_kwh": cycled / 3600,
+        "curtailed_kwh": (available_energy - solar_energy) / 3600,
+        "bess_writes": writes,
+        "final_soc": soc,
+    }
+
+
+# Chạy nhiều ngày, cộng dồn kết quả (SOC cuối là của ngày cuối)
+def replay(days, params, **kwargs):
+    totals = {}
+    for day in days:
+        for name, values in replay_day(day, params, **kwargs).items():
+            if name == "final_soc":
+                totals[name] = values
+            else:
+                totals[name] = totals.get(name, 0) + values
+    return totals
+
+
+def _date_range(first, last):
+    day = first
+    while day <= last:
+        yield day
+        day += datetime.timedelta(days=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay cây quyết định zero-export")
+    parser.add_argument("--history", default=bess_control.HISTORY_DIR)
+    parser.add_argument(
+        "--days",
+        nargs=2,
+        metavar=("FROM", "TO"),
+        type=datetime.date.fromisoformat,
+        help="Khoảng ngày trong lịch sử, vd. 2026-10-01 2026-10-07",
+    )
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        metavar="N",
+        help="Dùng N ngày giả lập thay cho lịch sử",
+    )
+    parser.add_argument(
+        "--schedule", help="File lịch xả (time_conf.txt), mặc định lịch mặc định"
+    )
+    parser.add_argument(
+        "--grid",
+        default="{}",
+        help='Giá trị cần thử, vd. \'{"pcs_gain": [0.8, 1.0], "soc_min": [5, 10]}\'',
+    )
+    parser.add_argument("--pv-max", type=float, default=bess_control.PVmax)
+    parser.add_argument("--capacity", type=float, default=BESS_CAPACITY)
+    parser.add_argument("--pcs-tau", type=float, default=PCS_TAU)
+    parser.add_argument(
+        "--step",
+        type=float,
+        help="Gộp dữ liệu thành bước dài hơn (giây), vd. 60 để quét nhanh",
+    )
+    parser.add_argument(
+        "--sort",
+        default="import_kwh",
+        choices=("import_kwh", "export_kwh", "cycled_kwh", "curtailed_kwh"),
+    )
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--output", help="Ghi toàn bộ kết quả ra file JSON")
+    args = parser.parse_args()
+
+    discharge_data = bess_control.default_discharge_data
+    if args.schedule:
+        with open(args.schedule, "r") as file:
+            discharge_data = json.load(file)
+    schedule = compile_schedule(discharge_data)
+
+    if args.synthetic:
+        today = datetime.date.today()
+        days = [synthetic_day(today, schedule, seed) for seed in range(args.synthetic)]
+    else:
+        if not args.days:
+            parser.error("Cần --days hoặc --synthetic")
+        if not os.path.isdir(args.history):
+            parser.error(f"Không có thư mục lịch sử {args.history}")
+        store = HistoryStore(args.history)
+        days = []
+        for day in _date_range(*args.days):
+            replay_day_data = load_history_day(store, day, schedule)
+            if replay_day_data is None:
+                print(f"⚠️ {day}: không có dữ liệu")
+                continue
+            days.append(replay_day_data)
+        store.close()
+    if not days:
+        parser.error("Không có ngày nào để replay")
+    if args.step:
+        days = [day.resample(args.step) for day in days]
+
+    values = json.loads(args.grid)
+    unknown = set(values) - set(REPLAY_DEFAULTS)
+    if unknown:
+        parser.error(f"Tham số không hợp lệ: {sorted(unknown)}")
+    params = param_grid(**values)
+    size = max(np.size(value) for value in params.values())
+    samples = sum(len(day) for day in days)
+
+    started = time.perf_counter()
+    result = replay(
+        days,
+        params,
+        pv_max=args.pv_max,
+        capacity=args.capacity,
+        pcs_tau=args.pcs_tau,
+    )
+    elapsed = time.perf_counter() - started
+    print(
+        f"🔁 {size} bộ tham số × {len(days)} ngày ({samples} chu kỳ) trong "
+        f"{elapsed:.2f} s: {size * len(days) / elapsed:.0f} bộ-ngày/s"
+    )
+
+    params = {name: np.broadcast_to(value, size) for name, value in params.items()}
+    names = list(values) or ["pcs_gain"]
+    order = np.argsort(result[args.sort], kind="stable")
+    for index in order[: args.top]:
+        combo = ", ".join(f"{name}={params[name][index]:g}" for name in names)
+        print(
+            f"{combo}: nhập {result['import_kwh'][index]:.2f} kWh, "
+            f"phát {result['export_kwh'][index]:.2f} kWh, "
+            f"qua BESS {result['cycled_kwh'][index]:.2f} kWh "
+            f"({result['cycled_kwh'][index] / 2 / args.capacity:.2f} chu kỳ), "
+            f"PV cắt {result['curtailed_kwh'][index]:.2f} kWh, "
+            f"lệnh BESS {result['bess_writes'][index]:.0f}"
+        )
+
+    if args.output:
+        rows = [
+            {
+                **{name: float(values[index]) for name, values in params.items()},
+                **{name: float(values[index]) for name, values in result.items()},
+            }
+            for index in range(size)
+        ]
+        with open(args.output, "w") as file:
+            json.dump(
+                {"days": [day.label for day in days], "results": rows}, file, indent=2
+            )
+
+
+if __name__ == "__main__":
+    main()
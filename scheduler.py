@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import time
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger("my_logger")
+
+CYCLE_DURATION = Histogram(
+    "bess_cycle_duration_seconds", "Thời gian chạy một chu kỳ điều khiển", ("loop",)
+)
+CYCLE_OVERRUNS = Counter(
+    "bess_cycle_overruns_total", "Số deadline bị bỏ qua do chu kỳ quá hạn", ("loop",)
+)
+
+
+# ⏱️ Lập lịch chu kỳ điều khiển theo deadline trên đồng hồ monotonic
+# Chu kỳ k bắt đầu tại start + k * period, không cộng dồn thời gian xử lý như time.sleep(5)
+# Nếu một chu kỳ chạy quá hạn, các deadline đã lỡ bị bỏ qua (skipped) thay vì chạy dồn
+# next_wakeup(): trả về thời điểm (time.time()) cần chạy thêm một lần step() trước
+# deadline kế tiếp, vd. đúng lúc bắt đầu/kết thúc khung giờ xả; None nếu không có
+# run() chạy trên thread hiện tại; run_async() là task asyncio, step() chạy trong executor
+class CycleScheduler:
+    def __init__(
+        self, period, report_every=60, reporters=(), next_wakeup=None, name=""
+    ):
+        if period <= 0:
+            raise ValueError(f"❌ Chu kỳ {period}s không hợp lệ")
+        self.period = period
+        self.report_every = report_every
+        self.reporters = list(reporters)  # Hàm báo cáo chạy kèm mỗi lần report()
+        self.next_wakeup = next_wakeup
+        self.name = name  # Tên site, thêm vào đầu dòng báo cáo và nhãn số liệu
+        self._duration_metric = CYCLE_DURATION.labels(name or "main")
+        self._overrun_metric = CYCLE_OVERRUNS.labels(name or "main")
+        self.running = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {
+            "cycles": 0,
+            "overruns": 0,
+            "skipped": 0,
+            "last_duration": 0.0,
+            "max_duration": 0.0,
+            "last_jitter": 0.0,
+            "max_jitter": 0.0,
+            "total_jitter": 0.0,
+            "wakeups": 0,
+        }
+
+    # Ghi nhận một chu kỳ: jitter = trễ so với deadline, duration = thời gian chạy step
+    def _record(self, jitter, duration, skipped):
+        stats = self.stats
+        stats["cycles"] += 1
+        stats["last_jitter"] = jitter
+        stats["total_jitter"] += jitter
+        if jitter > stats["max_jitter"]:
+            stats["max_jitter"] = jitter
+        stats["last_duration"] = duration
+        if duration > stats["max_duration"]:
+            stats["max_duration"] = duration
+        if skipped:
+            stats["overruns"] += 1
+            stats["skipped"] += skipped
+
+    def report(self):
+        stats = self.stats
+        cycles = stats["cycles"] or 1
+        message = (
+            (f"[{self.name}] " if self.name else "")
+            + f"⏱️ Chu kỳ {self.period}s: {stats['cycles']} lần, "
+            f"jitter TB {stats['total_jitter'] / cycles * 1000:.1f} ms, "
+            f"max {stats['max_jitter'] * 1000:.1f} ms, "
+            f"thời gian chạy max {stats['max_duration'] * 1000:.1f} ms, "
+            f"quá hạn {stats['overruns']}, bỏ qua {stats['skipped']}, "
+            f"đánh thức theo lịch {stats['wakeups']}"
+        )
+        logger.info(message)
+        for reporter in self.reporters:
+            reporter()
+
+    # Thời điểm monotonic của lần đánh thức sớm nếu nó rơi trước deadline, ngược lại None
+    def _wakeup_before(self, deadline):
+        if self.next_wakeup is None:
+            return None
+        wakeup = self.next_wakeup()
+        if wakeup is None:
+            return None
+        now = time.monotonic()
+        wakeup = now + (wakeup - time.time())
+        return wakeup if now <= wakeup < deadline else None
+
+    def stop(self):
+        self.running = False
+
+    # Kết thúc một chu kỳ: ghi thống kê, trả về deadline kế tiếp (bỏ qua deadline đã lỡ)
+    def _finish_cycle(self, deadline, started, jitter):
+        finished = time.monotonic()
+        deadline += self.period
+        skipped = 0
+        if finished > deadline:
+            skipped = int((finished - deadline) // self.period) + 1
+            deadline += skipped * self.period
+        self._record(jitter, finished - started, skipped)
+        self._duration_metric.observe(finished - started)
+        if skipped:
+            self._overrun_metric.inc(skipped)
+        if self.report_every and self.stats["cycles"] % self.report_every == 0:
+            self.report()
+        return deadline
+
+    def run(self, step):
+        self.running = True
+        deadline = time.monotonic()
+        while self.running:
+            started = time.monotonic()
+            jitter = started - deadline
+            try:
+                step()
+            finally:
+                deadline = self._finish_cycle(deadline, started, jitter)
+            # Chạy thêm step() đúng thời điểm đánh thức, không đổi lịch deadline
+            wakeup = self._wakeup_before(deadline)
+            while wakeup is not None and self.running:
+                time.sleep(max(wakeup - time.monotonic(), 0))
+                self.stats["wakeups"] += 1
+                step()
+                wakeup = self._wakeup_before(deadline)
+            time.sleep(max(deadline - time.monotonic(), 0))
+
+    # Như run() nhưng chờ bằng asyncio.sleep, nhiều site chạy chung một event loop
+    async def run_async(self, step, executor=None):
+        loop = asyncio.get_running_loop()
+        self.running = True
+        deadline = time.monotonic()
+        while self.running:
+            started = time.monotonic()
+            jitter = started - deadline
+            try:
+                await loop.run_in_executor(executor, step)
+            finally:
+                deadline = self._finish_cycle(deadline, started, jitter)
+            wakeup = self._wakeup_before(deadline)
+            while wakeup is not None and self.running:
+                await asyncio.sleep(max(wakeup - time.monotonic(), 0))
+                self.stats["wakeups"] += 1
+                await loop.run_in_executor(executor, step)
+                wakeup = self._wakeup_before(deadline)
+            await asyncio.sleep(max(deadline - time.monotonic(), 0))
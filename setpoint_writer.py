@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+
+from metrics import Counter
+
+logger = logging.getLogger("my_logger")
+
+SETPOINT_WRITES = Counter(
+    "bess_setpoint_writes_total",
+    "Lệnh ghi setpoint theo kết quả (written, failed, duplicate, deadband, rate_limited)",
+    ("device", "register", "result"),
+)
+
+
+# ✍️ Lớp ghi lệnh: nhớ giá trị thiết bị đã xác nhận cho từng (thiết bị, unit, thanh ghi)
+# - Bỏ qua lệnh trùng với giá trị thiết bị đang giữ
+# - Bỏ qua thay đổi nhỏ hơn deadband của thanh ghi (lệnh về 0 luôn được ghi)
+# - Giới hạn tần suất ghi mỗi thanh ghi (min_interval giây)
+# - Ghi lại định kỳ sau refresh_interval giây phòng khi thiết bị khởi động lại
+class SetpointWriter:
+    def __init__(
+        self, write_fn, deadband=None, min_interval=None, refresh_interval=300
+    ):
+        self.write_fn = write_fn
+        self.deadband = deadband or {}
+        self.min_interval = min_interval or {}
+        self.refresh_interval = refresh_interval
+        self._acked = {}
+        # thanh ghi -> giá trị được yêu cầu gần nhất (kể cả bị bỏ qua)
+        self.requested = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            "written": 0,
+            "failed": 0,
+            "duplicate": 0,
+            "deadband": 0,
+            "rate_limited": 0,
+        }
+
+    def _count(self, name, key):
+        with self._lock:
+            self.stats[name] += 1
+        SETPOINT_WRITES.labels(f"{key[0]}:{key[1]}", key[3], name).inc()
+
+    def _suppress_reason(self, key, register, value, now):
+        last = self._acked.get(key)
+        if last is None:
+            return None
+        last_value, last_time = last
+        if now - last_time >= self.refresh_interval:
+            return None
+        if value == last_value:
+            return "duplicate"
+        if value != 0 and abs(value - last_value) <= self.deadband.get(register, 0):
+            return "deadband"
+        if now - last_time < self.min_interval.get(register, 0):
+            return "rate_limited"
+        return None
+
+    def write(self, client, register, value, unit_id=None, **kwargs):
+        self.requested[register] = value
+        key = None
+        if client is not None:
+            key = (client.host, client.port, unit_id, register)
+            now = time.monotonic()
+            reason = self._suppress_reason(key, register, value, now)
+            if reason is not None:
+                self._count(reason, key)
+                return True
+
+        if unit_id is None:
+            ok = self.write_fn(client, register, value, **kwargs)
+        else:
+            ok = self.write_fn(client, register, value, unit_id=unit_id, **kwargs)
+        if key is None:
+            return ok
+        if ok:
+            self._acked[key] = (value, now)
+            self._count("written", key)
+        else:
+            self._acked.pop(key, None)
+            self._count("failed", key)
+        return ok
+
+    def report(self):
+        stats = self.stats
+        suppressed = stats["duplicate"] + stats["deadband"] + stats["rate_limited"]
+        message = (
+            f"✍️ Lệnh ghi: {stats['written']} đã ghi, {stats['failed']} lỗi, "
+            f"{suppressed} bỏ qua (trùng {stats['duplicate']}, "
+            f"deadband {stats['deadband']}, giới hạn tần suất {stats['rate_limited']})"
+        )
+        logger.info(message)
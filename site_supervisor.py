@@ -0,0 +1,295 @@
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+import bess_control
+from metrics import Counter, Gauge, start_http_server
+from scheduler import CycleScheduler
+
+logger = logging.getLogger("my_logger")
+
+# 🏢 Một supervisor điều khiển nhiều site trên một máy
+# - Các site được chia đều cho một số process worker (mặc định = số CPU) để cô lập CPU
+# - Trong mỗi worker, mỗi site là một task asyncio với CycleScheduler riêng,
+#   I/O Modbus chạy trong thread pool; các site dùng chung pool Modbus và một kết nối MQTT
+# - Log và số liệu của worker gửi về process chính qua hàng đợi
+# - Worker chết được khởi động lại sau RESTART_DELAY giây
+# - Số liệu Prometheus: process chính ở cổng METRICS_PORT, worker i ở METRICS_PORT + 1 + i
+#   (kèm /trace và /telemetry của các site trong worker)
+#
+# File cấu hình (JSON):
+# {
+#     "workers": 4,
+#     "mqtt": {"broker": "core.ziot.vn", "port": 5000,
+#              "username": "iot2022", "password": "iot2022"},
+#     "sites": [
+#         {"name": "PL000027", "bess_ip": "192.168.1.100",
+#          "data_management_ip": "192.168.1.2", "pv_max": 125,
+#          "mqtt_topic": "CONFIG/DO000000/PO000012/SI0000014/PL000027/dischargeConfig",
+#          "controller": "pi", "controller_params": {"ki": 0.1, "kff": 0.5}}
+#     ]
+# }
+# Khóa của mỗi site là tham số của bess_control.Site
+# Chạy: python site_supervisor.py sites.json
+
+METRICS_INTERVAL = 30  # Giây giữa 2 lần worker gửi số liệu về
+REPORT_INTERVAL = 300  # Giây giữa 2 lần in báo cáo tổng hợp
+RESTART_DELAY = 5
+
+WORKERS_ALIVE = Gauge("bess_supervisor_workers_alive", "Số worker đang chạy")
+WORKER_RESTARTS = Counter(
+    "bess_supervisor_worker_restarts_total", "Số lần khởi động lại worker", ("worker",)
+)
+
+
+def load_config(path):
+    with open(path, "r", encoding="utf-8") as file:
+        config = json.load(file)
+    names = [site.get("name") for site in config.get("sites", [])]
+    if not names:
+        raise ValueError(f"❌ {path} không có site nào")
+    if not all(names) or len(set(names)) != len(names):
+        raise ValueError("❌ Mỗi site cần một 'name' riêng")
+    return config
+
+
+# Chia site cho các worker theo vòng tròn
+def split_sites(sites, workers):
+    groups = [sites[index::workers] for index in range(workers)]
+    return [group for group in groups if group]
+
+
+# 📡 Một kết nối MQTT cho tất cả site của worker, tự đăng ký lại khi kết nối lại
+def connect_mqtt(config, client_id, sites):
+    client = mqtt.Client(client_id)
+    client.username_pw_set(config.get("username"), config.get("password"))
+
+    def on_connect(client, userdata, flags, rc):
+        for site in sites:
+            site.attach_mqtt(client)
+
+    client.on_connect = on_connect
+    client.connect_async(config["broker"], config.get("port", 1883), 60)
+    client.loop_start()
+    threading.Thread(
+        target=bess_control.send_healthcheck, args=(client, sites), daemon=True
+    ).start()
+    return client
+
+
+async def publish_metrics(index, sites, schedulers, metrics_queue):
+    while True:
+        await asyncio.sleep(METRICS_INTERVAL)
+        for site in sites:
+            metrics = site.metrics()
+            metrics["scheduler"] = dict(schedulers[site.name].stats)
+            metrics["worker"] = index
+            metrics_queue.put((site.name, time.time(), metrics))
+
+
+async def run_worker(index, site_configs, mqtt_config, metrics_queue):
+    sites = [bess_control.Site(**config) for config in site_configs]
+    for site in sites:
+        site.load_discharge_data_from_file()
+    if bess_control.METRICS_PORT:
+        start_http_server(
+            bess_control.METRICS_PORT + 1 + index,
+            routes={
+                **bess_control.trace_routes(sites),
+                **bess_control.telemetry_routes(sites),
+            },
+        )
+    client = None
+    mqtt_sites = [site for site in sites if site.mqtt_topic]
+    if mqtt_config and mqtt_sites:
+        client = connect_mqtt(mqtt_config, f"bess_supervisor_{index}", mqtt_sites)
+
+    executor = ThreadPoolExecutor(max_workers=len(sites), thread_name_prefix="site")
+    schedulers = {
+        site.name: CycleScheduler(
+            bess_control.CONTROL_PERIOD,
+            report_every=0,
+            next_wakeup=site.next_timer_wakeup,
+            name=site.name,
+        )
+        for site in sites
+    }
+    tasks = [
+        asyncio.create_task(
+            schedulers[site.name].run_async(site.step, executor), name=site.name
+        )
+        for site in sites
+    ]
+    tasks.append(
+        asyncio.create_task(publish_metrics(index, sites, schedulers, metrics_queue))
+    )
+    logger.info(
+        "🚀 Worker %s: %s site (%s)",
+        index,
+        len(sites),
+        ", ".join(site.name for site in sites),
+    )
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        if client is not None:
+            client.loop_stop()
+        for site in sites:
+            site.close()
+        executor.shutdown(wait=False)
+
+
+# Điểm vào của process worker
+def worker_main(index, site_configs, mqtt_config, log_queue, metrics_queue):
+    logger.handlers.clear()
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(logging.DEBUG)
+    asyncio.run(run_worker(index, site_configs, mqtt_config, metrics_queue))
+
+
+class Supervisor:
+    def __init__(self, config, workers=None):
+        self.config = config
+        workers = workers or config.get("workers") or os.cpu_count() or 1
+        self.groups = split_sites(config["sites"], workers)
+        # spawn: worker không thừa hưởng thread/lock của process chính
+        self.context = multiprocessing.get_context("spawn")
+        self.log_queue = self.context.Queue()
+        self.metrics_queue = self.context.Queue()
+        self.metrics = {}  # tên site -> (thời điểm, số liệu)
+        self._lock = threading.Lock()
+        self.processes = {}
+        self.restarts = 0
+        self.running = False
+
+    def _start_worker(self, index):
+        process = self.context.Process(
+            target=worker_main,
+            args=(
+                index,
+                self.groups[index],
+                self.config.get("mqtt"),
+                self.log_queue,
+                self.metrics_queue,
+            ),
+            name=f"bess_worker_{index}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[index] = process
+
+    def _collect_metrics(self):
+        while True:
+            name, timestamp, metrics = self.metrics_queue.get()
+            with self._lock:
+                self.metrics[name] = (timestamp, metrics)
+
+    # 📊 Tổng hợp số liệu của mọi site
+    def summary(self):
+        with self._lock:
+            metrics = dict(self.metrics)
+        totals = {"sites": len(metrics), "cycles": 0, "overruns": 0}
+        totals.update(written=0, failed=0, max_duration=0.0)
+        for _, site_metrics in metrics.values():
+            scheduler = site_metrics["scheduler"]
+            setpoints = site_metrics["setpoints"]
+            totals["cycles"] += scheduler["cycles"]
+            totals["overruns"] += scheduler["overruns"]
+            totals["max_duration"] = max(
+                totals["max_duration"], scheduler["max_duration"]
+            )
+            totals["written"] += setpoints["written"]
+            totals["failed"] += setpoints["failed"]
+        return totals
+
+    def report(self):
+        totals = self.summary()
+        logger.info(
+            "🏢 %s/%s site báo cáo, %s worker, %s chu kỳ, quá hạn %s, "
+            "chu kỳ chậm nhất %.1f ms, lệnh ghi %s (lỗi %s), khởi động lại %s",
+            totals["sites"],
+            sum(len(group) for group in self.groups),
+            len(self.groups),
+            totals["cycles"],
+            totals["overruns"],
+            totals["max_duration"] * 1000,
+            totals["written"],
+            totals["failed"],
+            self.restarts,
+        )
+
+    def run(self):
+        # Log của worker đi vào logger của process chính (file + console)
+        listener = QueueListener(self.log_queue, logger)
+        listener.start()
+        threading.Thread(target=self._collect_metrics, daemon=True).start()
+        for index in range(len(self.groups)):
+            self._start_worker(index)
+
+        self.running = True
+        next_report = time.monotonic() + REPORT_INTERVAL
+        try:
+            while self.running:
+                time.sleep(1)
+                for index, process in list(self.processes.items()):
+                    if not process.is_alive():
+                        logger.error(
+                            "💥 Worker %s dừng (mã %s), khởi động lại sau %ss",
+                            index,
+                            process.exitcode,
+                            RESTART_DELAY,
+                        )
+                        time.sleep(RESTART_DELAY)
+                        self.restarts += 1
+                        WORKER_RESTARTS.labels(index).inc()
+                        self._start_worker(index)
+                WORKERS_ALIVE.set(
+                    sum(process.is_alive() for process in self.processes.values())
+                )
+                if time.monotonic() >= next_report:
+                    next_report += REPORT_INTERVAL
+                    self.report()
+        finally:
+            self.stop()
+            listener.stop()
+
+    def stop(self):
+        self.running = False
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Điều khiển nhiều site BESS")
+    parser.add_argument("config", help="File JSON danh sách site")
+    parser.add_argument("--workers", type=int, help="Số process worker")
+    args = parser.parse_args()
+
+    bess_control.setup_logging()
+    if bess_control.METRICS_PORT:
+        start_http_server(bess_control.METRICS_PORT)
+    supervisor = Supervisor(load_config(args.config), args.workers)
+    logger.info(
+        "🏢 Bắt đầu %s site trên %s worker",
+        len(supervisor.config["sites"]),
+        len(supervisor.groups),
+    )
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        logger.info("Dừng supervisor...")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+from array import array
+import bisect
+
+# Các cột mặc định, đơn vị kW và %
+TELEMETRY_FIELDS = ("grid_power", "solar_power", "bess_power", "bess_soc", "load_power")
+
+
+# 📈 Bộ đệm vòng cấp phát sẵn cho mẫu đo theo thời gian, append O(1)
+# Mỗi mẫu được ghi 2 lần (vị trí i và i + capacity) nên N mẫu gần nhất luôn nằm liền nhau:
+# window() trả về memoryview không sao chép, không phải ghép 2 đoạn khi vòng bị quấn
+class TelemetryRingBuffer:
+    def __init__(self, capacity, fields=TELEMETRY_FIELDS):
+        if capacity <= 0:
+            raise ValueError(f"❌ Dung lượng {capacity} không hợp lệ")
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        self._columns = [
+            array("d", bytes(16 * capacity)) for _ in range(len(fields) + 1)
+        ]
+        self._views = [memoryview(column) for column in self._columns]
+        self.head = 0  # Vị trí ghi mẫu tiếp theo
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, timestamp, *values):
+        head = self.head
+        mirror = head + self.capacity
+        columns = self._columns
+        columns[0][head] = columns[0][mirror] = timestamp
+        for column, value in zip(columns[1:], values):
+            column[head] = column[mirror] = value
+        self.head = (head + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    def _bounds(self, count):
+        count = self.size if count is None else min(count, self.size)
+        end = self.head + self.capacity
+        return end - count, end
+
+    # 🔍 count mẫu gần nhất: {"timestamp": memoryview, tên cột: memoryview}
+    def window(self, count=None):
+        start, end = self._bounds(count)
+        result = {"timestamp": self._views[0][start:end]}
+        for name, view in zip(self.fields, self._views[1:]):
+            result[name] = view[start:end]
+        return result
+
+    # Các mẫu trong `seconds` giây gần nhất (tính từ mẫu mới nhất)
+    def window_since(self, seconds):
+        if not self.size:
+            return self.window(0)
+        start, end = self._bounds(None)
+        timestamps = self._views[0][start:end]
+        first = bisect.bisect_left(timestamps, timestamps[-1] - seconds)
+        return self.window(self.size - first)
+
+    def latest(self):
+        if not self.size:
+            return None
+        index = self.head + self.capacity - 1
+        sample = {"timestamp": self._columns[0][index]}
+        for name, column in zip(self.fields, self._columns[1:]):
+            sample[name] = column[index]
+        return sample
+
+    # 📉 Gộp mỗi `bucket` mẫu thành (thời điểm đầu, min, max, mean) của một cột
+    def downsample(self, field, bucket, count=None):
+        window = self.window(count)
+        timestamps = window["timestamp"]
+        values = window[field]
+        result = []
+        for start in range(0, len(values), bucket):
+            chunk = values[start : start + bucket]
+            result.append(
+                (timestamps[start], min(chunk), max(chunk), sum(chunk) / len(chunk))
+            )
+        return result
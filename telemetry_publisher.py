@@ -0,0 +1,134 @@
+from collections import deque
+import json
+import logging
+import threading
+
+from telemetry_buffer import TELEMETRY_FIELDS
+
+logger = logging.getLogger("my_logger")
+
+VALUE_SCALE = 100  # Giá trị gửi đi là số nguyên theo 0.01 đơn vị (kW, %)
+
+
+# 📦 Mã hóa một lô mẫu thành JSON nén delta
+# {"fields": [...], "scale": 100, "t": [t0 ms, Δt...], "v": [[v0, Δv...] mỗi cột]}
+# Các mẫu liên tiếp thay đổi ít nên phần lớn Δ là số nguyên nhỏ
+def encode_batch(samples, fields=TELEMETRY_FIELDS, scale=VALUE_SCALE):
+    columns = [[] for _ in range(len(fields) + 1)]
+    previous = [0] * (len(fields) + 1)
+    for sample in samples:
+        current = [round(sample[0] * 1000)]
+        current.extend(round(value * scale) for value in sample[1:])
+        for column, value, last in zip(columns, current, previous):
+            column.append(value - last)
+        previous = current
+    return json.dumps(
+        {"fields": list(fields), "scale": scale, "t": columns[0], "v": columns[1:]},
+        separators=(",", ":"),
+    )
+
+
+# Giải mã ngược encode_batch(): danh sách (timestamp, giá trị...)
+def decode_batch(payload):
+    batch = json.loads(payload)
+    scale = batch["scale"]
+    columns = []
+    for column in [batch["t"]] + batch["v"]:
+        total = 0
+        values = []
+        for delta in column:
+            total += delta
+            values.append(total)
+        columns.append(values)
+    return [
+        (timestamp / 1000,) + tuple(value / scale for value in values)
+        for timestamp, *values in zip(*columns)
+    ]
+
+
+# 📡 Gửi telemetry theo lô qua kết nối paho-mqtt sẵn có
+# - add() chỉ thêm mẫu vào lô hiện tại, không chặn thread điều khiển; khi chưa attach()
+#   lô đầy được đóng ngay vào hàng đợi tồn đọng
+# - Thread nền đóng lô khi đủ batch_size mẫu hoặc sau flush_interval giây
+# - Lô chưa gửi được (mất kết nối broker) nằm trong hàng đợi tồn đọng có giới hạn,
+#   đầy thì bỏ lô cũ nhất; gửi lại theo thứ tự khi kết nối lại
+class TelemetryPublisher:
+    def __init__(
+        self,
+        topic=None,
+        fields=TELEMETRY_FIELDS,
+        batch_size=12,
+        flush_interval=60,
+        qos=1,
+        backlog=1440,
+    ):
+        self.topic = topic
+        self.fields = tuple(fields)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.qos = qos
+        self.client = None
+        self._batch = []
+        self._backlog = deque(maxlen=backlog)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.stats = {"samples": 0, "published": 0, "dropped": 0}
+
+    def add(self, timestamp, *values):
+        with self._lock:
+            self._batch.append((timestamp,) + values)
+            self.stats["samples"] += 1
+            full = len(self._batch) >= self.batch_size
+        if not full:
+            return
+        if self._thread is None:
+            # Chưa có thread gửi (site không có MQTT, kết nối broker lỗi): đóng lô ngay vào
+            # hàng đợi tồn đọng có giới hạn để bộ nhớ không tăng mãi
+            self._close_batch()
+        else:
+            self._wakeup.set()
+
+    # Gắn client paho đã kết nối và bắt đầu thread gửi
+    def attach(self, client, topic=None):
+        self.client = client
+        if topic is not None:
+            self.topic = topic
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="mqtt_telemetry", daemon=True
+            )
+            self._thread.start()
+
+    def _close_batch(self):
+        with self._lock:
+            samples, self._batch = self._batch, []
+        if not samples:
+            return
+        if len(self._backlog) == self._backlog.maxlen:
+            self.stats["dropped"] += 1
+        self._backlog.append(encode_batch(samples, self.fields))
+
+    def flush(self):
+        self._close_batch()
+        client = self.client
+        while self._backlog and client is not None:
+            result = client.publish(self.topic, self._backlog[0], qos=self.qos)
+            if result.rc != 0:  # MQTT_ERR_SUCCESS
+                logger.warning(
+                    "⚠️ Chưa gửi được telemetry (rc=%s), %s lô đang chờ",
+                    result.rc,
+                    len(self._backlog),
+                )
+                return
+            self._backlog.popleft()
+            self.stats["published"] += 1
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("❌ Lỗi khi gửi telemetry: %s", e)
@@ -0,0 +1,123 @@
+import json
+
+import pytest
+
+import bess_control
+
+
+@pytest.fixture
+def site(tmp_path):
+    site = bess_control.Site(
+        config_file=str(tmp_path / "time_conf.txt"),
+        history_dir=str(tmp_path / "history"),
+    )
+    site.events = []
+    site.log_event = lambda event, *args, **fields: site.events.append(event)
+    return site
+
+
+def snapshot(**values):
+    readings = dict(
+        timestamp=1000.0,
+        bess_power=0.0,
+        bess_soc=50.0,
+        bess_state=0,
+        faults_word=None,
+        total_solar_production=20.0,
+        grid_import=2.0,
+        grid_export=0.0,
+    )
+    readings.update(values)
+    return readings
+
+
+def run_cycle(site, monkeypatch, within_timer, readings, online=("bess", "dm")):
+    clients = {site.bess_ip: "bess", site.data_management_ip: "dm"}
+    monkeypatch.setattr(
+        site, "connect", lambda ip: clients[ip] if clients[ip] in online else None
+    )
+    monkeypatch.setattr(site.poller, "poll", lambda: readings)
+    monkeypatch.setattr(site, "is_within_timer", lambda: within_timer)
+    bess_control.control_step(site)
+
+
+# Data Management mất kết nối: không có số đo solar, dừng chu kỳ trước khi xét inverter
+def test_data_management_offline_stops_cycle(site, monkeypatch):
+    readings = snapshot(total_solar_production=None, grid_import=None)
+    run_cycle(site, monkeypatch, True, readings, online=("bess",))
+    assert site.events == ["data_management_offline"]
+    assert site.enb_inv
+
+
+def test_missing_solar_reading_skips_cycle(site, monkeypatch):
+    run_cycle(site, monkeypatch, True, snapshot(total_solar_production=None))
+    assert site.events == ["missing_data"]
+    assert site.enb_inv
+
+
+def test_telemetry_snapshot_downsamples_recent_window(site, monkeypatch):
+    monkeypatch.setattr(bess_control, "CONTROL_PERIOD", 5)
+    for index in range(1000):
+        site.telemetry.append(index * 5.0, index, 1.0, 0.0, 50.0, 2.0)
+    snapshot = site.telemetry_snapshot(seconds=600, bucket=60)
+    assert snapshot["latest"]["timestamp"] == 4995.0
+    assert snapshot["latest"]["grid_power"] == 999
+    grid = snapshot["series"]["grid_power"]
+    # 121 mẫu trong 600 s gần nhất, gộp 12 mẫu mỗi điểm
+    assert len(grid) == 11
+    assert grid[0] == (4395.0, 879, 890, 884.5)
+    assert grid[-1] == (4995.0, 999, 999, 999)
+    assert snapshot["series"]["bess_soc"][0][1:] == (50.0, 50.0, 50.0)
+
+
+def test_telemetry_route_renders_json(site):
+    site.name = "PL1"
+    content_type, render = bess_control.telemetry_routes([site])["/telemetry"]
+    assert content_type == "application/json"
+    assert json.loads(render()) == {
+        "PL1": {
+            "latest": None,
+            "series": {field: [] for field in site.telemetry.fields},
+        }
+    }
+    site.telemetry.append(10.0, 1.0, 2.0, 3.0, 4.0, 5.0)
+    assert json.loads(render())["PL1"]["series"]["load_power"] == [[10.0, 5, 5, 5]]
+
+
+def test_decode_faults_maps_register_bits():
+    assert bess_control.decode_faults(None) == ()
+    assert bess_control.decode_faults([0, 0, 0, 0]) == ()
+    faults = bess_control.decode_faults([0b101, 0, 0, 1 << 15])
+    assert faults == (
+        "Phase-lock alarm",
+        "AC side hardware soft start fault",
+        "DSP software version mismatch fault",
+    )
+    # Bit không có trong bảng lỗi và thanh ghi thừa bị bỏ qua
+    assert bess_control.decode_faults([0, 0, 0, 0, 0xFFFF]) == ()
+    assert bess_control.fault_bits([1, 2, 0, 0x8000]) == 1 | 2 << 16 | 0x8000 << 48
+
+
+def test_fault_tracker_reports_only_transitions():
+    tracker = bess_control.FaultTracker()
+    first = bess_control.decode_faults([0b11, 0, 0, 0])
+    assert tracker.update(first, 10) == (
+        ["Phase-lock alarm", "DC side hardware soft start fault"],
+        [],
+    )
+    # Cùng bộ lỗi (decode_faults trả về cùng tuple từ cache): không có chuyển trạng thái
+    assert tracker.update(bess_control.decode_faults([0b11, 0, 0, 0]), 15) == ([], [])
+    second = bess_control.decode_faults([0b10, 0, 1, 0])
+    assert tracker.update(second, 20) == (
+        ["RS485 communication fault"],
+        ["Phase-lock alarm"],
+    )
+    assert tracker.active == {
+        "DC side hardware soft start fault": 10,
+        "RS485 communication fault": 20,
+    }
+    assert tracker.update((), 30) == (
+        [],
+        ["DC side hardware soft start fault", "RS485 communication fault"],
+    )
+    assert tracker.active == {}
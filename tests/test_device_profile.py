@@ -0,0 +1,115 @@
+import json
+
+import pytest
+
+from device_profile import DeviceProfile, ProfilePoint, ReadPlan, load_profile
+
+
+def test_scale_decodes_exact_decimals():
+    point = ProfilePoint("bess_soc", 587, "uint16", scale=0.1)
+    assert point.decode(587) == 58.7
+    assert point.decode(3) == 0.3
+    assert ProfilePoint("energy", 0, "uint32", scale=0.001).decode(1234) == 1.234
+    assert ProfilePoint("gain", 0, "int16", scale=2).decode(21) == 42
+    assert ProfilePoint("raw_value", 0, "int16").decode is None
+
+
+def test_encode_rounds_and_clamps():
+    point = ProfilePoint("charge_power", 618, "int16", scale=0.1, min=-120, max=120)
+    assert point.encode(12.34) == 123
+    assert point.encode(-0.26) == -3
+    assert point.encode(500) == 1200
+    assert point.encode(-500) == -1200
+    assert point.to_registers(-1.0) == [0xFFF6]
+    assert point.from_registers([0xFFF6]) == -1.0
+    # Không có min/max: kẹp theo khoảng của kiểu thanh ghi
+    unsigned = ProfilePoint("pv_limit", 0, "uint16", scale=0.01)
+    assert unsigned.encode(-5) == 0
+    assert unsigned.encode(1000) == 0xFFFF
+
+
+def test_negative_scale_swaps_limits():
+    point = ProfilePoint("export", 0, "int16", scale=-0.1, min=-10, max=50)
+    assert point.encode(60) == -500
+    assert point.encode(-20) == 100
+
+
+def test_deadband_in_register_units():
+    point = ProfilePoint(
+        "charge_power", 618, "int16", scale=0.1, access="write", deadband=0.2
+    )
+    assert point.deadband == 2
+    assert ProfilePoint("state", 1, "uint16").encode(3.6) == 4
+
+
+@pytest.mark.parametrize(
+    "spec",
+    [
+        dict(type="int64"),
+        dict(type="int16", access="readwrite"),
+        dict(type="int16", poll="fast"),
+        dict(type="raw", access="write"),
+        dict(type="int16", scale=0),
+    ],
+)
+def test_invalid_point_rejected(spec):
+    with pytest.raises(ValueError):
+        ProfilePoint("point", 0, **spec)
+
+
+def test_invalid_profile_rejected():
+    with pytest.raises(ValueError):
+        DeviceProfile("PCS", {"soc": {"address": 1, "type": "uint16", "units": "%"}})
+    with pytest.raises(ValueError):
+        DeviceProfile("PCS", {}, byteorder="middle")
+
+
+def test_load_profile_from_path_and_cache(tmp_path):
+    path = tmp_path / "meter.json"
+    path.write_text(
+        json.dumps(
+            {
+                "model": "Meter",
+                "wordorder": "little",
+                "points": {
+                    "import": {"address": 10, "type": "uint32", "scale": 0.001},
+                    "export": {"address": 12, "type": "uint32", "scale": 0.001},
+                    "serial": {"address": 100, "type": "uint16", "poll": "slow"},
+                },
+            }
+        )
+    )
+    profile = load_profile(str(path))
+    assert load_profile(str(path)) is profile
+    assert profile.model == "Meter"
+    assert profile["import"].from_registers([0x5678, 0x0001]) == 0x15678 / 1000
+    assert set(profile.read_points(13)) == {"import", "export"}
+    assert profile.write_points() == {}
+    with pytest.raises(ValueError):
+        load_profile(str(tmp_path / "missing.json"))
+
+
+def test_shipped_profiles_compile():
+    pcs = load_profile("pcs")
+    assert set(pcs.write_points()) == {"charge_power"}
+    assert pcs["charge_power"].encode(200) == 1200
+    plan = ReadPlan([(1, pcs)])
+    assert [span[:3] for span in plan.cycle] == [(1, 570, 18), (1, 25132, 4)]
+    data_manager = load_profile("data_manager")
+    load_meter = load_profile("load_meter")
+    ReadPlan([(3, data_manager), (13, load_meter)])
+
+
+def test_read_plan_rejects_duplicate_names_and_polls_slow_points():
+    pcs = load_profile("pcs")
+    with pytest.raises(ValueError):
+        ReadPlan([(1, pcs), (2, pcs)])
+    slow = DeviceProfile(
+        "Meter", {"serial": {"address": 1, "type": "uint16", "poll": "slow"}}
+    )
+    plan = ReadPlan([(1, slow)], slow_interval=60)
+    assert plan.cycle == []
+    assert plan.slow_due(now=100)
+    assert not plan.slow_due(now=159)
+    assert plan.slow_due(now=160)
+    assert not ReadPlan([(1, pcs)]).slow_due(now=0)
@@ -0,0 +1,109 @@
+import datetime
+import sys
+
+import numpy as np
+import pytest
+
+import discharge_optimizer
+from discharge_optimizer import (
+    DEFAULT_TARIFF,
+    evaluate_windows,
+    history_profiles,
+    mask_to_windows,
+    optimize_windows,
+    tariff_prices,
+    windows_to_discharge_data,
+)
+from history_store import HISTORY_FIELDS, record_layout
+
+SLOTS = 288
+
+
+def midnight(day):
+    return datetime.datetime.combine(day, datetime.time()).timestamp()
+
+
+# Kho lịch sử giả: mỗi ngày một mức tải cố định, ghi lại các khoảng được truy vấn
+class FakeStore:
+    def __init__(self, loads):
+        self.loads = loads
+        self.queries = []
+        self.dtype = record_layout(HISTORY_FIELDS)[1]
+
+    def query(self, start, end):
+        self.queries.append((start, end))
+        day = datetime.date.fromtimestamp(start)
+        if day not in self.loads:
+            return np.empty(0, dtype=self.dtype)
+        rows = np.zeros(SLOTS, dtype=self.dtype)
+        rows["timestamp"] = start + np.arange(SLOTS) * 300
+        rows["load_power"] = self.loads[day]
+        rows["solar_power"] = 1.0
+        rows["bess_soc"] = np.linspace(20, self.loads[day], SLOTS)
+        return rows
+
+
+def test_history_profiles_averages_requested_days_only():
+    today = datetime.date(2024, 6, 10)
+    day = datetime.timedelta(days=1)
+    store = FakeStore({today - 2 * day: 10.0, today - day: 20.0, today: 90.0})
+    load, solar, last_soc = history_profiles(store, today - 2 * day, today - day)
+    assert len(store.queries) == 2
+    np.testing.assert_allclose(load, 15.0)
+    np.testing.assert_allclose(solar, 1.0)
+    assert last_soc == 20.0
+
+
+def test_main_profiles_full_days_before_today(monkeypatch, tmp_path, capsys):
+    calls = []
+
+    def profiles(store, first_day, last_day):
+        calls.append((first_day, last_day))
+        return np.full(SLOTS, 5.0), np.zeros(SLOTS), 50.0
+
+    monkeypatch.setattr(discharge_optimizer, "history_profiles", profiles)
+    monkeypatch.setattr(
+        sys, "argv", ["discharge_optimizer.py", "--history", str(tmp_path)]
+    )
+    discharge_optimizer.main()
+    today = datetime.date.today()
+    assert calls == [
+        (today - datetime.timedelta(days=14), today - datetime.timedelta(days=1))
+    ]
+    assert "Khung xả tối ưu" in capsys.readouterr().out
+
+
+def test_tariff_prices_cover_day_and_reject_gaps():
+    prices = tariff_prices(DEFAULT_TARIFF)
+    assert len(prices) == SLOTS
+    assert prices[0] == 1190 and prices[-1] == 1190
+    assert prices[18 * 12] == 3398
+    with pytest.raises(ValueError):
+        tariff_prices(DEFAULT_TARIFF[1:])
+    with pytest.raises(ValueError):
+        tariff_prices([{"start": "25:00", "end": "01:00", "price": 1}])
+
+
+def test_mask_to_windows_merges_overnight():
+    windows = np.zeros(SLOTS, dtype=bool)
+    windows[:12] = windows[-24:] = True
+    windows[100:110] = True
+    assert mask_to_windows(windows) == [(500, 550), (1320, 60)]
+    data = windows_to_discharge_data(mask_to_windows(np.zeros(SLOTS, dtype=bool)))
+    assert data[0]["DISCHARGE_START_H"] == data[0]["DISCHARGE_END_H"] == 0
+
+
+# Không có PV, BESS chỉ đủ cho một phần cao điểm: chỉ xả trong giờ cao điểm tới SOC sàn
+def test_optimize_discharges_in_peak():
+    prices = tariff_prices(DEFAULT_TARIFF)
+    load = np.full(SLOTS, 20.0)
+    solar = np.zeros(SLOTS)
+    model = dict(capacity=60.0, max_power=50.0, soc_start=100.0)
+    windows = optimize_windows(load, solar, prices, **model)
+    assert len(mask_to_windows(windows)) == 1
+    assert (prices[windows] == prices.max()).all()
+    optimized = evaluate_windows(windows, load, solar, prices, **model)
+    baseline = evaluate_windows(np.zeros(SLOTS, bool), load, solar, prices, **model)
+    assert optimized["cost"] < baseline["cost"]
+    assert optimized["discharged_kwh"] == pytest.approx(54.0)
+    assert optimized["final_soc"] == pytest.approx(10.0)
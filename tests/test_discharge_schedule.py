@@ -0,0 +1,137 @@
+import datetime
+import json
+import time
+
+import pytest
+
+from discharge_schedule import BackgroundJsonWriter, atomic_write_json, compile_schedule
+
+MONDAY = datetime.date(2024, 6, 10)
+
+
+def at(hour, minute=0, day=MONDAY):
+    return datetime.datetime.combine(day, datetime.time(hour, minute))
+
+
+def window(start_h, start_m, end_h, end_m, **extra):
+    return {
+        "DISCHARGE_START_H": start_h,
+        "DISCHARGE_START_M": start_m,
+        "DISCHARGE_END_H": end_h,
+        "DISCHARGE_END_M": end_m,
+        **extra,
+    }
+
+
+# Cấu hình cũ một khung giờ, nửa mở [start, end)
+def test_single_window_lookup():
+    schedule = compile_schedule([window(17, 30, 20, 0)])
+    assert not schedule.is_active(at(17, 29))
+    assert schedule.is_active(at(17, 30))
+    assert schedule.is_active(at(19, 59))
+    assert not schedule.is_active(at(20, 0))
+
+
+def test_schedule_is_immutable():
+    schedule = compile_schedule([window(17, 0, 20, 0)])
+    with pytest.raises(AttributeError):
+        schedule.windows = ()
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        [],
+        {"DISCHARGE_START_H": 1},
+        [{"DISCHARGE_START_H": 17}],
+        [window(25, 0, 1, 0)],
+        [window(17, 0, 20, 0.5)],
+        ["17:00"],
+    ],
+)
+def test_invalid_config_rejected(data):
+    with pytest.raises(ValueError):
+        compile_schedule(data)
+
+
+def test_atomic_write_json(tmp_path):
+    path = str(tmp_path / "time_conf.txt")
+    atomic_write_json(path, [window(17, 0, 20, 0)])
+    with open(path) as file:
+        assert json.load(file) == [window(17, 0, 20, 0)]
+    assert not (tmp_path / "time_conf.txt.tmp").exists()
+
+
+def test_background_writer_keeps_latest(tmp_path):
+    path = tmp_path / "time_conf.txt"
+    writer = BackgroundJsonWriter(str(path))
+    data = [window(17, 0, 20, 0)]
+    writer.save(data)
+    data[0]["DISCHARGE_END_H"] = 21  # save() giữ bản sao, sửa sau không ảnh hưởng
+    writer.save([window(18, 0, 22, 0)])
+    deadline = time.monotonic() + 2
+    while time.monotonic() < deadline:
+        if path.exists() and json.loads(path.read_text()) == [window(18, 0, 22, 0)]:
+            break
+        time.sleep(0.01)
+    assert json.loads(path.read_text()) == [window(18, 0, 22, 0)]
+
+
+def test_overlapping_windows_merge():
+    schedule = compile_schedule([window(9, 0, 11, 0), window(10, 0, 12, 0)])
+    assert schedule.is_active(at(11, 30))
+    assert schedule.next_transition(at(9, 30)) == at(12, 0)
+
+
+# Khung qua đêm thứ 6: phần sau nửa đêm thuộc thứ 7, không thuộc sáng thứ 6
+def test_overnight_window_belongs_to_next_day():
+    friday = MONDAY + datetime.timedelta(days=4)
+    saturday = friday + datetime.timedelta(days=1)
+    schedule = compile_schedule([window(22, 0, 2, 0, DAYS=[4])])
+    assert not schedule.is_active(at(1, 0, friday))
+    assert schedule.is_active(at(23, 0, friday))
+    assert schedule.is_active(at(1, 59, saturday))
+    assert not schedule.is_active(at(2, 0, saturday))
+    assert not schedule.is_active(at(23, 0, saturday))
+
+
+def test_day_types_and_holidays():
+    holiday = MONDAY + datetime.timedelta(days=1)
+    schedule = compile_schedule(
+        [
+            window(17, 0, 20, 0, DAYS=[0, 1, 2, 3, 4]),
+            window(10, 0, 12, 0, DAYS=[5, 6, 7]),
+            {"HOLIDAYS": [holiday.isoformat()]},
+        ]
+    )
+    assert schedule.is_active(at(18, 0))
+    assert not schedule.is_active(at(11, 0))
+    assert schedule.is_active(at(11, 0, holiday))
+    assert not schedule.is_active(at(18, 0, holiday))
+    sunday = MONDAY + datetime.timedelta(days=6)
+    assert schedule.is_active(at(11, 0, sunday))
+
+
+def test_next_transition():
+    schedule = compile_schedule([window(17, 0, 20, 0), window(22, 0, 2, 0)])
+    assert schedule.next_transition(at(12, 0)) == at(17, 0)
+    assert schedule.next_transition(at(17, 0)) == at(20, 0)
+    tuesday = MONDAY + datetime.timedelta(days=1)
+    assert schedule.next_transition(at(23, 0)) == at(2, 0, tuesday)
+    assert schedule.state_at(at(19, 0)) == (True, at(20, 0))
+
+
+def test_next_transition_skips_days_without_windows():
+    schedule = compile_schedule([window(17, 0, 20, 0, DAYS=[0])])
+    next_monday = MONDAY + datetime.timedelta(days=7)
+    assert schedule.next_transition(at(21, 0)) == at(17, 0, next_monday)
+
+
+# Khung nối liền qua nửa đêm mọi ngày không có mốc chuyển giả lúc 00:00
+def test_next_transition_none_when_state_never_changes():
+    assert compile_schedule([window(0, 0, 0, 0)]).next_transition(at(8, 0)) is None
+    always = compile_schedule([window(0, 0, 24, 0)])
+    assert always.is_active(at(0, 0))
+    assert always.next_transition(at(8, 0)) is None
+    overnight = compile_schedule([window(18, 0, 6, 0), window(6, 0, 18, 0)])
+    assert overnight.next_transition(at(8, 0)) is None
@@ -0,0 +1,20 @@
+import time
+
+import DONGHOLOAD
+
+
+# Quá MAX_PARALLEL_DEVICES inverter im lặng: inverter khỏe xếp hàng sau chúng vẫn được đọc
+def test_fan_out_waits_for_queued_devices(monkeypatch):
+    monkeypatch.setattr(DONGHOLOAD, "FAN_OUT_TIMEOUT", 0.3)
+    silent = [f"10.0.0.{i}" for i in range(DONGHOLOAD.MAX_PARALLEL_DEVICES)]
+    healthy = [f"10.0.1.{i}" for i in range(8)]
+
+    def read(ip):
+        if ip in silent:
+            time.sleep(0.5)
+            return None
+        return 1.0
+
+    results = DONGHOLOAD.fan_out(read, silent + healthy)
+    assert [results[ip] for ip in healthy] == [1.0] * len(healthy)
+    assert all(results[ip] is None for ip in silent)
@@ -0,0 +1,86 @@
+import math
+
+import numpy as np
+import pytest
+
+from forecaster import MAX_GAP, WEIGHT_LIMIT, RlsForecaster, SiteForecaster
+
+
+def test_first_sample_forecasts_itself():
+    model = RlsForecaster()
+    assert model.forecast(5) is None
+    assert model.update(12.0, 0) == 0
+    assert model.forecast(60) == 12.0
+
+
+def test_ramp_is_extrapolated():
+    model = RlsForecaster()
+    for k in range(200):
+        model.update(0.5 * k, 5)
+    assert model.w1 + model.w2 == pytest.approx(1.0, abs=1e-3)
+    assert model.forecast(5) == pytest.approx(100.0, abs=0.01)
+    assert model.forecast(15) == pytest.approx(101.0, abs=0.01)
+
+
+# Tín hiệu trơn (mây trôi): dự báo 1 chu kỳ tốt hơn giữ nguyên giá trị hiện tại
+def test_smooth_signal_beats_persistence():
+    model = RlsForecaster()
+    values = [10 + math.sin(k / 5) for k in range(400)]
+    forecast_errors = []
+    persistence_errors = []
+    for previous, value in zip(values, values[1:]):
+        if model.value is not None:
+            forecast_errors.append(abs(model.forecast(5) - value))
+            persistence_errors.append(abs(previous - value))
+        model.update(value, 5)
+    # Hệ số bị kẹp trong ±WEIGHT_LIMIT nên không khớp hẳn hình sin, chỉ cần tốt hơn rõ
+    assert np.mean(forecast_errors[-100:]) < 0.9 * np.mean(persistence_errors[-100:])
+
+
+def test_weights_stay_bounded_on_diverging_signal():
+    model = RlsForecaster()
+    for k in range(60):
+        model.update(2.0**k, 5)
+    assert abs(model.w1) <= WEIGHT_LIMIT and abs(model.w2) <= WEIGHT_LIMIT
+    assert math.isfinite(model.forecast(300))
+
+
+# Mất dữ liệu lâu hoặc thời gian lùi: bắt đầu chuỗi mới, giữ hệ số đã học
+@pytest.mark.parametrize("dt", [MAX_GAP + 1, 0, -5])
+def test_gap_restarts_sequence_keeps_weights(dt):
+    model = RlsForecaster()
+    for k in range(100):
+        model.update(0.5 * k, 5)
+    weights = (model.w1, model.w2)
+    assert model.update(7.0, dt) == 0
+    assert model.forecast(5) == 7.0
+    assert (model.w1, model.w2) == weights
+
+
+def test_array_models_match_scalar_models():
+    rng = np.random.default_rng(0)
+    series = np.cumsum(rng.normal(0, 1, (50, 3)), axis=0)
+    vector = RlsForecaster()
+    scalars = [RlsForecaster() for _ in range(3)]
+    for row in series:
+        errors = vector.update(row, 5)
+        for index, model in enumerate(scalars):
+            assert model.update(row[index], 5) == pytest.approx(errors[index])
+    np.testing.assert_allclose(
+        vector.forecast(30), [model.forecast(30) for model in scalars]
+    )
+
+
+def test_site_forecaster_tracks_error_and_clips_solar():
+    site = SiteForecaster("test")
+    assert site.forecast(5) is None
+    site.update(0, 20.0, 3.0)
+    assert site.mae == {"load": None, "solar": None}
+    for k in range(1, 40):
+        site.update(5 * k, 20.0 + k, max(3.0 - 0.5 * k, 0.0))
+    load, solar = site.forecast(60)
+    assert load == pytest.approx(20.0 + 39 + 12, abs=0.5)
+    assert solar == 0.0
+    stats = site.stats()
+    assert stats["load"]["mae"] < 1.0
+    assert set(stats) == {"load", "solar"}
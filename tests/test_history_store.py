@@ -0,0 +1,92 @@
+import datetime
+import math
+import os
+
+import numpy as np
+
+from history_store import HISTORY_FIELDS, HistoryStore
+
+DAY = datetime.datetime(2024, 6, 10).timestamp()
+
+
+def record(timestamp, grid=1.5, branch=3):
+    return (timestamp, grid, 20.0, -2.5, 55.0, 19.0, 1 << 40, math.nan, 80.0, branch)
+
+
+def fill(store, start, end, step=300):
+    for timestamp in np.arange(start, end, step):
+        store.append(*record(float(timestamp), grid=float(timestamp - DAY) / 3600))
+
+
+def test_round_trip_all_fields(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append(*record(DAY + 10))
+    rows = store.query(DAY, DAY + 60)
+    store.close()
+    assert rows.dtype.names == tuple(name for name, _ in HISTORY_FIELDS)
+    assert len(rows) == 1
+    row = rows[0]
+    assert row["timestamp"] == DAY + 10
+    assert row["grid_power"] == 1.5
+    assert row["bess_power"] == -2.5
+    assert row["fault_bits"] == 1 << 40
+    assert math.isnan(row["bess_setpoint"])
+    assert row["branch"] == 3
+
+
+# Truy vấn nửa mở [start, end) qua ranh giới segment giờ
+def test_query_spans_hourly_segments(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    fill(store, DAY, DAY + 3 * 3600)
+    segments = sorted(name for name in os.listdir(tmp_path) if name.startswith("seg"))
+    assert len(segments) == 3
+    rows = store.query(DAY + 3000, DAY + 7500)
+    store.close()
+    assert rows["timestamp"][0] == DAY + 3000
+    assert rows["timestamp"][-1] == DAY + 7200
+    assert len(rows) == 15
+    assert len(HistoryStore(str(tmp_path)).query(DAY, DAY + 86400)) == 36
+
+
+def test_partial_trailing_record_ignored(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append(*record(DAY))
+    store.append(*record(DAY + 5))
+    store.close()
+    (segment,) = os.listdir(tmp_path)
+    with open(tmp_path / segment, "ab") as file:
+        file.write(b"\x00" * 7)
+    assert len(HistoryStore(str(tmp_path)).query(DAY, DAY + 60)) == 2
+
+
+# Chờ lần gộp nền (nếu còn chạy) rồi gộp các ngày trước `before`: lần gộp nền bị bỏ qua
+# khi lần trước chưa xong, nên không chỉ dựa vào nó
+def compact_after_background(store, before):
+    if store._compacting is not None:
+        store._compacting.join()
+    store.compact(before)
+
+
+# Sang ngày mới: segment của ngày cũ gộp thành một file ngày, dữ liệu không đổi
+def test_compact_merges_previous_day(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    fill(store, DAY + 22 * 3600, DAY + 26 * 3600)
+    compact_after_background(store, DAY + 86400)
+    before = store.query(DAY, DAY + 2 * 86400)
+    names = sorted(os.listdir(tmp_path))
+    assert names[0] == "day-20240610.bin"
+    assert all(name.startswith("seg") for name in names[1:])
+    assert len(before) == 48
+    assert len(store.query(DAY, DAY + 86400)) == 24
+    store.close()
+    # Segment sót lại của ngày cũ được nối vào file ngày có sẵn
+    late = HistoryStore(str(tmp_path))
+    late.append(*record(DAY + 23.5 * 3600 + 1))
+    late.close()
+    compact_after_background(late, DAY + 86400)
+    reopened = HistoryStore(str(tmp_path))
+    assert sorted(os.listdir(tmp_path))[0] == "day-20240610.bin"
+    assert len(reopened.query(DAY, DAY + 86400)) == 25
+    next_day = reopened.query(DAY + 86400, DAY + 2 * 86400)
+    for name in ("timestamp", "grid_power", "fault_bits"):
+        np.testing.assert_array_equal(next_day[name], before[24:][name])
@@ -0,0 +1,212 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from modbus_pool import CircuitBreaker, DeadlineModbusTcpClient, ModbusConnectionPool
+
+HEADER_DELAY = 0.3  # Giây, thiết bị "trả lời chậm" gửi header sau khoảng này
+
+
+def make_breaker(**kwargs):
+    params = dict(backoff_base=0.5, backoff_max=4, probe_timeout=2)
+    params.update(kwargs)
+    return CircuitBreaker("test", **params)
+
+
+# Cổng TCP trên localhost không có ai nghe: kết nối bị từ chối ngay
+@pytest.fixture
+def closed_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+# Thiết bị "hố đen": nhận kết nối nhưng không bao giờ trả lời
+@pytest.fixture
+def silent_port():
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("127.0.0.1", 0))
+    server.listen(8)
+    accepted = []
+
+    def accept():
+        while True:
+            try:
+                accepted.append(server.accept()[0])
+            except OSError:
+                return
+
+    threading.Thread(target=accept, daemon=True).start()
+    yield server.getsockname()[1]
+    server.close()
+    for conn in accepted:
+        conn.close()
+
+
+# Thiết bị trả lời chậm: gửi header MBAP sau HEADER_DELAY rồi không gửi phần thân
+@pytest.fixture
+def stalling_port():
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("127.0.0.1", 0))
+    server.listen(8)
+
+    def serve(conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv(260)
+                    if not request:
+                        return
+                    time.sleep(HEADER_DELAY)
+                    conn.sendall(request[:2] + b"\x00\x00\x00\x07\x01\x03")
+                except OSError:
+                    return
+
+    def accept():
+        while True:
+            try:
+                conn = server.accept()[0]
+            except OSError:
+                return
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    yield server.getsockname()[1]
+    server.close()
+
+
+def test_breaker_starts_closed():
+    breaker = make_breaker()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow(now=0)
+    assert not breaker.is_open(now=0)
+
+
+def test_breaker_opens_after_failure_and_rejects_during_cooldown():
+    breaker = make_breaker()
+    assert breaker.record_failure(now=10) == 0.5
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.is_open(now=10.4)
+    assert not breaker.allow(now=10.4)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_breaker_failure_threshold():
+    breaker = make_breaker(failure_threshold=3)
+    assert breaker.record_failure(now=0) is None
+    assert breaker.record_failure(now=0) is None
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.record_failure(now=0) == 0.5
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_breaker_half_open_allows_one_probe():
+    breaker = make_breaker()
+    breaker.record_failure(now=0)
+    assert breaker.allow(now=0.5)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow(now=1.0)
+    # Request thử không báo kết quả sau probe_timeout: cho thử request khác
+    assert breaker.allow(now=2.6)
+
+
+def test_breaker_half_open_success_closes():
+    breaker = make_breaker()
+    breaker.record_failure(now=0)
+    breaker.allow(now=1)
+    assert breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.trips == 0
+    assert breaker.allow(now=1)
+    # Lần ngắt sau bắt đầu lại từ backoff_base
+    assert breaker.record_failure(now=2) == 0.5
+
+
+def test_breaker_half_open_failure_reopens_with_doubled_backoff():
+    breaker = make_breaker()
+    breaker.record_failure(now=0)
+    breaker.allow(now=0.5)
+    assert breaker.record_failure(now=0.5) == 1.0
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow(now=1.4)
+    assert breaker.allow(now=1.5)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_breaker_backoff_doubles_up_to_max():
+    breaker = make_breaker()
+    delays = []
+    now = 0.0
+    for _ in range(6):
+        delay = breaker.record_failure(now=now)
+        delays.append(delay)
+        now += delay
+        assert breaker.allow(now=now)
+    assert delays == [0.5, 1.0, 2.0, 4, 4, 4]
+
+
+def test_breaker_success_when_closed_is_noop():
+    breaker = make_breaker()
+    assert not breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_pool_trips_on_refused_connection(closed_port):
+    pool = ModbusConnectionPool(port=closed_port, timeout=0.5, backoff_base=30)
+    try:
+        assert pool.get("127.0.0.1") is None
+        breaker = pool.breaker("127.0.0.1")
+        assert breaker.state == CircuitBreaker.OPEN
+        # Trong thời gian nghỉ không mở kết nối nữa
+        started = time.monotonic()
+        assert pool.get("127.0.0.1") is None
+        assert time.monotonic() - started < 0.05
+    finally:
+        pool.close_all()
+
+
+def test_pool_ignores_missing_client():
+    pool = ModbusConnectionPool()
+    assert pool.allow(None)
+    pool.succeeded(None)
+    pool.failed(None)
+    pool.invalidate(None)
+
+
+def test_pool_failed_request_opens_breaker(silent_port):
+    pool = ModbusConnectionPool(port=silent_port, timeout=0.3)
+    try:
+        client = pool.get("127.0.0.1")
+        assert client is not None
+        assert pool.allow(client)
+        pool.failed(client)
+        assert pool.breaker("127.0.0.1").state == CircuitBreaker.OPEN
+        assert not pool.allow(client)
+        assert client.socket is None
+    finally:
+        pool.close_all()
+
+
+def test_deadline_client_bounds_whole_request(stalling_port):
+    timeout = 0.5
+    client = DeadlineModbusTcpClient("127.0.0.1", port=stalling_port, timeout=timeout)
+    try:
+        assert client.connect()
+        started = time.monotonic()
+        try:
+            result = client.read_holding_registers(0, 1, unit=1)
+        except Exception:
+            result = None
+        elapsed = time.monotonic() - started
+        assert result is None or result.isError()
+        # pymodbus chờ thêm tối đa timeout cho phần thân (~HEADER_DELAY + timeout);
+        # hạn chót dùng chung cho cả request
+        assert elapsed < timeout + 0.15
+    finally:
+        client.close()
@@ -0,0 +1,64 @@
+from read_planner import MAX_READ_COUNT, plan_reads
+
+
+def spans(plan):
+    return [(unit_id, start, count) for unit_id, start, count, *_ in plan]
+
+
+def test_close_points_share_one_read():
+    plan = plan_reads(
+        {
+            "power": (1, 100, "int16", 1),
+            "soc": (1, 103, "uint16", 1),
+            "energy": (1, 110, "uint32", 2),
+        }
+    )
+    assert spans(plan) == [(1, 100, 12)]
+    _, _, _, raw, names, decode = plan[0]
+    assert raw == []
+    assert names == ["power", "soc", "energy"]
+    registers = [0] * 12
+    registers[0], registers[3], registers[10:12] = 0xFFFF, 55, [1, 2]
+    assert decode(registers) == (-1, 55, 0x10002)
+
+
+def test_gap_larger_than_max_gap_splits_read():
+    points = {"a": (1, 0, "uint16", 1), "b": (1, 21, "uint16", 1)}
+    assert spans(plan_reads(points, max_gap=20)) == [(1, 0, 22)]
+    assert spans(plan_reads(points, max_gap=19)) == [(1, 0, 1), (1, 21, 1)]
+
+
+def test_units_are_never_merged():
+    plan = plan_reads({"a": (1, 0, "uint16", 1), "b": (2, 1, "uint16", 1)})
+    assert spans(plan) == [(1, 0, 1), (2, 1, 1)]
+
+
+def test_span_respects_max_count():
+    points = {f"p{i}": (1, i * 50, "uint16", 1) for i in range(4)}
+    plan = plan_reads(points, max_gap=60)
+    assert spans(plan) == [(1, 0, 101), (1, 150, 1)]
+    assert all(count <= MAX_READ_COUNT for _, _, count in spans(plan))
+
+
+def test_adjacent_points_merge_in_address_order():
+    plan = plan_reads(
+        {"word": (1, 12, "uint16", 1), "pair": (1, 10, "uint32", 2)},
+        max_gap=0,
+    )
+    assert spans(plan) == [(1, 10, 3)]
+    assert plan[0][4] == ["pair", "word"]
+    assert plan[0][5]([0, 7, 9]) == (7, 9)
+
+
+def test_raw_points_and_scale():
+    plan = plan_reads(
+        {
+            "faults": (1, 0, "raw", 3),
+            "power": (1, 3, "int16", 1, lambda value: value / 10),
+        }
+    )
+    _, _, count, raw, names, decode = plan[0]
+    assert count == 4
+    assert raw == [("faults", 0, 3)]
+    assert names == ["power"]
+    assert decode([1, 2, 3, 125]) == (12.5,)
@@ -0,0 +1,124 @@
+import itertools
+import random
+
+import pytest
+from pymodbus.constants import Endian
+from pymodbus.payload import BinaryPayloadBuilder, BinaryPayloadDecoder
+
+from bess_control import value_decode
+from register_codec import RegisterCodec, get_codec
+
+ORDERS = list(itertools.product((Endian.Big, Endian.Little), repeat=2))
+
+# Kiểu -> (hàm ghi của BinaryPayloadBuilder, hàm đọc của BinaryPayloadDecoder, giá trị)
+PYMODBUS_TYPES = {
+    "int16": ("add_16bit_int", "decode_16bit_int", (-32768, -1, 0, 1234, 32767)),
+    "uint16": ("add_16bit_uint", "decode_16bit_uint", (0, 1, 0xABCD, 0xFFFF)),
+    "int32": ("add_32bit_int", "decode_32bit_int", (-(2**31), -5, 0, 2**31 - 1)),
+    "uint32": ("add_32bit_uint", "decode_32bit_uint", (0, 0x12345678, 2**32 - 1)),
+    "float16": ("add_16bit_float", "decode_16bit_float", (-2.5, 0.0, 1.0, 65504.0)),
+    "float32": ("add_32bit_float", "decode_32bit_float", (-1.5, 0.0, 3.25, 1e10)),
+}
+
+
+def pymodbus_registers(type, value, byteorder, wordorder):
+    builder = BinaryPayloadBuilder(byteorder=byteorder, wordorder=wordorder)
+    getattr(builder, PYMODBUS_TYPES[type][0])(value)
+    return builder.to_registers()
+
+
+def pymodbus_decode(type, registers, byteorder, wordorder):
+    decoder = BinaryPayloadDecoder.fromRegisters(
+        registers, byteorder=byteorder, wordorder=wordorder
+    )
+    return getattr(decoder, PYMODBUS_TYPES[type][1])()
+
+
+@pytest.mark.parametrize("byteorder,wordorder", ORDERS)
+@pytest.mark.parametrize("type", PYMODBUS_TYPES)
+def test_single_value_matches_pymodbus(type, byteorder, wordorder):
+    codec = get_codec(type, None, byteorder, wordorder)
+    for value in PYMODBUS_TYPES[type][2]:
+        registers = pymodbus_registers(type, value, byteorder, wordorder)
+        assert codec.encode(value) == registers
+        assert codec.decode(registers) == (value,)
+        assert pymodbus_decode(type, codec.encode(value), byteorder, wordorder) == value
+
+
+@pytest.mark.parametrize("byteorder,wordorder", ORDERS)
+def test_block_with_gaps_matches_pymodbus(byteorder, wordorder):
+    fields = [(0, "int16", 1), (2, "uint32", 2), (5, "float32", 2), (9, "uint16", 1)]
+    codec = RegisterCodec(fields, 12, byteorder, wordorder)
+    rng = random.Random(0)
+    for _ in range(50):
+        values = (
+            rng.randint(-32768, 32767),
+            rng.randint(0, 2**32 - 1),
+            rng.choice((0.5, -1.25, 1024.0)),
+            rng.randint(0, 0xFFFF),
+        )
+        registers = [0] * 12
+        for (offset, type, size), value in zip(fields, values):
+            registers[offset : offset + size] = pymodbus_registers(
+                type, value, byteorder, wordorder
+            )
+        assert codec.encode(*values) == registers
+        assert codec.decode(registers) == values
+
+
+# "string": size là số byte như decode_string của pymodbus, số lẻ byte vẫn chiếm
+# trọn thanh ghi cuối
+@pytest.mark.parametrize("length", [1, 2, 3, 4, 7, 8])
+def test_string_matches_pymodbus(length):
+    text = "ABCDEFGH"[:length]
+    builder = BinaryPayloadBuilder(byteorder=Endian.Big, wordorder=Endian.Big)
+    builder.add_string(text)
+    registers = builder.to_registers()
+    codec = get_codec("string", length)
+    assert codec.count == (length + 1) // 2
+    assert codec.encode(text) == registers
+    assert codec.decode(registers) == (text,)
+    decoder = BinaryPayloadDecoder.fromRegisters(registers, byteorder=Endian.Big)
+    assert decoder.decode_string(length).decode() == text
+
+
+def test_string_field_inside_block():
+    codec = RegisterCodec([(0, "uint16", 1), (1, "string", 3), (3, "int16", 1)])
+    assert codec.count == 4
+    assert codec.decode([1, 0x4142, 0x4300, 0xFFFF]) == (1, "ABC", -1)
+    assert codec.encode(1, "ABC", -1) == [1, 0x4142, 0x4300, 0xFFFF]
+
+
+def test_wider_block_ignores_trailing_registers():
+    codec = get_codec("int16", 2)
+    assert codec.count == 2
+    assert codec.decode([0xFFFE, 0x1234]) == (-2,)
+    assert codec.encode(-2) == [0xFFFE, 0]
+
+
+def test_overlapping_fields_rejected():
+    with pytest.raises(ValueError):
+        RegisterCodec([(0, "int32", 2), (1, "int16", 1)])
+
+
+def test_unsupported_type_rejected():
+    with pytest.raises(ValueError):
+        RegisterCodec([(0, "int64", 4)])
+
+
+def test_block_too_short_rejected():
+    with pytest.raises(ValueError):
+        RegisterCodec([(0, "uint32", 2)], 1)
+
+
+def test_get_codec_is_cached_per_layout():
+    assert get_codec("uint32") is get_codec("uint32")
+    assert get_codec("uint32") is not get_codec("uint32", None, Endian.Little)
+    assert get_codec("uint32", 4).count == 4
+
+
+# value_decode của bess_control: giữ giao diện cũ (danh sách thanh ghi dài hơn, kiểu sai)
+def test_value_decode_keeps_baseline_interface():
+    assert value_decode([0xFFFF, 0xFFFE, 7], "int32", 2) == -2
+    assert value_decode([0x4142, 0x4300], "string", 3) == "ABC"
+    assert value_decode([1], "int64", 4) == "Invalid type"
@@ -0,0 +1,92 @@
+import pytest
+
+import scheduler
+from scheduler import CycleScheduler
+
+WALL_OFFSET = 1_700_000_000.0
+
+
+# Đồng hồ giả: sleep() chỉ tăng thời gian, step() tự cộng thời gian chạy của nó
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now + WALL_OFFSET
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler, "time", clock)
+    return clock
+
+
+def run_steps(cycle, clock, durations):
+    started = []
+
+    def step():
+        started.append(clock.now)
+        clock.now += durations[len(started) - 1]
+        if len(started) == len(durations):
+            cycle.stop()
+
+    cycle.run(step)
+    return started
+
+
+def test_invalid_period_rejected():
+    with pytest.raises(ValueError):
+        CycleScheduler(0)
+
+
+def test_cycles_follow_deadlines_without_drift(clock):
+    cycle = CycleScheduler(5, report_every=0)
+    started = run_steps(cycle, clock, [0.3, 1.2, 0.0, 4.9])
+    assert started == [0, 5, 10, 15]
+    assert cycle.stats["cycles"] == 4
+    assert cycle.stats["overruns"] == 0
+    assert cycle.stats["max_duration"] == pytest.approx(4.9)
+
+
+# Chu kỳ 10 s chạy 12.5 s: các deadline 15 và 20 bị bỏ qua, chạy tiếp tại 25
+def test_overrun_skips_missed_deadlines(clock):
+    cycle = CycleScheduler(5, report_every=0)
+    started = run_steps(cycle, clock, [0.1, 0.1, 12.5, 0.1])
+    assert started == [0, 5, 10, 25]
+    assert cycle.stats["overruns"] == 1
+    assert cycle.stats["skipped"] == 2
+    assert cycle.stats["max_duration"] == 12.5
+    assert cycle.stats["last_jitter"] == 0
+
+
+def test_overrun_by_exactly_one_period(clock):
+    cycle = CycleScheduler(5, report_every=0)
+    started = run_steps(cycle, clock, [5.0, 0.1])
+    assert started == [0, 5]
+    assert cycle.stats["overruns"] == 0
+    started = run_steps(cycle, clock, [5.5, 0.1])
+    assert started[1] - started[0] == 10
+    assert cycle.stats["skipped"] == 1
+
+
+# Mốc đánh thức (vd. bắt đầu khung xả) chạy thêm step() mà không dời lịch deadline
+def test_wakeup_runs_extra_step_before_deadline(clock):
+    cycle = CycleScheduler(5, report_every=0, next_wakeup=lambda: WALL_OFFSET + 7.0)
+    started = run_steps(cycle, clock, [0.1, 0.1, 0.1, 0.1])
+    assert started == pytest.approx([0, 5, 7, 10])
+    assert cycle.stats["wakeups"] == 1
+    assert cycle.stats["cycles"] == 3
+
+
+def test_report_runs_reporters(clock):
+    reports = []
+    cycle = CycleScheduler(5, report_every=2, reporters=[lambda: reports.append(1)])
+    run_steps(cycle, clock, [0.1] * 5)
+    assert len(reports) == 2
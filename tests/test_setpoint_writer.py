@@ -0,0 +1,115 @@
+from types import SimpleNamespace
+
+import pytest
+
+import setpoint_writer
+from setpoint_writer import SetpointWriter
+
+POWER = 106
+LIMIT = 101
+
+
+class FakeDevice:
+    def __init__(self):
+        self.writes = []
+        self.fail = False
+
+    def __call__(self, client, register, value, **kwargs):
+        self.writes.append((client.host, register, value, kwargs.get("unit_id")))
+        return not self.fail
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(
+        setpoint_writer, "time", SimpleNamespace(monotonic=lambda: clock.now)
+    )
+    return clock
+
+
+def client(host="10.0.0.1"):
+    return SimpleNamespace(host=host, port=502)
+
+
+def make_writer(device, **kwargs):
+    params = dict(deadband={POWER: 2}, min_interval={POWER: 10}, refresh_interval=300)
+    params.update(kwargs)
+    return SetpointWriter(device, **params)
+
+
+def test_duplicate_value_not_rewritten(clock):
+    device = FakeDevice()
+    writer = make_writer(device)
+    assert writer.write(client(), LIMIT, 50, unit_id=3)
+    clock.now += 1
+    assert writer.write(client(), LIMIT, 50, unit_id=3)
+    assert device.writes == [("10.0.0.1", LIMIT, 50, 3)]
+    assert writer.stats["duplicate"] == 1
+    # Thiết bị / unit khác giữ giá trị riêng
+    writer.write(client("10.0.0.2"), LIMIT, 50, unit_id=3)
+    writer.write(client(), LIMIT, 50, unit_id=4)
+    assert len(device.writes) == 3
+
+
+def test_deadband_suppresses_small_changes_but_not_zero(clock):
+    device = FakeDevice()
+    writer = make_writer(device, min_interval={})
+    writer.write(client(), POWER, 1, unit_id=1)
+    for value in (3, -1, 2):
+        clock.now += 20
+        writer.write(client(), POWER, value, unit_id=1)
+    assert [value for *_, value, _ in device.writes] == [1]
+    assert writer.stats["deadband"] == 3
+    writer.write(client(), POWER, 0, unit_id=1)
+    writer.write(client(), POWER, 4, unit_id=1)
+    assert [value for *_, value, _ in device.writes] == [1, 0, 4]
+    assert writer.requested[POWER] == 4
+
+
+def test_min_interval_rate_limits_register(clock):
+    device = FakeDevice()
+    writer = make_writer(device)
+    writer.write(client(), POWER, 10, unit_id=1)
+    clock.now += 5
+    writer.write(client(), POWER, 20, unit_id=1)
+    assert writer.stats["rate_limited"] == 1
+    clock.now += 5
+    writer.write(client(), POWER, 20, unit_id=1)
+    assert [value for *_, value, _ in device.writes] == [10, 20]
+    # Thanh ghi không có min_interval không bị giới hạn
+    writer.write(client(), LIMIT, 1, unit_id=1)
+    writer.write(client(), LIMIT, 2, unit_id=1)
+    assert writer.stats["rate_limited"] == 1
+
+
+def test_refresh_interval_rewrites_same_value(clock):
+    device = FakeDevice()
+    writer = make_writer(device)
+    writer.write(client(), LIMIT, 50, unit_id=3)
+    clock.now += 299
+    writer.write(client(), LIMIT, 50, unit_id=3)
+    clock.now += 1
+    writer.write(client(), LIMIT, 50, unit_id=3)
+    assert len(device.writes) == 2
+
+
+def test_failed_write_is_retried(clock):
+    device = FakeDevice()
+    writer = make_writer(device)
+    device.fail = True
+    assert not writer.write(client(), LIMIT, 50, unit_id=3)
+    device.fail = False
+    assert writer.write(client(), LIMIT, 50, unit_id=3)
+    assert len(device.writes) == 2
+    assert writer.stats["failed"] == 1
+    assert writer.stats["written"] == 1
+
+
+def test_missing_client_passes_through(clock):
+    calls = []
+    writer = make_writer(lambda *args, **kwargs: calls.append(args) or False)
+    assert not writer.write(None, LIMIT, 50)
+    assert not writer.write(None, LIMIT, 50)
+    assert len(calls) == 2
+    assert writer.stats["written"] == writer.stats["failed"] == 0
@@ -0,0 +1,89 @@
+import json
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from telemetry_buffer import TELEMETRY_FIELDS
+from telemetry_publisher import TelemetryPublisher, decode_batch, encode_batch
+
+
+def samples(count, seed=0):
+    rng = random.Random(seed)
+    timestamp = 1_718_000_000.0
+    result = []
+    for _ in range(count):
+        timestamp += 5 + rng.choice((0, 0.001, -0.002))
+        result.append(
+            (timestamp,)
+            + tuple(round(rng.uniform(-150, 150), 2) for _ in TELEMETRY_FIELDS)
+        )
+    return result
+
+
+def test_round_trip_within_resolution():
+    batch = samples(50)
+    decoded = decode_batch(encode_batch(batch))
+    assert len(decoded) == len(batch)
+    for original, restored in zip(batch, decoded):
+        assert restored[0] == pytest.approx(original[0], abs=5e-4)
+        assert restored[1:] == pytest.approx(original[1:], abs=5e-3)
+
+
+def test_deltas_are_small_integers():
+    batch = [(100.0, 1.0, 2.0, 0.0, 50.0, 3.0), (105.0, 1.25, 2.0, 0.0, 50.5, 3.25)]
+    payload = json.loads(encode_batch(batch))
+    assert payload["fields"] == list(TELEMETRY_FIELDS)
+    assert payload["scale"] == 100
+    assert payload["t"] == [100000, 5000]
+    assert payload["v"][0] == [100, 25]
+    assert payload["v"][3] == [5000, 50]
+    assert decode_batch(encode_batch([])) == []
+
+
+def test_custom_fields_and_scale():
+    payload = encode_batch([(1.0, 0.123), (2.0, 0.125)], fields=("soc",), scale=1000)
+    assert json.loads(payload)["v"] == [[123, 2]]
+    assert decode_batch(payload) == [(1.0, 0.123), (2.0, 0.125)]
+
+
+class FakeClient:
+    def __init__(self):
+        self.sent = []
+        self.rc = 0
+
+    def publish(self, topic, payload, qos=0):
+        if self.rc == 0:
+            self.sent.append((topic, payload, qos))
+        return SimpleNamespace(rc=self.rc)
+
+
+# Không gắn client: lô đầy vào hàng đợi tồn đọng có giới hạn, bỏ lô cũ nhất
+def test_backlog_bounded_without_client():
+    publisher = TelemetryPublisher(batch_size=2, backlog=3)
+    for sample in samples(10):
+        publisher.add(*sample)
+    assert publisher.stats["dropped"] == 2
+    client = FakeClient()
+    publisher.client = client
+    publisher.topic = "telemetry"
+    publisher.flush()
+    assert [decode_batch(payload)[0][0] for _, payload, _ in client.sent] == [
+        pytest.approx(sample[0], abs=5e-4) for sample in samples(10)[4::2]
+    ]
+
+
+def test_flush_keeps_backlog_until_broker_accepts():
+    publisher = TelemetryPublisher(topic="telemetry", batch_size=100)
+    client = FakeClient()
+    publisher.client = client
+    for sample in samples(3):
+        publisher.add(*sample)
+    client.rc = 4
+    publisher.flush()
+    assert client.sent == []
+    client.rc = 0
+    publisher.flush()
+    assert len(client.sent) == 1
+    assert len(decode_batch(client.sent[0][1])) == 3
+    assert publisher.stats == {"samples": 3, "published": 1, "dropped": 0}
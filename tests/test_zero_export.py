@@ -0,0 +1,178 @@
+import numpy as np
+import pytest
+
+from zero_export import (
+    BRANCH_CODES,
+    DEFAULT_PARAMS,
+    PV_CURTAIL,
+    PV_FOLLOW,
+    PV_LIMIT_MODES,
+    PV_MAX,
+    SETPOINT_COMMAND,
+    SETPOINT_DISCHARGE,
+    SETPOINT_MODES,
+    SETPOINT_ZERO,
+    bess_setpoint,
+    choose_branch,
+    choose_branches,
+    inverter_action,
+    inverter_actions,
+    pv_limit_setpoint,
+)
+
+# Các giá trị sát ngưỡng của cây quyết định (kW, %) để mẫu ngẫu nhiên rơi vào mọi nhánh
+GRID_VALUES = (-5.0, -0.2, -0.1, -0.05, 0.0, 0.1, 0.2, 0.3, 5.0)
+BESS_VALUES = (-3.0, -0.05, -0.01, 0.0, 0.1, 0.3, 0.31, 3.0)
+SOC_VALUES = (0.0, 9.9, 10.0, 10.1, 50.0, 99.9, 100.0)
+SOLAR_VALUES = (0.0, 0.001, 0.005, 3.0, 5.0, 5.1, 10.0, 10.1, 80.0)
+
+
+def random_samples(size, seed):
+    rng = np.random.default_rng(seed)
+
+    def pick(values):
+        exact = rng.choice(values, size)
+        jitter = rng.uniform(-1, 1, size) * (rng.random(size) < 0.3)
+        return exact + jitter
+
+    return (
+        pick(GRID_VALUES),
+        pick(BESS_VALUES),
+        np.clip(pick(SOC_VALUES), 0, 100),
+        np.maximum(pick(SOLAR_VALUES), 0),
+        rng.random(size) < 0.5,
+        rng.random(size) < 0.2,
+    )
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_vectorized_branches_match_scalar(seed):
+    grid, bess, soc, solar, within_timer, faults = random_samples(2000, seed)
+    codes = np.empty(len(grid), dtype=np.uint8)
+    for index in range(len(grid)):
+        branch = choose_branch(
+            grid[index],
+            bess[index],
+            soc[index],
+            solar[index],
+            bool(within_timer[index]),
+            bool(faults[index]),
+        )
+        codes[index] = BRANCH_CODES[branch]
+    # Bản vector hóa nhận within_timer / bess_faults là số (replay.py) hoặc mảng
+    for index in (0, 1):
+        mask = within_timer == bool(index)
+        vectorized = choose_branches(
+            grid[mask], bess[mask], soc[mask], solar[mask], bool(index), faults[mask]
+        )
+        np.testing.assert_array_equal(vectorized, codes[mask])
+    assert len(set(codes)) >= 12
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_vectorized_branches_match_scalar_per_param_set(seed):
+    rng = np.random.default_rng(seed)
+    grid, bess, soc, solar, _, _ = random_samples(500, seed)
+    params = dict(
+        DEFAULT_PARAMS,
+        soc_min=rng.choice([5.0, 10.0, 20.0], len(grid)),
+        band_high=rng.choice([0.2, 0.5, 1.0], len(grid)),
+    )
+    vectorized = choose_branches(grid, bess, soc, solar, False, False, params)
+    for index in range(len(grid)):
+        scalar_params = dict(
+            DEFAULT_PARAMS,
+            soc_min=params["soc_min"][index],
+            band_high=params["band_high"][index],
+        )
+        branch = choose_branch(
+            grid[index],
+            bess[index],
+            soc[index],
+            solar[index],
+            False,
+            False,
+            scalar_params,
+        )
+        assert vectorized[index] == BRANCH_CODES[branch]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_vectorized_inverter_actions_match_scalar(seed):
+    _, _, soc, solar, within_timer, enabled = random_samples(2000, seed)
+    turn_off, turn_on = inverter_actions(within_timer, solar, soc, enabled)
+    for index in range(len(soc)):
+        action = inverter_action(
+            bool(within_timer[index]), solar[index], soc[index], bool(enabled[index])
+        )
+        assert turn_off[index] == (action == "inverter_off")
+        assert turn_on[index] == (action == "inverter_on")
+
+
+# Các trường hợp ghim theo cây quyết định gốc (bess_control.py bản đầu, số đo thô đổi
+# sang kW: BESS 0.1 kW/đơn vị, solar / lưới W -> kW)
+# (lưới, BESS, SOC, solar, trong giờ xả, lỗi BESS) -> nhánh
+BASELINE_CASES = [
+    ((0.1, 0.0, 50, 20, False, False), "stable"),
+    ((0.0, 0.0, 50, 20, True, False), "stable"),
+    ((-0.1, 0.0, 50, 20, False, False), "charge_increase"),
+    ((2.0, 0.0, 50, 5, True, False), "discharge_increase"),
+    ((2.0, -1.0, 50, 20, False, False), "charge_decrease"),
+    ((2.0, 0.0, 100, 20, False, False), "bess_full_raise_pv"),
+    ((2.0, 0.0, 50, 20, True, False), "discharge_start"),
+    ((2.0, 0.0, 10, 5, True, False), "discharge_start"),
+    ((2.0, 0.0, 50, 20, False, False), "pv_max"),
+    ((2.0, -1.0, 50, 20, False, True), "pv_increase"),
+    ((-2.0, 1.0, 50, 20, False, False), "standby"),
+    ((-2.0, 0.0, 50, 3, False, False), "none"),
+    ((-2.0, 0.0, 100, 10, False, False), "pv_curtail"),
+    ((-2.0, 0.0, 50, 10, True, True), "pv_curtail"),
+    ((-2.0, 2.0, 50, 0, True, False), "discharge_decrease"),
+    ((-2.0, 2.0, 5, 0, True, False), "no_action"),
+]
+
+
+@pytest.mark.parametrize("inputs,branch", BASELINE_CASES)
+def test_baseline_decision_tree(inputs, branch):
+    assert choose_branch(*inputs) == branch
+    codes = choose_branches(*(np.atleast_1d(value) for value in inputs))
+    assert codes.tolist() == [BRANCH_CODES[branch]]
+
+
+# (trong giờ xả, solar kW, SOC, inverter đang bật) -> hành động
+BASELINE_INVERTER_CASES = [
+    ((True, 0.5, 50, True), "inverter_off"),
+    ((True, 0.0, 50, True), None),
+    ((False, 0.004, 50, False), "inverter_on"),
+    ((False, 0.005, 50, False), None),
+    ((True, 20, 10, False), "inverter_on"),
+    ((False, 20, 50, True), None),
+    # Thiếu số đo solar: không tắt PV, vẫn bật lại PV khi SOC chạm ngưỡng
+    ((True, None, 50, True), None),
+    ((False, None, 50, False), None),
+    ((True, None, 10, False), "inverter_on"),
+]
+
+
+@pytest.mark.parametrize("inputs,action", BASELINE_INVERTER_CASES)
+def test_baseline_inverter_action(inputs, action):
+    assert inverter_action(*inputs) == action
+
+
+def test_setpoint_tables_follow_decide():
+    assert SETPOINT_MODES["discharge_increase"] == SETPOINT_DISCHARGE
+    assert SETPOINT_MODES["charge_increase"] == SETPOINT_COMMAND
+    assert SETPOINT_MODES["standby"] == SETPOINT_ZERO
+    assert PV_LIMIT_MODES["pv_max"] == PV_MAX
+    assert bess_setpoint(SETPOINT_COMMAND, -4.0, 0.9) == pytest.approx(-3.6)
+    assert bess_setpoint(SETPOINT_DISCHARGE, -4.0, 0.9) == pytest.approx(3.6)
+    assert bess_setpoint(SETPOINT_ZERO, -4.0, 0.9) == 0
+    assert pv_limit_setpoint(PV_FOLLOW, 3.0, 50.0, 125) == 53.0
+    assert pv_limit_setpoint(PV_FOLLOW, 100.0, 50.0, 125) == 125
+    assert pv_limit_setpoint(PV_MAX, 3.0, 50.0, 125) == 125
+    assert pv_limit_setpoint(PV_CURTAIL, -60.0, 50.0, 125) == 10.0
+    command = np.array([-4.0, 2.0])
+    np.testing.assert_allclose(
+        bess_setpoint(np.array([SETPOINT_COMMAND, SETPOINT_DISCHARGE]), command, 1.0),
+        [-4.0, 2.0],
+    )
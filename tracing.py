@@ -0,0 +1,176 @@
+from collections import deque
+import json
+import os
+import random
+import threading
+import time
+
+# 🔍 Span theo từng giai đoạn của chu kỳ điều khiển (connect, read.bess, read.meter,
+# decide, write, history), lưu trong bộ đệm vòng có giới hạn trong bộ nhớ
+# - Mỗi chu kỳ được lấy mẫu với xác suất sample_rate; chu kỳ không được lấy mẫu chỉ tốn
+#   một phép so sánh mỗi span (span() trả về đối tượng rỗng dùng chung)
+# - Span mở trên thread khác trong lúc chu kỳ đang chạy (vd. AsyncPoller) được gắn dưới
+#   span gốc của chu kỳ
+# - Xuất: chrome_trace() -> JSON mở bằng chrome://tracing hoặc ui.perfetto.dev,
+#         folded_stacks() -> "cycle;decide;write 1234" cho flamegraph.pl / speedscope
+#
+# with tracer.cycle():
+#     with tracer.span("read.bess"):
+#         ...
+
+TRACE_CAPACITY = 20000  # Số span tối đa giữ lại, đầy thì bỏ span cũ nhất
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "path", "start", "children")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        tracer = self.tracer
+        stack = tracer._stack()
+        parent = stack[-1].path if stack else tracer._root_path
+        self.path = parent + (self.name,)
+        self.children = 0
+        stack.append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter_ns() - self.start
+        stack = self.tracer._stack()
+        stack.pop()
+        if stack:
+            stack[-1].children += duration
+        if exc_type is not None:
+            self.args = dict(self.args, error=exc_type.__name__)
+        thread = threading.current_thread()
+        # (đường dẫn span, thread, tên thread, bắt đầu ns, thời lượng ns, thời gian riêng ns, args)
+        self.tracer.spans.append(
+            (
+                self.path,
+                thread.ident,
+                thread.name,
+                self.start,
+                duration,
+                duration - self.children,
+                self.args,
+            )
+        )
+        return False
+
+
+class _CycleSpan(_Span):
+    __slots__ = ()
+
+    def __enter__(self):
+        span = super().__enter__()
+        self.tracer._root_path = self.path
+        return span
+
+    def __exit__(self, *exc_info):
+        tracer = self.tracer
+        tracer.active = False
+        tracer._root_path = ()
+        return super().__exit__(*exc_info)
+
+
+class Tracer:
+    def __init__(self, name="", sample_rate=0.0, capacity=TRACE_CAPACITY):
+        self.name = name
+        self.sample_rate = sample_rate
+        self.spans = deque(maxlen=capacity)
+        self.active = False  # Chu kỳ hiện tại có được lấy mẫu không
+        self._root_path = ()
+        self._local = threading.local()
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    # Span gốc của một chu kỳ, quyết định lấy mẫu cho cả chu kỳ
+    def cycle(self, name="cycle", **args):
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return _NOOP_SPAN
+        self.active = True
+        return _CycleSpan(self, name, args)
+
+    def span(self, name, **args):
+        if not self.active:
+            return _NOOP_SPAN
+        return _Span(self, name, args)
+
+    def clear(self):
+        self.spans.clear()
+
+
+# 📤 Chrome trace (định dạng JSON Trace Event), mỗi tracer (site) là một process
+def chrome_trace(tracers):
+    events = []
+    for pid, tracer in enumerate(tracers, 1):
+        events.append(
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": pid,
+                "args": {"name": tracer.name or f"pid {os.getpid()}"},
+            }
+        )
+        thread_names = {}
+        for path, tid, thread_name, start, duration, _, args in list(tracer.spans):
+            thread_names[tid] = thread_name
+            events.append(
+                {
+                    "name": path[-1],
+                    "cat": path[0],
+                    "ph": "X",
+                    "ts": start / 1000,
+                    "dur": duration / 1000,
+                    "pid": pid,
+                    "tid": tid,
+                    "args": args,
+                }
+            )
+        for tid, thread_name in thread_names.items():
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"name": thread_name},
+                }
+            )
+    return json.dumps({"traceEvents": events, "displayTimeUnit": "ms"})
+
+
+# 🔥 Folded stacks: mỗi dòng "tracer;span;span con <thời gian riêng µs>"
+def folded_stacks(tracers):
+    totals = {}
+    for tracer in tracers:
+        prefix = (tracer.name,) if tracer.name else ()
+        for path, _, _, _, _, self_time, _ in list(tracer.spans):
+            key = ";".join(prefix + path)
+            totals[key] = totals.get(key, 0) + self_time
+    return "".join(
+        f"{stack} {round(total / 1000)}\n" for stack, total in sorted(totals.items())
+    )
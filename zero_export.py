@@ -0,0 +1,338 @@
+import functools
+
+import numpy as np
+
+# 🧭 Cây quyết định zero-export dạng hàm thuần: chỉ nhận số đo và tham số, trả về tên
+# nhánh, không đọc/ghi Modbus, không log; bess_control.decide() thực hiện lệnh theo nhánh,
+# replay.py chạy cùng logic (bản vector hóa choose_branches) trên dữ liệu đã ghi
+# Mọi công suất theo kW (+ là nhập lưới / BESS xả), SOC theo %
+
+# Các nhánh quyết định, mã lưu vào lịch sử là vị trí trong tuple (0: không có)
+DECISION_BRANCHES = (
+    "none",
+    "inverter_off",
+    "inverter_on",
+    "data_management_offline",
+    "missing_data",
+    "stable",
+    "discharge_increase",
+    "charge_decrease",
+    "bess_full_raise_pv",
+    "discharge_start",
+    "pv_max",
+    "pv_increase",
+    "standby",
+    "charge_increase",
+    "pv_curtail",
+    "discharge_decrease",
+    "no_action",
+)
+BRANCH_CODES = {branch: code for code, branch in enumerate(DECISION_BRANCHES)}
+
+# Tham số có thể chỉnh của cây quyết định
+DEFAULT_PARAMS = {
+    "pcs_gain": 1.0,  # Hệ số nhân lệnh công suất BESS
+    "soc_min": 10,  # % - dưới mức này không xả, bật lại inverter
+    "soc_full": 100,  # % - từ mức này coi BESS đã đầy
+    "band_low": -0.1,  # kW - dải ổn định của công suất lưới, không ra lệnh
+    "band_high": 0.2,
+}
+
+DISCHARGE_SOLAR_MAX = 10  # kW - trong giờ xả chỉ tăng xả khi solar không quá mức này
+CHARGE_SOLAR_MIN = 5  # kW - solar tối thiểu để sạc BESS
+# kW - ngoài giờ xả chỉ bật lại inverter khi solar dưới mức này (5 W: ngưỡng gốc so
+# sánh trên số đọc theo W, trước khi đổi sang kW)
+INVERTER_ENABLE_SOLAR_MAX = 0.005
+BESS_CHARGING = -0.05  # kW - BESS đang sạc khi công suất dưới mức này
+BESS_DISCHARGING = 0.3  # kW - BESS đang xả khi công suất trên mức này
+
+# Các nhánh gọi bộ điều khiển công suất BESS (tích phân chỉ chạy trong các nhánh này)
+CONTROLLED_BRANCHES = frozenset(
+    (
+        "discharge_increase",
+        "charge_decrease",
+        "discharge_start",
+        "charge_increase",
+        "discharge_decrease",
+    )
+)
+
+# ✍️ Lệnh mà mỗi nhánh ghi, dùng chung cho bess_control.decide() và replay.py
+# charge_power: SETPOINT_HOLD giữ lệnh cũ, SETPOINT_COMMAND lệnh bộ điều khiển,
+#   SETPOINT_DISCHARGE |lệnh|, SETPOINT_ZERO về 0
+# pv_limit: PV_HOLD giữ giới hạn cũ, PV_FOLLOW min(lưới + solar, pv_max), PV_MAX pv_max
+#   (kèm pv_limit_percent 100), PV_CURTAIL |solar + lưới|
+SETPOINT_HOLD, SETPOINT_COMMAND, SETPOINT_DISCHARGE, SETPOINT_ZERO = range(4)
+PV_HOLD, PV_FOLLOW, PV_MAX, PV_CURTAIL = range(4)
+SETPOINT_MODES = {
+    "discharge_increase": SETPOINT_DISCHARGE,
+    "charge_decrease": SETPOINT_COMMAND,
+    "bess_full_raise_pv": SETPOINT_ZERO,
+    "discharge_start": SETPOINT_COMMAND,
+    "standby": SETPOINT_ZERO,
+    "charge_increase": SETPOINT_COMMAND,
+    "discharge_decrease": SETPOINT_DISCHARGE,
+}
+PV_LIMIT_MODES = {
+    "bess_full_raise_pv": PV_FOLLOW,
+    "pv_max": PV_MAX,
+    "pv_increase": PV_FOLLOW,
+    "pv_curtail": PV_CURTAIL,
+}
+
+
+# Giá trị mới của charge_power (kW, đã nhân pcs_gain) theo chế độ của nhánh, bỏ qua
+# SETPOINT_HOLD (người gọi giữ lệnh cũ); chạy được trên số hoặc mảng NumPy
+def bess_setpoint(mode, command, pcs_gain):
+    return pcs_gain * (
+        command * (mode == SETPOINT_COMMAND)
+        + abs(command) * (mode == SETPOINT_DISCHARGE)
+    )
+
+
+# Giá trị mới của pv_limit (kW) theo chế độ của nhánh, bỏ qua PV_HOLD
+def pv_limit_setpoint(mode, grid_power, solar_power, pv_max):
+    net = grid_power + solar_power
+    return (
+        np.minimum(net, pv_max) * (mode == PV_FOLLOW)
+        + pv_max * (mode == PV_MAX)
+        + abs(net) * (mode == PV_CURTAIL)
+    )
+
+
+# 🔌 Bật/tắt inverter theo khung giờ xả, chạy trước cây quyết định
+# "inverter_off": tắt PV để xả BESS, bỏ qua phần còn lại của chu kỳ
+# "inverter_on": trả PV về tối đa, dừng BESS rồi vẫn chạy cây quyết định
+# Thiếu số đo solar (None) thì mọi so sánh với solar là sai, như NaN ở inverter_actions()
+def inverter_action(
+    within_timer, solar_power, bess_soc, inverter_enabled, params=DEFAULT_PARAMS
+):
+    solar_known = solar_power is not None
+    if within_timer and solar_known and solar_power > 0 and inverter_enabled:
+        return "inverter_off"
+    if not inverter_enabled and (
+        (not within_timer and solar_known and solar_power < INVERTER_ENABLE_SOLAR_MAX)
+        or bess_soc <= params["soc_min"]
+    ):
+        return "inverter_on"
+    return None
+
+
+# Đặc trưng nhị phân mà cây quyết định dùng, theo thứ tự của branch_features()
+BRANCH_FEATURES = (
+    "stable",
+    "importing",
+    "exporting",
+    "within_timer",
+    "bess_faults",
+    "soc_above_min",
+    "soc_at_min",
+    "bess_full",
+    "solar_low",
+    "solar_above_charge",
+    "solar_at_charge",
+    "solar_positive",
+    "solar_nonnegative",
+    "bess_charging",
+    "bess_discharging",
+    "bess_positive",
+)
+
+
+# Tính các đặc trưng từ số đo, dùng được cho cả số và mảng NumPy
+def branch_features(
+    grid_power,
+    bess_power,
+    bess_soc,
+    solar_power,
+    within_timer,
+    bess_faults,
+    params=DEFAULT_PARAMS,
+):
+    return (
+        (grid_power > params["band_low"]) & (grid_power < params["band_high"]),
+        grid_power > 0,
+        grid_power < 0,
+        within_timer,
+        bess_faults,
+        bess_soc > params["soc_min"],
+        bess_soc >= params["soc_min"],
+        bess_soc >= params["soc_full"],
+        solar_power <= DISCHARGE_SOLAR_MAX,
+        solar_power > CHARGE_SOLAR_MIN,
+        solar_power >= CHARGE_SOLAR_MIN,
+        solar_power > 0,
+        solar_power >= 0,
+        bess_power < BESS_CHARGING,
+        bess_power > BESS_DISCHARGING,
+        bess_power > 0,
+    )
+
+
+# Cây quyết định trên các đặc trưng
+def _branch_of(
+    stable,
+    importing,
+    exporting,
+    within_timer,
+    bess_faults,
+    soc_above_min,
+    soc_at_min,
+    bess_full,
+    solar_low,
+    solar_above_charge,
+    solar_at_charge,
+    solar_positive,
+    solar_nonnegative,
+    bess_charging,
+    bess_discharging,
+    bess_positive,
+):
+    if stable:
+        return "stable"
+
+    if importing:
+        if within_timer and soc_above_min and solar_low:
+            # trong giờ xả ít , tăng công suất xả, solar < 10
+            return "discharge_increase"
+        if (
+            bess_charging
+            and not bess_full
+            and solar_above_charge
+            and not within_timer
+            and not bess_faults
+        ):
+            # solar cấp ko đủ ,đang sạc bằng lưới -> giảm công suất
+            return "charge_decrease"
+        if not within_timer and bess_full:
+            # bess đầy, lấy lưới dùng -> tăng solar
+            return "bess_full_raise_pv"
+        if within_timer:
+            return "discharge_start"
+        if not bess_full and not bess_faults:
+            return "pv_max"
+        return "pv_increase"
+
+    if exporting:
+        if not bess_full and solar_nonnegative and not within_timer and not bess_faults:
+            # Solar dư đang dư
+            if bess_discharging:
+                return "standby"
+            if solar_at_charge:
+                return "charge_increase"
+            return "none"
+        if (bess_full and solar_positive) or bess_faults:
+            # bess đầy, giảm công suất inverter
+            return "pv_curtail"
+        if bess_positive and soc_at_min:
+            # bess đang xả, giảm công suất xả
+            return "discharge_decrease"
+        return "no_action"
+
+    return "none"
+
+
+# Chọn nhánh của cây quyết định cho một chu kỳ
+def choose_branch(
+    grid_power,
+    bess_power,
+    bess_soc,
+    solar_power,
+    within_timer,
+    bess_faults,
+    params=DEFAULT_PARAMS,
+):
+    return _branch_of(
+        *branch_features(
+            grid_power,
+            bess_power,
+            bess_soc,
+            solar_power,
+            within_timer,
+            bess_faults,
+            params,
+        )
+    )
+
+
+# Bảng mã nhánh theo mọi tổ hợp đặc trưng (bit i của khóa = đặc trưng thứ i), lập một lần
+@functools.lru_cache(maxsize=None)
+def branch_table():
+    table = np.empty(1 << len(BRANCH_FEATURES), dtype=np.uint8)
+    bits = range(len(BRANCH_FEATURES))
+    for key in range(len(table)):
+        features = [bool(key >> bit & 1) for bit in bits]
+        table[key] = BRANCH_CODES[_branch_of(*features)]
+    return table
+
+
+# Bản vector hóa của inverter_action(): mảng NumPy (hoặc số) cùng kích thước hoặc
+# broadcast được, trả về 2 mảng bool (tắt inverter, bật inverter)
+def inverter_actions(
+    within_timer, solar_power, bess_soc, inverter_enabled, params=DEFAULT_PARAMS
+):
+    within_timer = np.asarray(within_timer, dtype=bool)
+    inverter_enabled = np.asarray(inverter_enabled, dtype=bool)
+    turn_off = within_timer & (solar_power > 0) & inverter_enabled
+    turn_on = ~inverter_enabled & (
+        (~within_timer & (solar_power < INVERTER_ENABLE_SOLAR_MAX))
+        | (bess_soc <= params["soc_min"])
+    )
+    return turn_off, turn_on
+
+
+# Khóa tra branch_table() của từng phần tử: các đặc trưng ghép thành số 16 bit, chỉ gồm
+# phép so sánh và cộng, không có phép gán theo mặt nạ (np.where/np.select chậm với mặt nạ
+# ngẫu nhiên); số đo và giá trị trong params có thể là mảng NumPy
+def branch_keys(
+    grid_power,
+    bess_power,
+    bess_soc,
+    solar_power,
+    within_timer,
+    bess_faults,
+    params=DEFAULT_PARAMS,
+):
+    features = branch_features(
+        grid_power,
+        bess_power,
+        bess_soc,
+        solar_power,
+        within_timer,
+        bess_faults,
+        params,
+    )
+    key = np.zeros(
+        np.broadcast(grid_power, bess_power, bess_soc, solar_power).shape,
+        dtype=np.uint16,
+    )
+    for bit, feature in enumerate(features):
+        if np.ndim(feature):
+            key += np.multiply(feature, 1 << bit, dtype=np.uint16)
+        elif feature:
+            key += 1 << bit
+    return key
+
+
+# Bản vector hóa của choose_branch(): mỗi phần tử là một chu kỳ hoặc một bộ tham số,
+# trả về mảng mã nhánh (BRANCH_CODES)
+def choose_branches(
+    grid_power,
+    bess_power,
+    bess_soc,
+    solar_power,
+    within_timer,
+    bess_faults,
+    params=DEFAULT_PARAMS,
+):
+    return branch_table().take(
+        branch_keys(
+            grid_power,
+            bess_power,
+            bess_soc,
+            solar_power,
+            within_timer,
+            bess_faults,
+            params,
+        )
+    )